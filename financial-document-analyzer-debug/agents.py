@@ -4,24 +4,54 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-from crewai import Agent
+from crewai import Agent, LLM
 from langchain_openai import ChatOpenAI
-from tools import search_tool, FinancialDocumentTool
+from tools import search_tool, FinancialDocumentTool, DocumentSearchTool, FinancialMetricsTool
+from rate_limiter import llm_rate_limiter
+from llm_cache import llm_response_cache, prompt_text, LLM_CACHE_MODE
+from chunked_analysis import estimate_tokens
+
+
+class ManagedLLM(LLM):
+    """
+    Agent LLM behind the response cache (llm_cache.py): identical calls are
+    answered from the store, and only calls that reach the API wait for the
+    cluster-wide request/token quota (rate_limiter.py).
+    """
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        def live():
+            prompt_tokens = estimate_tokens(prompt_text(messages))
+            with llm_rate_limiter.call(self.model, prompt_tokens) as reservation:
+                response = super(ManagedLLM, self).call(messages, tools, callbacks, available_functions)
+                reservation.settle(prompt_tokens + estimate_tokens(str(response)))
+            return response
+
+        params = {"temperature": self.temperature, "top_p": self.top_p, "stop": self.stop,
+                  "max_tokens": self.max_tokens, "seed": self.seed, "tools": tools}
+        return llm_response_cache.complete(self.model, messages, params, live, react=True)
+
 
 ### Loading LLM
+## LangChain client for the chunked map-reduce mode; agents use the cached, rate-limited crewai LLM.
+## Offline modes (fake/replay) never reach the API, so they need no key.
+api_key = os.getenv("OPENAI_API_KEY") or ("offline" if LLM_CACHE_MODE in ("fake", "replay") else None)
 llm = ChatOpenAI(
     model=os.getenv("MODEL", "gpt-4o-mini"),
-    api_key=os.getenv("OPENAI_API_KEY")
+    api_key=api_key
+)
+agent_llm = ManagedLLM(
+    model=os.getenv("MODEL", "gpt-4o-mini"),
+    api_key=api_key
 )
 
 # Creating an Experienced Financial Analyst agent
 financial_analyst=Agent(
     role="Senior Financial Analyst",
     goal="""Provide accurate, evidence-based financial analysis of the document 
-    provided for the query: {query}. Extract key financial metrics, identify trends, 
+    provided. Extract key financial metrics, identify trends, 
     and provide data-driven insights grounded strictly in the document content.""",
     verbose=True,
-    memory=True,
     backstory=(
         "You are a CFA-certified Senior Financial Analyst with 15 years of experience "
         "analyzing Fortune 500 earnings reports, SEC filings, and investment prospectuses. "
@@ -30,10 +60,10 @@ financial_analyst=Agent(
         "from documents and never make claims that aren't supported by the data. "
         "You strictly follow financial regulations and compliance standards in all your analysis."
     ),
-    tools=[FinancialDocumentTool.read_data_tool],
-    llm=llm,
+    tools=[FinancialMetricsTool.extract_metrics_tool, DocumentSearchTool.search_document_tool,
+           FinancialDocumentTool.read_data_tool],
+    llm=agent_llm,
     max_iter=5,
-    max_rpm=10,
     allow_delegation=False  
 )
 
@@ -46,7 +76,6 @@ verifier = Agent(
         "tables, figures, and regulatory disclosures. Flag any anomalies or missing sections."
     ),
     verbose=True,
-    memory=True,
     backstory=(
         "You are a detail-oriented financial compliance specialist with a background in "
         "auditing and document verification at a Big 4 accounting firm. "
@@ -55,9 +84,8 @@ verifier = Agent(
         "You take regulatory accuracy seriously and never approve documents without "
         "thorough review."
     ),
-    llm=llm,
+    llm=agent_llm,
     max_iter=5,
-    max_rpm=10,
     allow_delegation=False
 )
 
@@ -79,9 +107,8 @@ investment_advisor = Agent(
         "risk tolerance, and prioritize long-term financial health over short-term gains. "
         "You have no undisclosed conflicts of interest."
     ),
-    llm=llm,
+    llm=agent_llm,
     max_iter=5,
-    max_rpm=10,
     allow_delegation=False
 )
 
@@ -103,8 +130,7 @@ risk_assessor = Agent(
         "and never overstate or understate risks. You believe proper risk management "
         "is the foundation of sound investing."
     ),
-    llm=llm,
+    llm=agent_llm,
     max_iter=5,
-    max_rpm=10,
     allow_delegation=False
 )
@@ -0,0 +1,179 @@
+## Batch manifests, aggregate progress and combined results for /analyze/batch
+import os
+import json
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+from result_store import result_store
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+## How long batch manifests and combined results are kept
+BATCH_TTL_SECONDS = int(os.getenv("BATCH_TTL_SECONDS", str(24 * 3600)))
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "200"))
+
+KEY_PREFIX = "batch:"
+
+## Progress credited to a document per Celery state (PROGRESS reports its own percentage)
+_STATE_PROGRESS = {"PENDING": 0, "STARTED": 5, "SUCCESS": 100, "FAILURE": 100, "REVOKED": 100}
+_STATE_STATUS = {"PENDING": "pending", "RETRY": "pending", "STARTED": "started", "PROGRESS": "processing",
+                 "SUCCESS": "completed", "FAILURE": "failed", "REVOKED": "failed"}
+
+
+class BatchStore:
+    """
+    Redis store of batch manifests: the shared query, every submitted document
+    (file name, hash, owning task id, in-batch duplicate) and, once the chord
+    callback has run, the combined result — kept for BATCH_TTL_SECONDS so it
+    outlives the per-task Celery results.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, ttl: int = BATCH_TTL_SECONDS):
+        self.ttl = ttl
+        self._redis_url = redis_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def save(self, batch_id: str, manifest: dict):
+        self.client.set(f"{KEY_PREFIX}{batch_id}", json.dumps(manifest), ex=self.ttl)
+
+    def get(self, batch_id: str):
+        raw = self.client.get(f"{KEY_PREFIX}{batch_id}")
+        return json.loads(raw) if raw else None
+
+    def save_result(self, batch_id: str, combined: dict):
+        self.client.set(f"{KEY_PREFIX}{batch_id}:result", json.dumps(combined), ex=self.ttl)
+
+    def get_result(self, batch_id: str):
+        raw = self.client.get(f"{KEY_PREFIX}{batch_id}:result")
+        return json.loads(raw) if raw else None
+
+
+def _task_states(task_ids: list) -> dict:
+    """
+    task id -> (celery state, info/result) of every distinct task, read in one
+    MGET from key-value result backends (one lookup per task on the others)
+    """
+    from celery_worker import celery_app
+
+    backend = celery_app.backend
+    task_ids = list(dict.fromkeys(task_ids))
+    if not task_ids:
+        return {}
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    try:
+        values = backend.mget(keys)
+    except (AttributeError, NotImplementedError):
+        metas = [backend.get_task_meta(task_id) for task_id in task_ids]
+    else:
+        ## Redis returns values in key order, memcached-style clients a mapping
+        if hasattr(values, "items"):
+            values = [values.get(key) for key in keys]
+        metas = [backend.decode_result(value) if value else {"status": "PENDING", "result": None}
+                 for value in values]
+    return {task_id: (meta["status"], meta.get("result")) for task_id, meta in zip(task_ids, metas)}
+
+
+def _document_status(state: str, info) -> str:
+    status = _STATE_STATUS.get(state, state.lower())
+    ## The task reports pipeline errors in its return value rather than raising
+    if state == "SUCCESS" and isinstance(info, dict) and info.get("status") != "success":
+        status = "failed"
+    return status
+
+
+def _document_progress(state: str, info) -> int:
+    if state == "PROGRESS" and isinstance(info, dict):
+        try:
+            return int(str(info.get("progress", "0")).rstrip("%"))
+        except ValueError:
+            return 0
+    return _STATE_PROGRESS.get(state, 0)
+
+
+def batch_progress(manifest: dict) -> dict:
+    """Per-document status and overall progress; duplicates mirror the document they repeat"""
+    documents = manifest["documents"]
+    states = _task_states([document["task_id"] for document in documents])
+    counts, rows, total_progress = {}, [], 0
+    for document in documents:
+        state, info = states[document["task_id"]]
+        status = _document_status(state, info)
+        progress = _document_progress(state, info)
+        counts[status] = counts.get(status, 0) + 1
+        total_progress += progress
+        rows.append({**document, "status": status, "progress": f"{progress}%"})
+
+    finished = counts.get("completed", 0) + counts.get("failed", 0)
+    return {
+        "batch_id": manifest["batch_id"],
+        "status": "completed" if finished == len(documents) else "processing",
+        "progress": f"{int(total_progress / len(documents)) if documents else 100}%",
+        "counts": counts,
+        "total_documents": len(documents),
+        "unique_documents": len({document["task_id"] for document in documents}),
+        "documents": rows,
+    }
+
+
+def combine_results(manifest: dict, results_by_task: dict = None) -> dict:
+    """
+    Merge the per-document task results into one batch result. `results_by_task`
+    supplies results already in hand (the chord header's); the rest are read
+    from the Celery backend.
+    """
+    results_by_task = dict(results_by_task or {})
+    documents = manifest["documents"]
+    missing = [document["task_id"] for document in documents if document["task_id"] not in results_by_task]
+    states = _task_states(missing)
+
+    rows, total_tokens, completed, failed = [], 0, 0, 0
+    for document in documents:
+        task_id = document["task_id"]
+        if task_id in results_by_task:
+            state, result = "SUCCESS", results_by_task[task_id]
+        else:
+            state, result = states[task_id]
+        if state == "SUCCESS":
+            result = result_store.load(result)
+        status = _document_status(state, result)
+        row = {**document, "status": status}
+        if status == "completed":
+            completed += 1
+            row["analysis"] = result.get("analysis")
+            row["elapsed_seconds"] = result.get("elapsed_seconds")
+            row["token_usage"] = result.get("token_usage", {})
+            ## Duplicates share their original's tokens, so count each task once
+            if document.get("duplicate_of") is None:
+                total_tokens += row["token_usage"].get("total_tokens", 0)
+        elif status == "failed":
+            failed += 1
+            row["error"] = result.get("error") if isinstance(result, dict) else str(result)
+        rows.append(row)
+
+    return {
+        "batch_id": manifest["batch_id"],
+        "query": manifest["query"],
+        "complete": completed + failed == len(documents),
+        "summary": {
+            "total_documents": len(documents),
+            "unique_documents": len({document["task_id"] for document in documents}),
+            "completed": completed,
+            "failed": failed,
+            "total_tokens": total_tokens,
+            "created_at": manifest.get("created_at"),
+            "combined_at": time.time(),
+        },
+        "documents": rows,
+    }
+
+
+## Process-wide batch store used by the API and the chord callback
+batch_store = BatchStore()
@@ -0,0 +1 @@
+## Standalone performance benchmarks — run from the project dir, e.g. `python -m benchmarks.bench_normalizer`
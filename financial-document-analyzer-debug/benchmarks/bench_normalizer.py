@@ -0,0 +1,103 @@
+"""
+Micro-benchmark: text normalization throughput (MB/s), legacy loops vs text_normalizer.
+
+    python -m benchmarks.bench_normalizer --sizes 1 5 10 50 --legacy-max-mb 1
+
+The legacy double-space loop is quadratic, so it is only run up to
+`--legacy-max-mb`; larger sizes report the new engine alone.
+"""
+import argparse
+import random
+import time
+
+from text_normalizer import normalize_pages, normalize_text
+
+PAGE_TEMPLATE = """ACME Holdings Inc.  Quarterly  Update
+
+
+Total  revenues   were  ${rev:,}  million,  up  {growth}%  year-over-year,  driven  by  strong
+auto-  motive  deliveries  and  energy  storage  deploy-
+ments.    Operating   margin   was   {margin}%.
+
+
+  Net  income   attributable   to   common   stockholders   was   ${ni:,}  million.
+Free  cash  flow  of   ${fcf:,}  million   reflects   higher   capital   expenditures.
+
+
+
+Q1-2025    Q2-2025    Q3-2025    Q4-2025
+{rev:,}     {rev2:,}     {rev3:,}     {rev4:,}
+
+Page {page} of 400
+"""
+
+
+## Legacy implementations copied from tools.py before the normalization engine
+def legacy_read_data(pages):
+    full_report = ""
+    for content in pages:
+        while "\n\n" in content:
+            content = content.replace("\n\n", "\n")
+        full_report += content + "\n"
+    return full_report
+
+
+def legacy_collapse_spaces(processed_data):
+    i = 0
+    while i < len(processed_data):
+        if processed_data[i:i+2] == "  ":
+            processed_data = processed_data[:i] + processed_data[i+1:]
+        else:
+            i += 1
+    return processed_data
+
+
+def synthetic_pages(size_mb: float, seed: int = 7):
+    """Generate pages of filing-like text until the target size is reached"""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    pages, total, page_number = [], 0, 1
+    while total < target:
+        rev = rng.randint(15_000, 30_000)
+        page = PAGE_TEMPLATE.format(
+            rev=rev, rev2=rev + 211, rev3=rev + 422, rev4=rev + 633,
+            growth=rng.randint(-20, 40), margin=rng.randint(2, 20),
+            ni=rng.randint(500, 3_000), fcf=rng.randint(100, 2_000), page=page_number,
+        ) * 6
+        pages.append(page)
+        total += len(page)
+        page_number += 1
+    return pages, total
+
+
+def measure(fn, arg, size_bytes: int) -> float:
+    start = time.perf_counter()
+    fn(arg)
+    elapsed = time.perf_counter() - start
+    return (size_bytes / (1024 * 1024)) / elapsed if elapsed else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 5, 10, 50], help="input sizes in MB")
+    parser.add_argument("--legacy-max-mb", type=float, default=1.0, help="largest size to run the quadratic legacy code on")
+    args = parser.parse_args()
+
+    header = f"{'size MB':>8} | {'legacy read MB/s':>16} | {'new read MB/s':>13} | {'legacy spaces MB/s':>18} | {'new spaces MB/s':>15}"
+    print(header)
+    print("-" * len(header))
+    for size_mb in args.sizes:
+        pages, size_bytes = synthetic_pages(size_mb)
+        text = "".join(pages)
+
+        run_legacy = size_mb <= args.legacy_max_mb
+        legacy_read = f"{measure(legacy_read_data, pages, size_bytes):16.1f}" if run_legacy else f"{'skipped':>16}"
+        legacy_spaces = f"{measure(legacy_collapse_spaces, text, size_bytes):18.3f}" if run_legacy else f"{'skipped':>18}"
+        new_read = measure(normalize_pages, pages, size_bytes)
+        new_spaces = measure(normalize_text, text, size_bytes)
+
+        print(f"{size_mb:8.1f} | {legacy_read} | {new_read:13.1f} | {legacy_spaces} | {new_spaces:15.1f}")
+
+
+if __name__ == "__main__":
+    main()
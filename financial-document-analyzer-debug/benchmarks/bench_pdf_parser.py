@@ -0,0 +1,64 @@
+"""
+Benchmark: PDF parsing throughput (pages/s) by page count and parser process count.
+
+    python -m benchmarks.bench_pdf_parser --pages 50 200 400 --workers 1 2 4
+
+Synthetic PDFs are generated in a temporary directory. Each pool is warmed
+up before timing, so the numbers exclude one-off process start-up. The
+`PyPDFLoader` column is the serial loader the tools used before.
+"""
+import os
+import argparse
+import tempfile
+import time
+
+from pdf_parser import ParallelPdfParser
+from benchmarks.synthetic_pdf import write_synthetic_pdf
+
+
+def legacy_parse(path: str) -> list:
+    from langchain_community.document_loaders import PyPDFLoader
+    return [doc.page_content for doc in PyPDFLoader(file_path=path).load()]
+
+
+def pages_per_second(fn, path: str, pages: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - start)
+    return pages / best if best else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 400], help="page counts to test")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}),
+                        help="parser process counts to test")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is reported)")
+    parser.add_argument("--skip-legacy", action="store_true", help="do not time PyPDFLoader")
+    args = parser.parse_args()
+
+    print(f"cores: {os.cpu_count()}")
+    header = f"{'pages':>6} | {'PyPDFLoader p/s':>15} | " + " | ".join(f"{f'{w} worker(s) p/s':>16}" for w in args.workers)
+    print(header)
+    print("-" * len(header))
+
+    parsers = {workers: ParallelPdfParser(workers=workers, min_pages=0) for workers in args.workers}
+    with tempfile.TemporaryDirectory() as directory:
+        warmup = write_synthetic_pdf(os.path.join(directory, "warmup.pdf"), 8)
+        for pdf_parser in parsers.values():
+            pdf_parser.parse(warmup)
+
+        for pages in args.pages:
+            path = write_synthetic_pdf(os.path.join(directory, f"doc-{pages}.pdf"), pages)
+            legacy = f"{'skipped':>15}" if args.skip_legacy else f"{pages_per_second(legacy_parse, path, pages, args.repeat):15.1f}"
+            cells = [f"{pages_per_second(parsers[w].parse, path, pages, args.repeat):16.1f}" for w in args.workers]
+            print(f"{pages:6d} | {legacy} | " + " | ".join(cells))
+
+    for pdf_parser in parsers.values():
+        pdf_parser.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+End-to-end benchmark: FastAPI -> Celery -> crew on synthetic filings, with the
+fake LLM and an in-memory broker, so runs need no API key, network or Redis.
+
+    python -m benchmarks.bench_pipeline --pages 10 100 500 --jobs 4 --concurrency 2
+    python -m benchmarks.bench_pipeline --save-baseline       ## record benchmarks/baselines/pipeline.json
+    python -m benchmarks.bench_pipeline --baseline            ## compare, exit 1 on regression
+
+Each scenario (pages x mode x jobs x concurrency) runs in a fresh process, so
+import time and peak RSS belong to that scenario alone. Inside it, a Celery
+worker (thread pool, `memory://` broker) consumes the priority queues while
+jobs are submitted through POST /analyze/async and polled on /result, as a
+client would. Every job uploads its own filing (distinct seed), so nothing is
+served from the coalescer or the stage cache.
+
+App state that normally lives in Redis (coalescing, stage cache, tenant slots,
+queue metrics samples) goes to an in-process fakeredis server
+(`pip install "fakeredis[lua]"`), or to a real Redis with `--redis-url`.
+
+Reported per scenario: import and warm-up time, submit latency, end-to-end
+p50/p95, mean time per stage (from the stage timestamps the task reports),
+throughput, peak RSS of the process and the fake LLM's token counts.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+
+from benchmarks.synthetic_pdf import write_synthetic_pdf
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "pipeline.json")
+POLL_SECONDS = 0.05
+QUERY = "Analyze this financial document for investment insights"
+
+## Metrics compared against the baseline: name -> (kind, higher is better)
+COMPARED = {
+    "e2e_p50_seconds": ("time", False),
+    "e2e_p95_seconds": ("time", False),
+    "docs_per_minute": ("time", True),
+    "peak_rss_mb": ("rss", False),
+    "prompt_tokens": ("tokens", False),
+    "completion_tokens": ("tokens", False),
+}
+## Differences below these floors are noise whatever the ratio (seconds, MB, tokens)
+ABSOLUTE_SLACK = {"time": 0.05, "rss": 10, "tokens": 50}
+
+
+def scenario_name(pages: int, mode: str, jobs: int, concurrency: int) -> str:
+    return f"{pages}p-{mode}-{jobs}j-c{concurrency}"
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _use_fakeredis():
+    """Point every redis client the app creates at one in-process fakeredis server"""
+    import redis
+    import fakeredis
+
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeRedis(server=server, **kwargs)
+
+    redis.Redis.from_url = staticmethod(from_url)
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_scenario(pages: int, mode: str, jobs: int, concurrency: int, tenants: int, table_every: int,
+                 redis_url: str = None, verbose: bool = False) -> dict:
+    """Runs in a spawned child process; returns the scenario's measurements"""
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    os.environ.update({
+        "LLM_CACHE_MODE": "fake",
+        "LLM_RATE_LIMIT_BACKEND": "local",
+        "DOC_CACHE_DIR": os.path.join(workdir, "cache"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "RESULT_BLOB_DIR": os.path.join(workdir, "results"),
+        "SYNC_START_METHOD": "spawn",
+        ## crewai's telemetry export would add network round trips to every run
+        "CREWAI_DISABLE_TELEMETRY": "true",
+    })
+    if not verbose:
+        ## Agents are verbose; keep their transcripts out of the report
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.dup2(devnull, sys.stderr.fileno())
+    if redis_url:
+        os.environ["REDIS_URL"] = redis_url
+    else:
+        _use_fakeredis()
+
+    inputs = [
+        write_synthetic_pdf(os.path.join(workdir, f"filing-{job}.pdf"), pages, seed=1000 + job, table_every=table_every)
+        for job in range(jobs)
+    ]
+
+    started = time.perf_counter()
+    from fastapi.testclient import TestClient
+    from celery.contrib.testing.worker import start_worker
+    import main
+    from celery_worker import celery_app
+    from scheduling import PRIORITY_QUEUES
+    from pipeline import crew_pool
+    from llm_cache import llm_response_cache
+    import_seconds = time.perf_counter() - started
+
+    ## The memory transport polls its queues; the default 1 s interval would dominate short jobs
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://",
+                           broker_transport_options={"polling_interval": 0.01})
+    started = time.perf_counter()
+    crew_pool.warm()
+    warm_seconds = time.perf_counter() - started
+
+    client = TestClient(main.app)
+    submit_seconds, e2e_seconds, stage_seconds, results = [], [], {}, []
+
+    def run_job(job: int) -> dict:
+        submitted = time.perf_counter()
+        with open(inputs[job], "rb") as f:
+            response = client.post(
+                "/analyze/async",
+                files={"file": (os.path.basename(inputs[job]), f, "application/pdf")},
+                data={"query": QUERY, "execution_mode": mode, "tenant": f"bench-{job % tenants}"},
+            )
+        if response.status_code >= 400:
+            raise RuntimeError(f"POST /analyze/async returned {response.status_code}: {response.text}")
+        submit_seconds.append(time.perf_counter() - submitted)
+        task_id = response.json()["task_id"]
+        while True:
+            body = client.get(f"/result/{task_id}").json()
+            if body["status"] in ("completed", "failed"):
+                break
+            time.sleep(POLL_SECONDS)
+        e2e_seconds.append(time.perf_counter() - submitted)
+        return body.get("result") or {"status": "failed", "error": body.get("error")}
+
+    with start_worker(celery_app, pool="threads", concurrency=concurrency, perform_ping_check=False,
+                      queues=list(PRIORITY_QUEUES.values()), shutdown_timeout=30):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=jobs) as submitters:
+            results = list(submitters.map(run_job, range(jobs)))
+        wall_seconds = time.perf_counter() - started
+
+    failures = [result.get("error") for result in results if result.get("status") != "success"]
+    for result in results:
+        previous = 0.0
+        for stage in result.get("stages", []):
+            stage_seconds.setdefault(stage["stage"], []).append(stage["elapsed_seconds"] - previous)
+            previous = stage["elapsed_seconds"]
+    cache = llm_response_cache.stats()
+
+    return {
+        "pages": pages,
+        "mode": sorted({result.get("execution_mode", mode) for result in results}),
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "failures": failures,
+        "import_seconds": round(import_seconds, 2),
+        "warm_seconds": round(warm_seconds, 2),
+        "submit_p50_seconds": round(statistics.median(submit_seconds), 3),
+        "e2e_p50_seconds": round(percentile(e2e_seconds, 0.5), 3),
+        "e2e_p95_seconds": round(percentile(e2e_seconds, 0.95), 3),
+        "task_mean_seconds": round(statistics.mean(result.get("elapsed_seconds", 0) for result in results), 3),
+        "stage_mean_seconds": {stage: round(statistics.mean(values), 3) for stage, values in stage_seconds.items()},
+        "docs_per_minute": round(jobs * 60 / wall_seconds, 2),
+        "pages_per_second": round(jobs * pages / wall_seconds, 1),
+        "peak_rss_mb": _peak_rss_mb(),
+        "llm_calls": cache["fake_calls"],
+        "prompt_tokens": cache["fake_prompt_tokens"],
+        "completion_tokens": cache["fake_completion_tokens"],
+    }
+
+
+def compare(name: str, current: dict, baseline: dict, tolerances: dict) -> list:
+    """Regressions of `current` against `baseline`, as readable lines"""
+    regressions = []
+    for metric, (kind, higher_is_better) in COMPARED.items():
+        if metric not in baseline or metric not in current:
+            continue
+        old, new = baseline[metric], current[metric]
+        worse = old - new if higher_is_better else new - old
+        if worse > max(abs(old) * tolerances[kind], ABSOLUTE_SLACK[kind]):
+            regressions.append(f"{name}: {metric} {old} -> {new} (tolerance {tolerances[kind]:.0%})")
+    return regressions
+
+
+def print_report(name: str, result: dict):
+    stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["stage_mean_seconds"].items())
+    print(f"\n== {name} (ran as {'/'.join(result['mode'])})")
+    print(f"  import {result['import_seconds']}s, crew warm-up {result['warm_seconds']}s, "
+          f"submit p50 {result['submit_p50_seconds'] * 1000:.0f} ms")
+    print(f"  end-to-end p50 {result['e2e_p50_seconds']}s, p95 {result['e2e_p95_seconds']}s "
+          f"(task itself {result['task_mean_seconds']}s on average)")
+    print(f"  stages (mean): {stages or 'none reported'}")
+    print(f"  throughput {result['docs_per_minute']} docs/min, {result['pages_per_second']} pages/s")
+    print(f"  peak RSS {result['peak_rss_mb']} MB")
+    print(f"  fake LLM: {result['llm_calls']} calls, {result['prompt_tokens']} prompt + "
+          f"{result['completion_tokens']} completion tokens")
+    if result["failures"]:
+        print(f"  FAILED jobs: {len(result['failures'])}: {result['failures'][0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 500], help="filing sizes to test")
+    parser.add_argument("--modes", nargs="+", default=["sequential"], help="execution modes to test")
+    parser.add_argument("--jobs", type=int, default=4, help="documents submitted per scenario")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[2], help="worker thread counts to test")
+    parser.add_argument("--tenants", type=int, default=1, help="tenants the jobs are spread over (tenant caps apply)")
+    parser.add_argument("--table-every", type=int, default=5, help="put a financial table on every n-th page")
+    parser.add_argument("--verbose", action="store_true", help="show the agents' output and worker logs")
+    parser.add_argument("--redis-url", help="use this Redis for app state instead of an in-process fakeredis")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH, help="write the results as the baseline")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_PATH, help="compare with a baseline, exit 1 on regression")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="allowed slowdown of latency/throughput")
+    parser.add_argument("--rss-tolerance", type=float, default=0.15, help="allowed growth of peak RSS")
+    parser.add_argument("--token-tolerance", type=float, default=0.05, help="allowed growth of token counts")
+    args = parser.parse_args()
+
+    if not args.redis_url:
+        try:
+            import fakeredis
+        except ImportError:
+            parser.error('fakeredis is not installed: pip install "fakeredis[lua]", or pass --redis-url')
+
+    print(f"cores: {os.cpu_count()}, python {platform.python_version()}")
+    results = {}
+    ## One process per scenario: fresh imports, fresh caches and a peak RSS of its own
+    context = multiprocessing.get_context("spawn")
+    for pages in args.pages:
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                name = scenario_name(pages, mode, args.jobs, concurrency)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    results[name] = pool.submit(run_scenario, pages, mode, args.jobs, concurrency,
+                                                args.tenants, args.table_every, args.redis_url, args.verbose).result()
+                print_report(name, results[name])
+
+    failed = any(result["failures"] for result in results.values())
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump({"machine": {"cores": os.cpu_count(), "platform": platform.platform(),
+                                   "python": platform.python_version()},
+                       "scenarios": results}, f, indent=2)
+        print(f"\nbaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+        tolerances = {"time": args.time_tolerance, "rss": args.rss_tolerance, "tokens": args.token_tolerance}
+        regressions = [line for name, result in results.items() if name in baseline
+                       for line in compare(name, result, baseline[name], tolerances)]
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}")
+        for line in regressions:
+            print(f"  {line}")
+        failed = failed or bool(regressions)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
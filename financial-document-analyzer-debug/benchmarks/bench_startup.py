@@ -0,0 +1,106 @@
+"""
+API cold start: import-time profile of `main` and time until uvicorn serves GET /.
+
+    python -m benchmarks.bench_startup --runs 5 --max-seconds 3
+
+The profile runs `python -X importtime -c "import main"` in a fresh interpreter
+and lists the slowest modules by cumulative import time. It also fails the run
+if the crew stack (crewai, LangChain, LiteLLM, the agents) was imported, since
+the API only enqueues jobs and reads results. The latency test starts uvicorn
+in a fresh process and polls GET / until it answers; it exits 1 above
+`--max-seconds`.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+## Packages only workers and sync job processes may load
+CREW_STACK = ("crewai", "crewai_tools", "langchain", "langchain_openai", "langchain_community", "litellm",
+              "embedchain", "agents", "task", "pipeline", "tools", "tiktoken")
+
+
+def import_profile(module: str = "main") -> list:
+    """(cumulative seconds, module) of every import, slowest first"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative) / 1e6, name.rstrip()))
+    return sorted(rows, reverse=True)
+
+
+def loaded_crew_modules(module: str = "main") -> list:
+    script = (f"import sys, json, {module}; "
+              f"print(json.dumps(sorted({{m.split('.')[0] for m in sys.modules}} & set({list(CREW_STACK)!r}))))")
+    result = subprocess.run([sys.executable, "-c", script], cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_response(timeout: float = 60) -> float:
+    """Seconds from launching uvicorn until GET / returns 200"""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                              cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"API did not answer within {timeout}s")
+    finally:
+        ## The whole group: the sync executor's fork server would keep importing into the next run
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="cold starts to time (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--max-seconds", type=float, default=0, help="fail when the median start exceeds this (0 = off)")
+    args = parser.parse_args()
+
+    profile = import_profile()
+    total = next(seconds for seconds, name in profile if name.strip() == "main")
+    print(f"import main: {total * 1000:.0f} ms")
+    for seconds, name in profile[:args.top]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    crew_modules = loaded_crew_modules()
+    print(f"crew stack modules loaded by the API: {', '.join(crew_modules) or 'none'}")
+
+    starts = [time_to_first_response() for _ in range(args.runs)]
+    median = statistics.median(starts)
+    print(f"time to first response: median {median:.2f}s over {args.runs} run(s) "
+          f"(min {min(starts):.2f}s, max {max(starts):.2f}s)")
+
+    failed = bool(crew_modules) or bool(args.max_seconds and median > args.max_seconds)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
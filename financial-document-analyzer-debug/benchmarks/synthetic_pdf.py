@@ -0,0 +1,122 @@
+"""
+Minimal synthetic PDF writer for benchmarks: one Helvetica text block per page,
+optionally with a quarterly financial table every few pages, no external
+dependencies.
+
+    python -m benchmarks.synthetic_pdf out.pdf --pages 400 --table-every 5
+"""
+import argparse
+import random
+
+LINE_TEMPLATES = [
+    "Total revenues were ${rev:,} million, up {growth}% year-over-year.",
+    "Operating margin was {margin}% and gross margin was {gross}%.",
+    "Net income attributable to common stockholders was ${ni:,} million.",
+    "Free cash flow of ${fcf:,} million reflects higher capital expenditures.",
+    "Competition, supply chain disruption and regulatory changes may affect results.",
+    "Cash, cash equivalents and investments were ${cash:,} million at quarter end.",
+]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_lines(page_number: int, rng: random.Random, lines: int = 40) -> list:
+    values = dict(
+        rev=rng.randint(15_000, 30_000), growth=rng.randint(-20, 40), margin=rng.randint(2, 20),
+        gross=rng.randint(15, 30), ni=rng.randint(500, 3_000), fcf=rng.randint(100, 2_000),
+        cash=rng.randint(20_000, 40_000),
+    )
+    body = [LINE_TEMPLATES[index % len(LINE_TEMPLATES)].format(**values) for index in range(lines)]
+    return ["ACME Holdings Inc. Quarterly Update", *body, f"Page {page_number}"]
+
+
+## Line items of the synthetic financial summary; labels match financial_tables.METRIC_PATTERNS
+TABLE_ROWS = [
+    ("Total revenues", 18_000, 30_000),
+    ("Gross profit", 3_000, 6_000),
+    ("Income from operations", 500, 3_000),
+    ("Net income attributable to common stockholders", 400, 2_500),
+    ("EPS attributable to common stockholders, diluted", 0.1, 0.9),
+    ("Net cash provided by operating activities", 1_000, 5_000),
+    ("Capital expenditures", -3_000, -1_500),
+    ("Free cash flow", 100, 2_500),
+    ("Total cash, cash equivalents and investments", 20_000, 40_000),
+]
+
+
+def _cell(value) -> str:
+    text = f"{abs(value):.2f}" if isinstance(value, float) else f"{abs(value):,}"
+    return f"({text})" if value < 0 else text
+
+
+def table_lines(rng: random.Random, year: int = 2024, quarters: int = 5) -> list:
+    """A period-columned "F I N A N C I A L   S U M M A R Y" block like the ones in quarterly updates"""
+    periods = [f"Q{(quarter % 4) + 1}-{year + quarter // 4}" for quarter in range(quarters)]
+    lines = ["F I N A N C I A L S U M M A R Y (Unaudited)", "($ in millions) " + " ".join(periods)]
+    for label, low, high in TABLE_ROWS:
+        if isinstance(low, float):
+            values = [round(rng.uniform(low, high), 2) for _ in periods]
+        else:
+            values = [rng.randint(low, high) for _ in periods]
+        lines.append(f"{label} " + " ".join(_cell(value) for value in values))
+    return lines
+
+
+def build_pdf(pages: list) -> bytes:
+    """Serialize pages (each a list of text lines) into a valid PDF document"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = " T* ".join(f"({_escape(line)}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td {text} ET".encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def write_synthetic_pdf(path: str, pages: int, seed: int = 7, lines_per_page: int = 40, table_every: int = 0) -> str:
+    """Write a `pages`-page filing; with `table_every`, every n-th page also carries a financial table"""
+    rng = random.Random(seed)
+    content = []
+    for number in range(1, pages + 1):
+        if table_every and number % table_every == 0:
+            table = table_lines(rng)
+            content.append(page_lines(number, rng, max(0, lines_per_page - len(table)))[:-1] + table + [f"Page {number}"])
+        else:
+            content.append(page_lines(number, rng, lines_per_page))
+    with open(path, "wb") as f:
+        f.write(build_pdf(content))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--table-every", type=int, default=0, help="put a financial table on every n-th page")
+    args = parser.parse_args()
+    write_synthetic_pdf(args.path, args.pages, table_every=args.table_every)
+
+
+if __name__ == "__main__":
+    main()
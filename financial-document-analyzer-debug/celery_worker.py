@@ -1,8 +1,20 @@
 from celery import Celery
+from kombu import Queue
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, task_prerun, task_postrun, before_task_publish
+from celery.utils.log import get_logger
 import os
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
+from scheduling import (PRIORITY_QUEUES, DEFAULT_PRIORITY, DEFAULT_TENANT, TENANT_DEFER_SECONDS,
+                        priority_for_queue, tenant_slots)
+from result_store import result_store, RESULT_TTL_SECONDS
+from tracing import setup_tracing, flush_tracing, open_span, close_span, set_attributes, inject_context, extract_context
+from opentelemetry.trace import SpanKind
+
+logger = get_logger(__name__)
+
 ##initialize celery app with Redis as broker 
 celery_app = Celery(
     "financial_analyzer",
@@ -18,62 +30,239 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
     task_track_started=True,         
-    result_expires=3600,               
+    ## Only a pointer to the compressed result lives here (see result_store.py); both share the retention
+    result_expires=RESULT_TTL_SECONDS,
     worker_prefetch_multiplier=1,      
     task_acks_late=True, 
+    ## One queue per priority class, declared interactive first; "priority" ordering makes
+    ## workers drain the interactive queue before taking anything from the bulk one
+    task_queues=[Queue(name, routing_key=name) for name in PRIORITY_QUEUES.values()],
+    task_default_queue=PRIORITY_QUEUES[DEFAULT_PRIORITY],
+    broker_transport_options={"queue_order_strategy": "priority"},
 )
 
+
+## Pre-warming: the crew stack (crewai, LLM clients, agent/task templates) is imported once in
+## the parent before the pool forks, and each pool process builds its own ready crew clones.
+## Jobs then only check out a clone (see crew_pool.py). Failures are logged and left to the
+## first job, which imports lazily and reports the error in its result.
+@worker_init.connect
+def _import_crew_stack(**kwargs):
+    ## The span processor restarts its export thread in each forked pool process
+    setup_tracing("worker")
+    try:
+        import pipeline
+    except Exception:
+        logger.exception("Could not pre-import the crew pipeline")
+
+
+@worker_process_init.connect
+def _warm_crew_pool(**kwargs):
+    try:
+        from pipeline import crew_pool
+        crew_pool.warm()
+    except Exception:
+        logger.exception("Could not pre-warm the crew pool")
+
+
+@worker_process_shutdown.connect
+def _shutdown_pdf_parser(**kwargs):
+    ## Each worker process owns a PDF parser pool (PDF_PARSE_WORKERS); stop it with the process
+    from pdf_parser import pdf_parser
+    pdf_parser.shutdown()
+    flush_tracing()
+
+
+## Task timing for queue metrics: the publish time travels in the message headers (and is
+## carried over when a job is deferred), workers record queue wait and runtime once the job
+## has actually run (see queue_metrics.py)
+_task_started_at = {}
+## The publisher's trace context travels in the headers too; each run is a span in that trace
+_task_spans = {}
+TRACE_HEADERS = ("traceparent", "tracestate")
+
+
+def _header(request, name: str):
+    return getattr(request, name, None) or (getattr(request, "headers", None) or {}).get(name)
+
+
+def _enqueued_at(request):
+    return _header(request, "enqueued_at")
+
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+        inject_context(headers)
+
+
+@task_prerun.connect
+def _record_start_time(task_id=None, task=None, **kwargs):
+    _task_started_at[task_id] = time.time()
+    request = task.request
+    queue = (request.delivery_info or {}).get("routing_key")
+    enqueued_at = _enqueued_at(request)
+    carrier = {name: _header(request, name) for name in TRACE_HEADERS if _header(request, name)}
+    _task_spans[task_id] = open_span(f"celery.run {task.name}", context=extract_context(carrier),
+                                     kind=SpanKind.CONSUMER, attributes={
+                                         "celery.task_id": task_id,
+                                         "celery.retries": request.retries or 0,
+                                         "messaging.destination.name": queue or "",
+                                         "job.priority": priority_for_queue(queue) or "",
+                                     })
+    if enqueued_at:
+        set_attributes({"job.queue_wait_seconds": round(time.time() - enqueued_at, 3)})
+
+
+@task_postrun.connect
+def _end_task_span(task_id=None, state=None, retval=None, **kwargs):
+    opened = _task_spans.pop(task_id, None)
+    if opened is None:
+        return
+    set_attributes({"celery.state": state}, opened[0])
+    error = None
+    if state == "FAILURE":
+        error = str(retval)
+    elif isinstance(retval, dict) and retval.get("status") == "failed":
+        error = str(retval.get("error"))
+    close_span(opened, error)
+
+
+@task_postrun.connect
+def _record_timings(task_id=None, task=None, state=None, **kwargs):
+    from queue_metrics import record_sample, WAIT_SAMPLES_KEY, RUNTIME_SAMPLES_KEY
+    started_at = _task_started_at.pop(task_id, None)
+    ## A deferred attempt has not really started; its wait counts towards the attempt that runs
+    if not started_at or state == "RETRY":
+        return
+    now = time.time()
+    request = task.request
+    queue = (request.delivery_info or {}).get("routing_key")
+    labels = {"task": task.name, "queue": queue, "priority": priority_for_queue(queue)}
+    enqueued_at = _enqueued_at(request)
+    if enqueued_at:
+        record_sample(WAIT_SAMPLES_KEY, {"t": started_at, "v": round(started_at - enqueued_at, 3), **labels})
+    record_sample(RUNTIME_SAMPLES_KEY, {"t": now, "v": round(now - started_at, 3), "state": state, **labels})
+
+
 @celery_app.task(bind=True, name="analyze_document_task")
-def analyze_document_task(self, query: str, file_path: str):
+def analyze_document_task(self, query: str, file_path: str, file_hash: str = None, execution_mode: str = None,
+                          keep_file: bool = False, tenant: str = DEFAULT_TENANT, priority: str = DEFAULT_PRIORITY,
+                          document_id: str = None):
     """
     Celery task to run the CrewAI financial analysis pipeline.
+    `file_hash` is the SHA-256 computed while the upload was streamed to disk;
+    `execution_mode` is "sequential", "parallel" or "chunked" (see pipeline.EXECUTION_MODES).
+    `keep_file` leaves server-side batch inputs in place instead of deleting the upload.
+    `tenant` and `priority` select the concurrency cap the job counts against (see scheduling.py).
+    `document_id` names the logical document this file is a version of, so only
+    what changed since the tenant's previous version is re-analyzed.
     """
+    from doc_cache import document_cache
+    from coalescing import job_coalescer, coalesce_key
+    from task_events import publish_task_event
+    from llm_cache import llm_response_cache
+    from execution_modes import DEFAULT_EXECUTION_MODE
+
+    ## Captured once: self.request is thread-local, and parallel mode reports stages from pool threads
+    task_id = self.request.id
+    set_attributes({"job.tenant": tenant})
+    ## Tenant at its cap: put the job back on its queue so this worker serves other tenants
+    if not tenant_slots.acquire(priority, tenant, task_id):
+        set_attributes({"job.deferred": True})
+        raise self.retry(countdown=TENANT_DEFER_SECONDS, max_retries=None,
+                         headers={"enqueued_at": _enqueued_at(self.request) or time.time()})
+
+    ## Keyed exactly as the API claimed it: the submitted mode (resolution below is deterministic
+    ## for a given file and requested mode), tenant, priority and document id
+    dedupe_key = (coalesce_key(file_hash, query, execution_mode or DEFAULT_EXECUTION_MODE, tenant, priority,
+                               document_id)
+                  if file_hash else None)
+    succeeded = False
+
+    def report(state, meta, **event_fields):
+        ## Store the state for pollers and push it (plus any extra fields) to streaming clients
+        self.update_state(task_id=task_id, state=state, meta=meta)
+        publish_task_event(task_id, state, **meta, **event_fields)
+
     try:
         ## Update task state to show it has started
-        self.update_state(
-            state="STARTED",
-            meta={"status": "Analysis started", "progress": "0%"}
-        )
+        report("STARTED", {"status": "Analysis started", "progress": "0%"})
         
+        if file_hash:
+            document_cache.register_file(file_path, file_hash)
+
         ## Import here to avoid circular imports
-        from crewai import Crew, Process
-        from agents import financial_analyst, verifier, investment_advisor, risk_assessor
-        from task import verification, analyze_financial_document, investment_analysis, risk_assessment
+        from pipeline import run_pipeline, resolve_execution_mode, terminal_stages, STAGES
+
+        ## Oversized documents are switched to the chunked map-reduce mode
+        execution_mode, pages = resolve_execution_mode(file_path, execution_mode or DEFAULT_EXECUTION_MODE)
+        set_attributes({"job.execution_mode": execution_mode, "document.bytes": os.path.getsize(file_path),
+                        "document.pages": len(pages) if pages is not None else None})
+        completed_stages = []
+        stage_outputs = {}
+        usage = {}
+        started = time.perf_counter()
+
+        def report_stage(stage, output, cached):
+            ## Progress advances per finished (or cache-reused) crew stage
+            if stage in STAGES:
+                stage_outputs[stage] = output
+            completed_stages.append({
+                "stage": stage,
+                "cached": cached,
+                "elapsed_seconds": round(time.perf_counter() - started, 2)
+            })
+            ## The stage's output is pushed to streaming clients only, keeping the stored state small
+            report(
+                "PROGRESS",
+                {
+                    "status": f"Finished {stage.replace('_', ' ')}" + (" (cached)" if cached else ""),
+                    "progress": f"{int(80 * len(completed_stages) / len(STAGES)) + 10}%",
+                    "stages": completed_stages,
+                },
+                stage=stage, cached=cached, output=output,
+            )
 
         ## Update progress
-        self.update_state(
-            state="PROGRESS",
-            meta={"status": "Running document verification", "progress": "25%"}
-        )
-
-        ## Build and run the crew
-        financial_crew = Crew(
-            agents=[verifier, financial_analyst, investment_advisor, risk_assessor],
-            tasks=[verification, analyze_financial_document, investment_analysis, risk_assessment],
-            process=Process.sequential,
-        )
-
-        self.update_state(
-            state="PROGRESS",
-            meta={"status": "Running financial analysis", "progress": "50%"}
-        )
-
-        result = financial_crew.kickoff({
-            "query": query,
-            "file_path": file_path
-        })
+        report("PROGRESS", {"status": "Running analysis pipeline", "progress": "10%"})
 
-        self.update_state(
-            state="PROGRESS",
-            meta={"status": "Finalizing results", "progress": "90%"}
-        )
+        result = run_pipeline(query=query, file_path=file_path, file_hash=file_hash, on_stage=report_stage,
+                              execution_mode=execution_mode, usage=usage, pages=pages,
+                              document_id=document_id, tenant=tenant)
 
-        return {
+        report("PROGRESS", {"status": "Finalizing results", "progress": "90%"})
+        set_attributes({"job.stages_cached": sum(1 for stage in completed_stages if stage["cached"]),
+                        **{f"llm.usage.{name}": value for name, value in usage.items()}})
+
+        task_result = {
             "status": "success",
             "query": query,
-            "analysis": str(result),
-            "file_processed": os.path.basename(file_path)
+            "document_id": document_id,
+            "analysis": result,
+            "file_processed": os.path.basename(file_path),
+            "stages": completed_stages,
+            "execution_mode": execution_mode,
+            "elapsed_seconds": round(time.perf_counter() - started, 2),
+            "token_usage": usage,
+            "document_cache": document_cache.stats(),
+            "llm_cache": llm_response_cache.stats()
         }
+        ## Stage texts are kept for versioned documents only, without the terminal stages the
+        ## analysis is already made of
+        if document_id:
+            terminal = terminal_stages()
+            task_result["stage_outputs"] = {stage: output for stage, output in stage_outputs.items()
+                                         if stage not in terminal}
+
+        ## The backend keeps a pointer; the full result is stored compressed, in Redis or as a blob
+        stored = result_store.save(task_id, task_result)
+        reference = stored["stored_result"]
+        set_attributes({"result.bytes": reference["bytes"], "result.stored_bytes": reference["stored_bytes"],
+                        "result.location": reference["location"]})
+        succeeded = True
+        return stored
 
     except Exception as e:
         ## Return failure info
@@ -85,9 +274,55 @@ def analyze_document_task(self, query: str, file_path: str):
         }
 
     finally:
+        tenant_slots.release(priority, tenant, task_id)
+
+        ## Keep the coalescing entry for the reuse window on success, drop it on failure
+        if dedupe_key:
+            try:
+                if succeeded:
+                    job_coalescer.mark_completed(dedupe_key, task_id)
+                else:
+                    job_coalescer.release(dedupe_key, task_id)
+            except Exception:
+                pass
+
         ## Clean up uploaded file after processing
-        if os.path.exists(file_path) and "sample" not in file_path:
+        document_cache.forget_file(file_path)
+        if not keep_file and os.path.exists(file_path) and "sample" not in file_path:
             try:
                 os.remove(file_path)
             except:
-                pass
\ No newline at end of file
+                pass
+
+
+@task_postrun.connect(sender=analyze_document_task)
+def _publish_final_state(task_id=None, state=None, retval=None, **kwargs):
+    ## Runs after the result is stored, so a client reconnecting on this event finds it in the backend
+    from task_events import publish_task_event, result_reference
+    if state == "SUCCESS":
+        publish_task_event(task_id, state, **result_reference(task_id, retval))
+    elif state == "RETRY":
+        publish_task_event(task_id, state, status="Waiting for a free slot for this tenant")
+    else:
+        publish_task_event(task_id, state or "FAILURE", error=str(retval))
+
+
+@celery_app.task(name="summarize_batch_task")
+def summarize_batch_task(results: list, batch_id: str):
+    """
+    Chord callback of /analyze/batch: runs once every queued document has
+    finished and stores the combined batch result, which outlives the
+    individual task results.
+    """
+    from batches import batch_store, combine_results
+
+    manifest = batch_store.get(batch_id)
+    if manifest is None:
+        return {"batch_id": batch_id, "status": "expired"}
+    combined = combine_results(manifest, dict(zip(manifest["queued_task_ids"], results)))
+    ## Documents coalesced onto tasks outside the chord may still be running; their batch
+    ## result is combined on request until they finish, never frozen half-done
+    if not combined["complete"]:
+        return {"batch_id": batch_id, "status": "pending", "summary": combined["summary"]}
+    batch_store.save_result(batch_id, combined)
+    return {"batch_id": batch_id, "status": "completed", "summary": combined["summary"]}
@@ -0,0 +1,247 @@
+## Map-reduce analysis for documents that exceed the model context
+import os
+import hashlib
+import threading
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+from text_normalizer import find_headings
+from rate_limiter import llm_rate_limiter
+from llm_cache import llm_response_cache
+from tracing import start_span, in_current_context
+
+## Token budget of the document text in one map call, and how many map calls run at once
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "6000"))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+## Sections whose hash falls on an anchor also close the current chunk once it is half full, so chunk
+## boundaries follow the content and an edit only changes the chunks around it (0 disables)
+CHUNK_ANCHOR_EVERY = int(os.getenv("CHUNK_ANCHOR_EVERY", "4"))
+## Token budget of partial results fed into one reduce call
+REDUCE_TOKENS = int(os.getenv("REDUCE_TOKENS", "12000"))
+MODEL = os.getenv("MODEL", "gpt-4o-mini")
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  ## tiktoken missing or its encoding files unavailable offline
+    _ENCODING = None
+
+
+MAP_PROMPT = """You are a Senior Financial Analyst reading one excerpt (pages {first_page}-{last_page}) of a larger financial document.
+Extract ONLY what this excerpt states — never infer or invent figures:
+1. Document identity clues (company, document type, reporting period)
+2. Key financial metrics with their periods (revenue, net income, EPS, margins, cash flow, debt)
+3. Growth rates, trends and management guidance
+4. Risk factors, litigation, regulatory or liquidity concerns
+Cite page numbers for every figure. Reply "No material content" if the excerpt has none.
+
+Excerpt:
+{text}"""
+
+COMBINE_PROMPT = """Merge the following partial extractions from consecutive parts of one financial document
+into a single extraction. Keep every figure with its page citation, remove duplicates,
+and do not add anything that is not in the partials.
+
+{partials}"""
+
+REDUCE_PROMPT = """You are a team of a financial document verifier, a Senior Financial Analyst, a Certified
+Investment Advisor and a Risk Assessment Specialist. Using ONLY the page-cited extractions
+below, write the final report for the user's query: {query}
+
+The report must contain:
+## Verification — document type, company, period, VERIFIED / NOT VERIFIED with reasoning
+## Financial Analysis — key metrics table, YoY/QoQ growth, trends, guidance, data gaps
+## Investment Analysis — stance, positives, concerns, recommendations per investor profile, disclaimers
+## Risk Assessment — overall rating (Low/Medium/High/Critical), risks by category, top 3 risks
+Cite page numbers for every figure. Never fabricate data.
+
+Extractions:
+{partials}"""
+
+## Map outputs do not depend on the query, so they are cacheable per document
+MAP_FINGERPRINT = hashlib.sha256(MAP_PROMPT.encode("utf-8")).hexdigest()
+
+
+class Chunk(NamedTuple):
+    index: int
+    first_page: int
+    last_page: int
+    text: str
+    tokens: int
+
+
+def estimate_tokens(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _sections(page_text: str):
+    """Split a page at its headings so chunks break on section boundaries"""
+    starts, _ = find_headings(page_text)
+    bounds = [0] + [start for start in starts if start > 0] + [len(page_text)]
+    for start, end in zip(bounds, bounds[1:]):
+        section = page_text[start:end].strip()
+        if section:
+            yield section
+
+
+def _split_oversized(section: str, max_tokens: int):
+    """Fallback for a single section larger than the budget: split on line boundaries"""
+    lines, size = [], 0
+    for line in section.split("\n"):
+        line_tokens = estimate_tokens(line) + 1
+        if line_tokens > max_tokens:
+            ## A single huge line (e.g. a flattened table): cut it proportionally
+            if lines:
+                yield "\n".join(lines)
+                lines, size = [], 0
+            step = max(1, len(line) * max_tokens // line_tokens)
+            for start in range(0, len(line), step):
+                yield line[start:start + step]
+            continue
+        if lines and size + line_tokens > max_tokens:
+            yield "\n".join(lines)
+            lines, size = [], 0
+        lines.append(line)
+        size += line_tokens
+    if lines:
+        yield "\n".join(lines)
+
+
+def _is_anchor(section: str, every: int = CHUNK_ANCHOR_EVERY) -> bool:
+    return every > 0 and int(hashlib.sha256(section.encode("utf-8")).hexdigest()[:8], 16) % every == 0
+
+
+def chunk_document(pages: list, max_tokens: int = CHUNK_TOKENS) -> list:
+    """
+    Pack sections of the (normalized) pages into chunks of at most `max_tokens`,
+    keeping whole sections together wherever they fit. Each chunk records its
+    page range and carries "[page N]" markers so map outputs can cite pages.
+
+    Anchor sections (see CHUNK_ANCHOR_EVERY) start a new chunk once the current
+    one is half full: two versions of a document then chunk identically away
+    from their differences, and unchanged chunks hit the map output cache.
+    """
+    chunks = []
+    parts, size, first_page, last_page = [], 0, None, None
+
+    def flush():
+        nonlocal parts, size, first_page, last_page
+        if parts:
+            chunks.append(Chunk(len(chunks), first_page, last_page, "\n".join(parts), size))
+        parts, size, first_page, last_page = [], 0, None, None
+
+    for page_number, page_text in enumerate(pages, start=1):
+        for section in _sections(page_text):
+            tokens = estimate_tokens(section)
+            pieces = [(section, tokens)] if tokens <= max_tokens else [
+                (piece, estimate_tokens(piece)) for piece in _split_oversized(section, max_tokens)
+            ]
+            for piece, piece_tokens in pieces:
+                if parts and (size + piece_tokens > max_tokens or (size >= max_tokens // 2 and _is_anchor(piece))):
+                    flush()
+                if last_page != page_number:
+                    piece = f"[page {page_number}]\n{piece}"
+                first_page = page_number if first_page is None else first_page
+                last_page = page_number
+                parts.append(piece)
+                size += piece_tokens
+    flush()
+    return chunks
+
+
+_usage_lock = threading.Lock()
+
+
+def call_llm(llm, prompt: str, usage: dict = None) -> str:
+    """
+    Invoke the LangChain chat model through the response cache and accumulate
+    the token usage of calls that reached the API like crew usage metrics.
+    """
+    model = getattr(llm, "model_name", MODEL)
+
+    def live():
+        prompt_tokens = estimate_tokens(prompt)
+        with llm_rate_limiter.call(model, prompt_tokens) as reservation:
+            response = llm.invoke(prompt)
+            metadata = getattr(response, "usage_metadata", None) or {}
+            reservation.settle(metadata.get("total_tokens") or prompt_tokens + estimate_tokens(response.content))
+        if usage is not None:
+            with _usage_lock:
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + metadata.get("input_tokens", 0)
+                usage["completion_tokens"] = usage.get("completion_tokens", 0) + metadata.get("output_tokens", 0)
+                usage["total_tokens"] = usage.get("total_tokens", 0) + metadata.get("total_tokens", 0)
+                usage["successful_requests"] = usage.get("successful_requests", 0) + 1
+        return response.content
+
+    params = {"temperature": getattr(llm, "temperature", None), "max_tokens": getattr(llm, "max_tokens", None)}
+    return llm_response_cache.complete(model, prompt, params, live)
+
+
+def _reduce_groups(partials: list, max_tokens: int) -> list:
+    """Group partial results so each group fits in one combine call"""
+    groups, group, size = [], [], 0
+    for partial in partials:
+        tokens = estimate_tokens(partial)
+        if group and size + tokens > max_tokens:
+            groups.append(group)
+            group, size = [], 0
+        group.append(partial)
+        size += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def map_reduce_analysis(query: str, pages: list, llm, max_workers: int = CHUNK_CONCURRENCY,
+                        chunk_tokens: int = CHUNK_TOKENS, reduce_tokens: int = REDUCE_TOKENS,
+                        cache_get=None, cache_put=None, on_progress=None, usage: dict = None) -> str:
+    """
+    Analyze a document of any size with token use proportional to its length:
+
+    - map: every chunk is extracted independently, at most `max_workers` at a time
+      (`cache_get(chunk)` / `cache_put(chunk, output)` can serve and store map outputs);
+    - combine: partial extractions are merged in groups until they fit `reduce_tokens`;
+    - reduce: one final call writes the report for the query.
+    """
+    chunks = chunk_document(pages, chunk_tokens)
+    if not chunks:
+        return "No readable text found in document"
+
+    def extract(chunk: Chunk) -> str:
+        cached = cache_get(chunk) if cache_get else None
+        if cached is not None:
+            return cached
+        output = call_llm(llm, MAP_PROMPT.format(first_page=chunk.first_page, last_page=chunk.last_page,
+                                                  text=chunk.text), usage)
+        if cache_put:
+            cache_put(chunk, output)
+        return output
+
+    with start_span("chunked.map", {"chunked.chunks": len(chunks)}), \
+            ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="chunk-map") as pool:
+        partials = [
+            f"### Pages {chunk.first_page}-{chunk.last_page}\n{output}"
+            for chunk, output in zip(chunks, pool.map(in_current_context(extract), chunks))
+        ]
+    if on_progress:
+        on_progress("chunk_map", f"{len(chunks)} chunks extracted", False)
+
+    with start_span("chunked.reduce", {"chunked.partials": len(partials)}):
+        ## Hierarchical combine keeps every call within budget however large the document
+        while sum(estimate_tokens(partial) for partial in partials) > reduce_tokens and len(partials) > 1:
+            groups = _reduce_groups(partials, reduce_tokens)
+            if len(groups) == len(partials):
+                break
+            with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="chunk-combine") as pool:
+                partials = list(pool.map(in_current_context(
+                    lambda group: call_llm(llm, COMBINE_PROMPT.format(partials="\n\n".join(group)), usage)
+                ), groups))
+
+        report = call_llm(llm, REDUCE_PROMPT.format(query=query, partials="\n\n".join(partials)), usage)
+    if on_progress:
+        on_progress("chunk_reduce", report, False)
+    return report
@@ -0,0 +1,91 @@
+## Redis-backed coalescing of duplicate analysis submissions
+import os
+import hashlib
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+MODEL = os.getenv("MODEL", "gpt-4o-mini")
+
+## How long a completed job's result is reused for identical submissions
+COALESCE_TTL_SECONDS = int(os.getenv("COALESCE_TTL_SECONDS", "900"))
+## Safety expiry for in-flight claims, in case a worker dies without releasing one
+COALESCE_INFLIGHT_TTL_SECONDS = int(os.getenv("COALESCE_INFLIGHT_TTL_SECONDS", str(6 * 3600)))
+
+KEY_PREFIX = "coalesce:"
+
+## Compare-and-set scripts so a task only touches a key it still owns
+_EXPIRE_IF_OWNER = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end
+return 0
+"""
+_DELETE_IF_OWNER = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+
+
+def normalize_query(query: str) -> str:
+    """Queries that differ only in case or whitespace are the same job"""
+    return " ".join((query or "").lower().split())
+
+
+def coalesce_key(file_hash: str, query: str, execution_mode: str, tenant: str, priority: str,
+                  document_id: str = None, model: str = MODEL) -> str:
+    ## The mode is part of the job: a sequential run must not be answered with a chunked map-reduce.
+    ## So are tenant and priority: results never cross tenants, and an interactive job is never
+    ## parked behind a bulk one. So is the document id, whose version history only the job records
+    identity = "\x00".join((file_hash, normalize_query(query), execution_mode, tenant, priority,
+                             document_id or "", model))
+    return KEY_PREFIX + hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+class JobCoalescer:
+    """
+    Maps (document hash, normalized query, execution mode, tenant, priority, document id,
+    model) to the task that owns it.
+
+    The key holds the task id while the job is queued/running (long safety TTL)
+    and for COALESCE_TTL_SECONDS after it succeeds, so identical submissions in
+    that window reuse the same task across all API replicas.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, ttl: int = COALESCE_TTL_SECONDS,
+                 inflight_ttl: int = COALESCE_INFLIGHT_TTL_SECONDS):
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self._redis_url = redis_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def claim(self, key: str, task_id: str):
+        """
+        Atomically claim `key` for `task_id`.
+        Returns None when claimed, or the task id that already owns the key.
+        """
+        if self.client.set(key, task_id, nx=True, ex=self.inflight_ttl):
+            return None
+        existing = self.client.get(key)
+        if existing is None:
+            ## Owner released or expired between SET and GET — try once more
+            return None if self.client.set(key, task_id, nx=True, ex=self.inflight_ttl) else self.client.get(key)
+        return existing
+
+    def mark_completed(self, key: str, task_id: str):
+        """Keep the mapping for the reuse window only; no-op if another task owns the key"""
+        self.client.eval(_EXPIRE_IF_OWNER, 1, key, task_id, self.ttl)
+
+    def release(self, key: str, task_id: str):
+        """Drop the mapping (failed or never-enqueued job) if `task_id` still owns it"""
+        self.client.eval(_DELETE_IF_OWNER, 1, key, task_id)
+
+
+## Process-wide coalescer used by the API and the worker
+job_coalescer = JobCoalescer()
@@ -0,0 +1,65 @@
+## Pre-warmed crews: the template is built once per process, every job gets its own clone
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+## Ready clones kept per process; each is handed to exactly one job and then dropped
+CREW_POOL_SIZE = int(os.getenv("CREW_POOL_SIZE", "2"))
+
+
+class CrewPool:
+    """
+    Holds a template crew (agents with their LLM clients and tools, tasks with
+    their context links), built once per process, and a few ready clones of it.
+
+    A job checks out a clone for its exclusive use and the clone is discarded
+    afterwards, so task outputs, callbacks and agent state never cross jobs.
+    The pool is topped up by a background thread once a job checks out a
+    clone, so copying never runs on a request path that found a clone ready.
+    """
+
+    def __init__(self, factory, size: int = CREW_POOL_SIZE):
+        self._factory = factory
+        self.size = max(0, size)
+        self._template = None
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._refilling = threading.Lock()
+
+    @property
+    def template(self):
+        with self._lock:
+            if self._template is None:
+                self._template = self._factory()
+            return self._template
+
+    def warm(self):
+        """Build the template and fill the pool; called at worker process start"""
+        template = self.template
+        while len(self._ready) < self.size:
+            self._ready.append(template.copy())
+
+    def refill(self):
+        """Top the pool up in a daemon thread; at most one refill runs at a time"""
+        if self.size == 0 or not self._refilling.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.warm()
+            finally:
+                self._refilling.release()
+
+        threading.Thread(target=run, name="crew-pool-refill", daemon=True).start()
+
+    @contextmanager
+    def checkout(self):
+        try:
+            crew = self._ready.popleft()
+        except IndexError:
+            crew = self.template.copy()
+        self.refill()
+        yield crew
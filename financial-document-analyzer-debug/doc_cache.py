@@ -0,0 +1,167 @@
+## Parsed-document cache shared by the PDF tools and the Celery workers
+import os
+import sys
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+load_dotenv()
+
+## Bump whenever the parsing/cleanup output changes so stale entries are ignored
+PARSER_VERSION = "pypdf-parallel-1"
+
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", "data/.doc_cache")
+DOC_CACHE_MEMORY_BYTES = int(os.getenv("DOC_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file in fixed-size chunks so large PDFs are never fully loaded"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParsedDocumentCache:
+    """
+    Two-tier cache of parsed PDF pages keyed by (file SHA-256, parser version).
+
+    - Memory tier: per-process LRU bounded by the total size of the cached pages.
+    - Disk tier: one gzip-compressed JSON file per document under `cache_dir`,
+      shared by every process (API and Celery workers) on the same volume.
+    """
+
+    def __init__(self, cache_dir: str = DOC_CACHE_DIR, max_memory_bytes: int = DOC_CACHE_MEMORY_BYTES,
+                 parser_version: str = PARSER_VERSION):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.parser_version = parser_version
+        self._entries = OrderedDict()   ## key -> (pages, size_bytes)
+        self._known_hashes = {}         ## path -> file hash computed at upload time
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_writes": 0,
+            "disk_errors": 0,
+        }
+
+    def key(self, file_hash: str) -> str:
+        return hashlib.sha256(f"{file_hash}:{self.parser_version}".encode()).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _remember(self, key: str, pages: list):
+        """Insert into the memory tier, evicting least recently used entries"""
+        ## Sized by the page strings actually held, not by their (several times smaller) gzip payload
+        size_bytes = sum(sys.getsizeof(page) for page in pages)
+        if size_bytes > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._memory_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (pages, size_bytes)
+            self._memory_bytes += size_bytes
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self._counters["evictions"] += 1
+
+    def get(self, file_hash: str):
+        """Return the cached pages for a document hash, or None on a miss"""
+        key = self.key(file_hash)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry[0]
+
+        disk_path = self._disk_path(key)
+        try:
+            with open(disk_path, "rb") as f:
+                payload = f.read()
+            pages = json.loads(gzip.decompress(payload))
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except Exception:
+            ## Corrupt or partially written entry — treat as a miss
+            self._count("disk_errors")
+            self._count("misses")
+            return None
+
+        self._count("disk_hits")
+        self._remember(key, pages)
+        return pages
+
+    def put(self, file_hash: str, pages: list):
+        """Store parsed pages in both tiers"""
+        key = self.key(file_hash)
+        payload = gzip.compress(json.dumps(pages).encode("utf-8"), compresslevel=6)
+        self._remember(key, pages)
+
+        disk_path = self._disk_path(key)
+        tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            ## Atomic rename so concurrent workers never read a half-written file
+            os.replace(tmp_path, disk_path)
+            self._count("disk_writes")
+        except OSError:
+            self._count("disk_errors")
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def register_file(self, path: str, file_hash: str):
+        """Record a hash computed during upload so the file is never re-read just to hash it"""
+        with self._lock:
+            self._known_hashes[os.path.abspath(path)] = file_hash
+
+    def forget_file(self, path: str):
+        with self._lock:
+            self._known_hashes.pop(os.path.abspath(path), None)
+
+    def file_hash(self, path: str) -> str:
+        with self._lock:
+            known = self._known_hashes.get(os.path.abspath(path))
+        return known or file_sha256(path)
+
+    def get_or_parse(self, path: str, parse, file_hash: str = None) -> list:
+        """Return cached pages for `path`, running `parse(path)` only on a miss"""
+        file_hash = file_hash or self.file_hash(path)
+        pages = self.get(file_hash)
+        if pages is None:
+            pages = parse(path)
+            self.put(file_hash, pages)
+        return pages
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._entries)
+            stats["memory_bytes"] = self._memory_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+## Process-wide cache instance used by the tools
+document_cache = ParsedDocumentCache()
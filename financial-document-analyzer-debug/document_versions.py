@@ -0,0 +1,138 @@
+## Versions of logical documents (amended or corrected filings): section fingerprints and diffs
+import os
+import re
+import json
+import time
+import difflib
+import hashlib
+from typing import NamedTuple
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+from text_normalizer import find_headings, iter_normalized_pages
+from doc_cache import document_cache
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+## How long the latest version of a logical document is remembered; previous stage outputs
+## are only reusable while the stage cache still has them, so both default to a week
+DOCUMENT_VERSION_TTL_SECONDS = int(os.getenv("DOCUMENT_VERSION_TTL_SECONDS",
+                                             os.getenv("STAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))))
+
+## Client-chosen name of a logical document, e.g. "TSLA-10Q-2025Q2"
+DOCUMENT_ID_PATTERN = re.compile(r"[A-Za-z0-9_.:/-]{1,128}")
+
+KEY_PREFIX = "docver:"
+
+
+class Section(NamedTuple):
+    page: int
+    title: str
+    text: str
+    fingerprint: str
+
+
+class VersionDiff(NamedTuple):
+    ## (previous sections, new sections) of every region that differs; one side is empty for
+    ## removed or added sections. Previous sections are [fingerprint, page, title, chars] rows.
+    regions: list
+    changed_chars: int
+    total_chars: int
+
+    @property
+    def ratio(self) -> float:
+        return self.changed_chars / max(1, self.total_chars)
+
+
+def _fingerprint(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()[:32]
+
+
+def document_sections(pages) -> list:
+    """
+    Split normalized pages into sections at their headings. A page's text
+    before its first heading continues the previous page's section title.
+    """
+    sections, title = [], ""
+    for page_number, page_text in enumerate(pages, start=1):
+        starts, titles = find_headings(page_text)
+        title_at = dict(zip(starts, titles))
+        bounds = [0] + [start for start in starts if start > 0] + [len(page_text)]
+        for start, end in zip(bounds, bounds[1:]):
+            title = title_at.get(start, title)
+            text = page_text[start:end].strip()
+            if text:
+                sections.append(Section(page_number, title, text, _fingerprint(text)))
+    return sections
+
+
+def diff_versions(previous: list, sections: list) -> VersionDiff:
+    """
+    Align the previous version's section rows with the new sections by
+    fingerprint, so moved pages or inserted sections do not mark the rest
+    of the document as changed.
+    """
+    matcher = difflib.SequenceMatcher(None, [row[0] for row in previous],
+                                      [section.fingerprint for section in sections], autojunk=False)
+    regions, changed_chars = [], 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        old, new = previous[i1:i2], sections[j1:j2]
+        regions.append((old, new))
+        changed_chars += max(sum(row[3] for row in old), sum(len(section.text) for section in new))
+    return VersionDiff(regions, changed_chars, sum(len(section.text) for section in sections))
+
+
+def section_texts(file_hash: str) -> dict:
+    """Fingerprint -> text of a version's sections, from the parsed-document cache ({} once evicted)"""
+    pages = document_cache.get(file_hash)
+    if pages is None:
+        return {}
+    return {section.fingerprint: section.text for section in document_sections(iter_normalized_pages(pages))}
+
+
+class DocumentVersionStore:
+    """
+    Redis record of the latest analyzed version of each logical document per
+    tenant: its file hash and one [fingerprint, page, title, chars] row per
+    section. Lookups and writes never raise; without Redis every version is
+    simply analyzed in full.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, ttl: int = DOCUMENT_VERSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._redis_url = redis_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def key(self, tenant: str, document_id: str) -> str:
+        return f"{KEY_PREFIX}{tenant}:{document_id}"
+
+    def latest(self, tenant: str, document_id: str):
+        try:
+            raw = self.client.get(self.key(tenant, document_id))
+        except redis.RedisError:
+            return None
+        return json.loads(raw) if raw else None
+
+    def record(self, tenant: str, document_id: str, file_hash: str, sections: list):
+        version = {
+            "file_hash": file_hash,
+            "sections": [[section.fingerprint, section.page, section.title, len(section.text)] for section in sections],
+            "recorded_at": time.time(),
+        }
+        try:
+            self.client.set(self.key(tenant, document_id), json.dumps(version), ex=self.ttl)
+        except redis.RedisError:
+            pass
+
+
+## Process-wide version store used by the pipeline
+document_versions = DocumentVersionStore()
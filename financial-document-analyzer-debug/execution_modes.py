@@ -0,0 +1,11 @@
+## Execution modes of the analysis pipeline, importable without the crew stack (the API validates
+## requests with them; pipeline.py implements them)
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+## "sequential" runs stages one after another (Process.sequential);
+## "parallel" runs independent stages of the context DAG concurrently;
+## "chunked" replaces the crew with a map-reduce over document chunks
+EXECUTION_MODES = ("sequential", "parallel", "chunked")
+DEFAULT_EXECUTION_MODE = os.getenv("EXECUTION_MODE", "sequential")
@@ -0,0 +1,224 @@
+## Table extraction and deterministic metric computation over normalized page text
+import os
+import re
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+## How many of the most recent periods the compact metrics table shows
+FINANCIAL_METRICS_MAX_PERIODS = int(os.getenv("FINANCIAL_METRICS_MAX_PERIODS", "6"))
+
+## Column headers: "Q2-2025", "Q2 25", "2Q25", "FY2024", "2024"
+_QUARTER = re.compile(r"^(?:Q([1-4])[-'\s]?((?:19|20)?\d{2})|([1-4])Q[-'\s]?((?:19|20)?\d{2}))$", re.IGNORECASE)
+_YEAR = re.compile(r"^(?:FY|CY)?[-'\s]?((?:19|20)\d{2})$", re.IGNORECASE)
+## Cell values: "1,234", "(56.7)", "-12%", "$0.33", "—"
+_NUMBER = re.compile(r"^\(?[-–]?\$?\d[\d,]*(?:\.\d+)?\)?%?$")
+_MISSING = {"—", "–", "-", "n/a", "N/A", "NM", "nm"}
+
+## Canonical metric -> label patterns (matched against the lower-cased row label)
+METRIC_PATTERNS = {
+    "revenue": r"^(?:total )?(?:net )?(?:revenues?|sales)$",
+    "gross_profit": r"^(?:total )?gross profit$",
+    "operating_income": r"^(?:operating income|income from operations|income \(loss\) from operations)(?: \(loss\))?$",
+    "net_income": r"^net income(?: \(loss\))?(?: attributable to common stockholders)?$",
+    "eps_diluted": r"(?:eps|earnings per share).*diluted|diluted.*(?:eps|earnings per share)",
+    "operating_cash_flow": r"^(?:net cash provided by (?:\(used in\) )?operating activities|operating cash flows?)$",
+    "capital_expenditures": r"^capital expenditures$",
+    "free_cash_flow": r"^free cash flow$",
+    "cash_and_investments": r"^(?:total )?cash(?:, cash equivalents)?(?: and| &) (?:cash equivalents|investments)(?: and investments)?$",
+}
+_METRIC_REGEXES = {metric: re.compile(pattern) for metric, pattern in METRIC_PATTERNS.items()}
+
+## Metrics that are flows/levels (growth rates apply) as opposed to ratios
+GROWTH_METRICS = ["revenue", "gross_profit", "operating_income", "net_income", "eps_diluted",
+                  "operating_cash_flow", "free_cash_flow"]
+
+
+class FinancialTable(NamedTuple):
+    page: int
+    title: str
+    frame: pd.DataFrame   ## rows: line-item labels, columns: period labels
+
+
+def period_key(label: str):
+    """(year, quarter) for a period header, quarter 0 for fiscal years; None if not a period"""
+    match = _QUARTER.match(label)
+    if match:
+        quarter, year = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+        year = int(year)
+        return (year + 2000 if year < 100 else year, int(quarter))
+    match = _YEAR.match(label)
+    if match:
+        return (int(match.group(1)), 0)
+    return None
+
+
+def _period_label(key) -> str:
+    year, quarter = key
+    return f"Q{quarter}-{year}" if quarter else f"FY{year}"
+
+
+def parse_number(token: str) -> float:
+    if token in _MISSING:
+        return np.nan
+    negative = token.startswith("(") or token.lstrip("($").startswith(("-", "–"))
+    value = float(token.strip("()$%").lstrip("-–$").replace(",", ""))
+    return -value if negative else value
+
+
+def _header_periods(line: str):
+    """Period keys of a header line, or None when the line is not a column header"""
+    tokens = line.replace("Q ", "Q").split()
+    ## Joined two-token periods such as "Q2 2025"
+    keys, skip = [], False
+    for position, token in enumerate(tokens):
+        if skip:
+            skip = False
+            continue
+        key = period_key(token)
+        if key is None and position + 1 < len(tokens):
+            key = period_key(f"{token} {tokens[position + 1]}")
+            skip = key is not None
+        if key is not None:
+            keys.append(key)
+        elif _NUMBER.match(token):
+            ## A plain numeric cell means this is a data row, not a header
+            return None
+    return keys if len(keys) >= 2 and len(set(keys)) == len(keys) else None
+
+
+def _data_row(line: str):
+    """(label, values) for "Label 1,234 (56) 7%" lines, else None"""
+    tokens = line.split()
+    split = len(tokens)
+    while split > 0 and (tokens[split - 1] in _MISSING or _NUMBER.match(tokens[split - 1])):
+        split -= 1
+    label = " ".join(tokens[:split]).rstrip(":")
+    values = tokens[split:]
+    if len(values) < 2 or not any(char.isalpha() for char in label):
+        return None
+    return label, values
+
+
+def extract_tables(pages: list) -> list:
+    """
+    Detect period-columned tables in normalized page text.
+
+    A table starts at a header line with two or more period labels and takes
+    every following "label value value ..." line; it ends at the next header or
+    after two consecutive non-row lines. Trailing extra cells (e.g. a YoY %
+    column) are dropped so values align with the period headers.
+    """
+    tables = []
+    for page_number, page_text in enumerate(pages, start=1):
+        lines = page_text.split("\n")
+        position = 0
+        while position < len(lines):
+            periods = _header_periods(lines[position])
+            if periods is None:
+                position += 1
+                continue
+            title = lines[position - 1] if position and _data_row(lines[position - 1]) is None else ""
+            rows, labels, misses = [], [], 0
+            position += 1
+            while position < len(lines) and misses < 2:
+                if _header_periods(lines[position]) is not None:
+                    break
+                row = _data_row(lines[position])
+                if row is None or len(row[1]) < len(periods):
+                    misses += 1
+                else:
+                    misses = 0
+                    labels.append(row[0])
+                    rows.append([parse_number(value) for value in row[1][:len(periods)]])
+                position += 1
+            if rows:
+                frame = pd.DataFrame(rows, index=labels, columns=[_period_label(key) for key in periods])
+                tables.append(FinancialTable(page_number, title, frame[~frame.index.duplicated()]))
+    return tables
+
+
+def standard_metrics(tables: list):
+    """
+    Collect canonical metrics across tables into one frame (metrics x periods,
+    chronological) and the source page of each metric. The first table that
+    reports a metric wins, later tables only fill periods it lacks.
+    """
+    series, sources = {}, {}
+    for table in tables:
+        ## "(GAAP)" qualifies the standard figure; non-GAAP rows keep their label and do not match
+        labels = table.frame.index.str.lower().str.replace(r"\s*\(gaap\)$", "", regex=True)
+        for metric, regex in _METRIC_REGEXES.items():
+            matches = labels.str.contains(regex)
+            if not matches.any():
+                continue
+            row = table.frame[matches].iloc[0]
+            series[metric] = row if metric not in series else series[metric].combine_first(row)
+            sources.setdefault(metric, table.page)
+
+    if not series:
+        return pd.DataFrame(), sources
+    frame = pd.DataFrame(series).T
+    columns = sorted(frame.columns, key=period_key)
+    frame = frame[columns]
+
+    ## Derived metrics as whole-row vector operations
+    if "free_cash_flow" not in frame.index and {"operating_cash_flow", "capital_expenditures"} <= set(frame.index):
+        frame.loc["free_cash_flow"] = frame.loc["operating_cash_flow"] - frame.loc["capital_expenditures"].abs()
+    if "revenue" in frame.index:
+        revenue = frame.loc["revenue"].where(frame.loc["revenue"] != 0)
+        for metric, margin in (("gross_profit", "gross_margin_pct"), ("operating_income", "operating_margin_pct"),
+                               ("net_income", "net_margin_pct"), ("free_cash_flow", "fcf_margin_pct")):
+            if metric in frame.index:
+                frame.loc[margin] = frame.loc[metric] / revenue * 100
+    return frame, sources
+
+
+def _previous(key, lag: str):
+    year, quarter = key
+    if lag == "yoy":
+        return (year - 1, quarter)
+    if quarter == 0:
+        return None
+    return (year - 1, 4) if quarter == 1 else (year, quarter - 1)
+
+
+def growth_rates(frame: pd.DataFrame, lag: str) -> pd.DataFrame:
+    """
+    Period-over-period growth in % for GROWTH_METRICS: "yoy" compares each
+    period with the same period a year earlier, "qoq" with the previous
+    quarter. The comparison frame is built by a single reindex, so the
+    computation is one vectorized division over the whole table.
+    """
+    flows = frame.loc[[metric for metric in GROWTH_METRICS if metric in frame.index]]
+    if flows.empty:
+        return flows
+    previous_labels = [
+        _period_label(previous) if (previous := _previous(period_key(column), lag)) else None
+        for column in flows.columns
+    ]
+    previous = flows.reindex(columns=previous_labels)
+    previous.columns = flows.columns
+    base = previous.abs().where(previous != 0)
+    return ((flows - previous) / base * 100).dropna(axis=1, how="all")
+
+
+def _format(frame: pd.DataFrame, max_periods: int) -> str:
+    return frame.iloc[:, -max_periods:].to_string(float_format=lambda value: f"{value:,.2f}", na_rep="—")
+
+
+def metrics_report(pages: list, max_periods: int = FINANCIAL_METRICS_MAX_PERIODS) -> str:
+    """Compact metrics, margins and YoY/QoQ growth tables computed from the document's own tables"""
+    tables = extract_tables(pages)
+    frame, sources = standard_metrics(tables)
+    if frame.empty:
+        return f"No standard financial metrics found ({len(tables)} tables detected)"
+
+    sections = [f"Reported metrics and margins (as stated in the document; margins in %):\n{_format(frame, max_periods)}"]
+    for lag, title in (("yoy", "Year-over-year growth (%)"), ("qoq", "Quarter-over-quarter growth (%)")):
+        growth = growth_rates(frame, lag)
+        if not growth.empty:
+            sections.append(f"{title}:\n{_format(growth, max_periods)}")
+    sections.append("Sources: " + ", ".join(f"{metric} p.{page}" for metric, page in sources.items()))
+    return "\n\n".join(sections)
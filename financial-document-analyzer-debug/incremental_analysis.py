@@ -0,0 +1,83 @@
+## Incremental re-analysis: update a previous version's stage outputs from the changed sections only
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+from chunked_analysis import call_llm
+
+## A new version whose changed sections exceed this share of its text is analyzed from scratch
+INCREMENTAL_MAX_CHANGED_RATIO = float(os.getenv("INCREMENTAL_MAX_CHANGED_RATIO", "0.3"))
+## Character budget of the changes quoted in one update prompt; larger changes run in full
+INCREMENTAL_MAX_CHANGE_CHARS = int(os.getenv("INCREMENTAL_MAX_CHANGE_CHARS", "40000"))
+## How many incremental updates may build on each other before a version is analyzed in full again
+INCREMENTAL_MAX_CHAINED_UPDATES = int(os.getenv("INCREMENTAL_MAX_CHAINED_UPDATES", "3"))
+
+UPDATE_PROMPT = """You are the {role}. A new version of a financial document you analyzed before has
+arrived{query_note}. Update your previous output so it describes the new version:
+- revise every figure, statement and conclusion that the changes below affect;
+- keep everything the changes do not touch as it was;
+- keep the required structure:
+{expected_output}
+Cite page numbers of the new version. Never fabricate data. Reply with the complete updated output only.
+{context}
+Your previous output:
+{previous_output}
+
+Changes in the new version:
+{changes}"""
+
+CONTEXT_BLOCK = """
+Updated outputs of the stages this one builds on:
+{outputs}
+"""
+
+
+def _pages(numbers) -> str:
+    numbers = sorted(set(numbers)) or [0]
+    return str(numbers[0]) if numbers[0] == numbers[-1] else f"{numbers[0]}-{numbers[-1]}"
+
+
+def describe_changes(diff, previous_texts: dict, max_chars: int = INCREMENTAL_MAX_CHANGE_CHARS):
+    """
+    Changed regions of a VersionDiff as prompt text: the new text of added
+    and changed sections, and the previous text of changed and removed ones
+    where the previous version is still in the document cache. None when the
+    description exceeds `max_chars`.
+    """
+    blocks = []
+    for old, new in diff.regions:
+        titles = ", ".join(dict.fromkeys(title for title in
+                                         [section.title for section in new] + [row[2] for row in old] if title))
+        kind = "Changed" if old and new else ("Added" if new else "Removed")
+        new_pages, old_pages = _pages(section.page for section in new), _pages(row[1] for row in old)
+        where = {"Changed": f"page {new_pages} (previously {old_pages})", "Added": f"page {new_pages}",
+                 "Removed": f"previously page {old_pages}"}[kind]
+        block = [f"### {kind}: {titles or 'untitled section'}, {where}"]
+        if old:
+            previous = "\n".join(previous_texts.get(row[0], "") for row in old).strip()
+            block.append(f"Previous text:\n{previous or '(no longer available; infer it from your previous output)'}")
+        if new:
+            block.append("New text:\n" + "\n".join(section.text for section in new))
+        blocks.append("\n".join(block))
+    changes = "\n\n".join(blocks)
+    return changes if len(changes) <= max_chars else None
+
+
+def update_stage_output(llm, task, query: str, previous_output: str, changes: str,
+                        upstream: dict = None, usage: dict = None) -> str:
+    """
+    One LLM call that rewrites `task`'s previous output for the changes; upstream
+    outputs give it context. `query` is None for stages that do not depend on it.
+    """
+    context = CONTEXT_BLOCK.format(outputs="\n\n".join(
+        f"### {name.replace('_', ' ').title()}\n{output}" for name, output in upstream.items()
+    )) if upstream else ""
+    prompt = UPDATE_PROMPT.format(
+        role=task.agent.role,
+        query_note=f" (user query: {query})" if query is not None else "",
+        expected_output=(task._original_expected_output or task.expected_output).replace("{query}", query or ""),
+        context=context,
+        previous_output=previous_output,
+        changes=changes,
+    )
+    return call_llm(llm, prompt, usage)
@@ -0,0 +1,283 @@
+## LLM response cache keyed by (model, messages, parameters), with record/replay and a fake LLM
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+from tracing import start_span, set_attributes
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", "data/.doc_cache")
+
+## off    — every call goes to the API, nothing is stored
+## cache  — identical calls are answered from the store, the rest go to the API and are stored
+## record — every call goes to the API and its response is stored (refreshes a recording)
+## replay — calls are answered from the store only; a miss raises ReplayMiss (no network)
+## fake   — calls are answered by the deterministic fake LLM (no network, nothing stored)
+LLM_CACHE_MODES = ("off", "cache", "record", "replay", "fake")
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "cache")
+## "sqlite" keeps the store in one file per host; "redis" shares it across hosts
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "sqlite")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(DOC_CACHE_DIR, "llm_responses.sqlite"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+## Least recently used responses are evicted beyond this total size
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+## Bump to invalidate every cached response at once
+LLM_CACHE_VERSION = os.getenv("LLM_CACHE_VERSION", "1")
+
+## Fake LLM: words per answer and simulated latency, so benchmarks see realistic sizes and timing
+LLM_FAKE_COMPLETION_WORDS = int(os.getenv("LLM_FAKE_COMPLETION_WORDS", "150"))
+LLM_FAKE_LATENCY_SECONDS = float(os.getenv("LLM_FAKE_LATENCY_SECONDS", "0"))
+
+KEY_PREFIX = "llm:"
+
+## Store a response, then evict least recently used entries beyond the size limit
+_REDIS_PUT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+local previous = tonumber(redis.call('HGET', KEYS[3], KEYS[1]) or '0')
+redis.call('HSET', KEYS[3], KEYS[1], ARGV[4])
+local total = redis.call('HINCRBY', KEYS[3], '__total__', tonumber(ARGV[4]) - previous)
+local evicted = 0
+while total > tonumber(ARGV[5]) do
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, 0)[1]
+    if not oldest or oldest == KEYS[1] then break end
+    redis.call('DEL', oldest)
+    redis.call('ZREM', KEYS[2], oldest)
+    total = redis.call('HINCRBY', KEYS[3], '__total__', -tonumber(redis.call('HGET', KEYS[3], oldest) or '0'))
+    redis.call('HDEL', KEYS[3], oldest)
+    evicted = evicted + 1
+end
+return evicted
+"""
+
+
+class ReplayMiss(LookupError):
+    """Replay mode found no recorded response for a call"""
+
+
+def cache_key(model: str, messages, params: dict = None) -> str:
+    """Stable hash of everything that determines a response"""
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    identity = {
+        "version": LLM_CACHE_VERSION,
+        "model": model,
+        "messages": [{"role": m.get("role"), "content": m.get("content")} for m in messages],
+        "params": {name: value for name, value in (params or {}).items() if value is not None},
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def prompt_text(messages) -> str:
+    return messages if isinstance(messages, str) else "\n".join(str(m.get("content") or "") for m in messages)
+
+
+def fake_completion(model: str, messages, react: bool = False) -> str:
+    """
+    Deterministic stand-in answer: the same call always gets the same text.
+    Agent calls (`react=True`) get a ReAct final answer so the crew finishes
+    the task in one step without using tools.
+    """
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    digest = cache_key(model, messages)
+    prompt_words = sum(len(str(m.get("content") or "").split()) for m in messages)
+    vocabulary = ("revenue", "margin", "cash", "growth", "risk", "guidance", "liquidity", "operating",
+                  "segment", "quarter", "demand", "capex", "debt", "outlook", "cost", "pricing")
+    words = [vocabulary[int(digest[i % 64], 16)] for i in range(LLM_FAKE_COMPLETION_WORDS)]
+    answer = f"Fake analysis {digest[:12]} of a {prompt_words}-word prompt: " + " ".join(words) + "."
+    if LLM_FAKE_LATENCY_SECONDS:
+        time.sleep(LLM_FAKE_LATENCY_SECONDS)
+    return f"Thought: I now can give a great answer\nFinal Answer: {answer}" if react else answer
+
+
+class SqliteResponseStore:
+    """
+    Responses in one SQLite file (WAL mode, so API and worker processes on the
+    host can share it). Expired entries are dropped on read and on write; past
+    `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+            self._local.db = db
+        return db
+
+    def get(self, key: str):
+        now = time.time()
+        try:
+            row = self.db.execute("SELECT response, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+            return row[0]
+        except sqlite3.Error:
+            return None
+
+    def put(self, key: str, response: str, ttl: int) -> int:
+        now = time.time()
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, expires_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now + ttl, now),
+            )
+            return self._evict(now)
+        except sqlite3.Error:
+            return 0
+
+    def _evict(self, now: float) -> int:
+        evicted = self.db.execute("DELETE FROM responses WHERE expires_at < ?", (now,)).rowcount
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            ## Walk from the least recently used entry until enough space is freed
+            excess, cutoff = total - self.max_bytes, None
+            for used_at, size in self.db.execute("SELECT used_at, size FROM responses ORDER BY used_at"):
+                excess -= size
+                cutoff = used_at
+                if excess <= 0:
+                    break
+            evicted += self.db.execute("DELETE FROM responses WHERE used_at <= ?", (cutoff,)).rowcount
+        return evicted
+
+
+class RedisResponseStore:
+    """
+    Responses in Redis, shared by every host. Entries expire with their TTL;
+    a sorted set of last-use times and a size index let writes evict the
+    least recently used entries beyond `max_bytes`.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._redis_url = redis_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def get(self, key: str):
+        try:
+            response = self.client.get(KEY_PREFIX + key)
+            if response is not None:
+                self.client.zadd(f"{KEY_PREFIX}used", {KEY_PREFIX + key: time.time()})
+            return response
+        except redis.RedisError:
+            return None
+
+    def put(self, key: str, response: str, ttl: int) -> int:
+        try:
+            return int(self.client.eval(
+                _REDIS_PUT, 3, KEY_PREFIX + key, f"{KEY_PREFIX}used", f"{KEY_PREFIX}sizes",
+                response, ttl, time.time(), len(response.encode("utf-8")), self.max_bytes,
+            ))
+        except redis.RedisError:
+            return 0
+
+
+class LLMResponseCache:
+    """
+    Wraps LLM calls: `complete(model, messages, params, call)` returns the
+    response for the call, from the store, the live `call()` or the fake LLM
+    depending on the mode. Only text responses are stored.
+    """
+
+    def __init__(self, store=None, mode: str = LLM_CACHE_MODE, ttl: int = LLM_CACHE_TTL_SECONDS):
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode '{mode}', expected one of {LLM_CACHE_MODES}")
+        self.mode = mode
+        self.ttl = ttl
+        self._store = store
+        self._counters = {"hits": 0, "misses": 0, "live_calls": 0, "fake_calls": 0, "evictions": 0,
+                          "fake_prompt_tokens": 0, "fake_completion_tokens": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = RedisResponseStore() if LLM_CACHE_BACKEND == "redis" else SqliteResponseStore()
+        return self._store
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def complete(self, model: str, messages, params: dict, call, react: bool = False):
+        with start_span("llm.call", {"llm.model": model, "llm.cache_mode": self.mode, "llm.agent": react}) as span:
+            response = self._complete(model, messages, params, call, react)
+            if span.is_recording() and isinstance(response, str):
+                ## Imported here: chunked_analysis itself wraps its calls in this cache
+                from chunked_analysis import estimate_tokens
+                set_attributes({"llm.prompt_tokens": estimate_tokens(prompt_text(messages)),
+                                "llm.completion_tokens": estimate_tokens(response)}, span)
+            return response
+
+    def _complete(self, model: str, messages, params: dict, call, react: bool):
+        if self.mode == "fake":
+            from chunked_analysis import estimate_tokens
+            response = fake_completion(model, messages, react)
+            set_attributes({"llm.cache": "fake"})
+            with self._lock:
+                self._counters["fake_calls"] += 1
+                self._counters["fake_prompt_tokens"] += estimate_tokens(prompt_text(messages))
+                self._counters["fake_completion_tokens"] += estimate_tokens(response)
+            return response
+        if self.mode == "off":
+            self._count("live_calls")
+            set_attributes({"llm.cache": "off"})
+            return call()
+
+        key = cache_key(model, messages, params)
+        if self.mode in ("cache", "replay"):
+            cached = self.store.get(key)
+            if cached is not None:
+                self._count("hits")
+                set_attributes({"llm.cache": "hit"})
+                return cached
+            self._count("misses")
+            set_attributes({"llm.cache": "miss"})
+            if self.mode == "replay":
+                raise ReplayMiss(f"No recorded response for {model} call {key[:16]} (LLM_CACHE_MODE=replay)")
+
+        response = call()
+        self._count("live_calls")
+        if isinstance(response, str):
+            self._count("evictions", self.store.put(key, response, self.ttl))
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        return {"mode": self.mode, **counters, "hit_rate": round(counters["hits"] / lookups, 3) if lookups else None}
+
+
+## Process-wide response cache used by every LLM call
+llm_response_cache = LLMResponseCache()
@@ -1,14 +1,31 @@
 import os
+import time
 import uuid
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
-from crewai import Crew, Process
-from agents import financial_analyst, verifier, investment_advisor, risk_assessor
-from task import verification, analyze_financial_document, investment_analysis, risk_assessment
-from celery_worker import analyze_document_task
+from typing import List
+import json
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+## The crew stack (crewai, LangChain, agents) is not imported here: enqueuing and result lookup
+## do not need it, and workers and sync job processes load it themselves (see run_crew)
+from execution_modes import EXECUTION_MODES, DEFAULT_EXECUTION_MODE
+from celery_worker import analyze_document_task, summarize_batch_task
+from doc_cache import document_cache
+from uploads import save_upload, open_server_file
+from coalescing import job_coalescer, coalesce_key
+from batches import batch_store, batch_progress, combine_results, BATCH_MAX_DOCUMENTS
+from task_events import task_event_hub
+from queue_metrics import queue_metrics_collector
+from scheduling import PRIORITIES, PRIORITY_QUEUES, DEFAULT_PRIORITY, BATCH_DEFAULT_PRIORITY, DEFAULT_TENANT, TENANT_PATTERN
+from document_versions import DOCUMENT_ID_PATTERN
+from result_store import (result_store, is_stored, select_fields, select_section, iter_stream, iter_range,
+                          parse_byte_range, ResultExpired)
+from sync_executor import sync_executor, ExecutorSaturated, JobTimeout, SYNC_RETRY_AFTER_SECONDS
+from tracing import setup_tracing, start_span, set_attributes, inject_context, extract_context, flush_tracing
+from celery import chord
+from starlette.concurrency import run_in_threadpool
 from celery.result import AsyncResult
 
 app = FastAPI(
@@ -17,17 +34,133 @@ app = FastAPI(
     version="2.0.0"
 )
 
+## Each request starts a trace that the worker (or the sync job process) continues
+tracer_provider = setup_tracing("api")
+if tracer_provider:
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    FastAPIInstrumentor.instrument_app(app, tracer_provider=tracer_provider)
+
+
+## Background queue metrics collection for /queue/status and /metrics
+@app.on_event("startup")
+async def start_queue_metrics():
+    queue_metrics_collector.start()
+
+
+## Fork server of the sync executor imports the crew stack before the first /analyze call
+@app.on_event("startup")
+async def warm_sync_executor():
+    sync_executor.warm()
+
+
+@app.on_event("shutdown")
+async def stop_queue_metrics():
+    await queue_metrics_collector.stop()
+
 
 ## Synchronous crew runner (used as fallback)
-def run_crew(query: str, file_path: str = "data/TSLA-Q2-2025-Update.pdf"):
-    """Run the CrewAI pipeline synchronously"""
-    financial_crew = Crew(
-        agents=[verifier, financial_analyst, investment_advisor, risk_assessor],
-        tasks=[verification, analyze_financial_document, investment_analysis, risk_assessment],
-        process=Process.sequential,
-    )
-    result = financial_crew.kickoff({"query": query, "file_path": file_path})
-    return result
+def run_crew(query: str, file_path: str = "data/TSLA-Q2-2025-Update.pdf", file_hash: str = None,
+             execution_mode: str = DEFAULT_EXECUTION_MODE, trace_context: dict = None, document_id: str = None) -> dict:
+    """
+    Run the CrewAI pipeline synchronously (also the sync executor's worker entry point).
+    `trace_context` carries the request's trace into the job process; `document_id`
+    names the logical document this file is a version of (see run_pipeline).
+    """
+    from pipeline import run_pipeline, resolve_execution_mode
+
+    if file_hash:
+        document_cache.register_file(file_path, file_hash)
+    usage = {}
+    started = time.perf_counter()
+    try:
+        with start_span("analysis.sync", context=extract_context(trace_context)):
+            ## Oversized documents are switched to the chunked map-reduce mode
+            execution_mode, pages = resolve_execution_mode(file_path, execution_mode)
+            analysis = run_pipeline(query=query, file_path=file_path, file_hash=file_hash,
+                                    execution_mode=execution_mode, usage=usage, pages=pages, document_id=document_id)
+    finally:
+        ## Job processes exit without atexit hooks; export their spans before returning
+        flush_tracing()
+    return {
+        "analysis": analysis,
+        "execution_mode": execution_mode,
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+        "token_usage": usage,
+    }
+
+
+def _validate_execution_mode(execution_mode: str) -> str:
+    execution_mode = (execution_mode or DEFAULT_EXECUTION_MODE).strip().lower()
+    if execution_mode not in EXECUTION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"execution_mode must be one of: {', '.join(EXECUTION_MODES)}"
+        )
+    return execution_mode
+
+
+def _validate_scheduling(priority: str, tenant: str) -> tuple:
+    priority = (priority or DEFAULT_PRIORITY).strip().lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of: {', '.join(PRIORITIES)}")
+    tenant = (tenant or DEFAULT_TENANT).strip()
+    if not TENANT_PATTERN.fullmatch(tenant):
+        raise HTTPException(status_code=400, detail="tenant must be 1-64 letters, digits, '.', '_' or '-'")
+    return priority, tenant
+
+
+
+def _validate_document_id(document_id: str):
+    document_id = (document_id or "").strip() or None
+    if document_id and not DOCUMENT_ID_PATTERN.fullmatch(document_id):
+        raise HTTPException(status_code=400, detail="document_id must be 1-128 letters, digits, '.', '_', ':', '/' or '-'")
+    return document_id
+
+
+def _remove_file(file_path: str):
+    """Best-effort removal of an uploaded file that will not be processed"""
+    if file_path and os.path.exists(file_path):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+
+def _claim_job(dedupe_key: str, task_id: str):
+    """
+    Claim a coalescing key for `task_id`; returns the id of the task that
+    already owns it, or None. Claims left behind by failed jobs are taken over.
+    """
+    existing_id = job_coalescer.claim(dedupe_key, task_id)
+    if existing_id:
+        existing = AsyncResult(existing_id)
+        existing_result = existing.result if existing.state == "SUCCESS" else None
+        if existing.state == "FAILURE" or (isinstance(existing_result, dict) and existing_result.get("status") != "success"):
+            ## Stale claim left by a failed job — take it over
+            job_coalescer.release(dedupe_key, existing_id)
+            existing_id = job_coalescer.claim(dedupe_key, task_id)
+    return existing_id
+
+
+def _stream_result(head: str, stream):
+    yield head.encode("utf-8")
+    yield from iter_stream(stream)
+    yield b"}"
+
+
+def _select_result(task_id: str, result, fields: str = None, section: str = None):
+    """Response body of a completed task limited to `fields` or to one `section` of the analysis"""
+    if section and isinstance(result, dict):
+        selected = select_section(result, section)
+        if selected is None:
+            return JSONResponse(status_code=404, content={
+                "task_id": task_id, "status": "completed", "error": f"No '{section}' section in this result"
+            })
+        name, text = selected
+        return {"task_id": task_id, "status": "completed", "section": name, "result": text}
+    if fields and isinstance(result, dict):
+        result = select_fields(result, [name.strip() for name in fields.split(",") if name.strip()])
+    return {"task_id": task_id, "status": "completed", "result": result}
 
 
 
@@ -43,40 +176,97 @@ async def root():
 @app.post("/analyze/async", summary="Queue document for async analysis")
 async def analyze_document_async(
     file: UploadFile = File(...),
-    query: str = Form(default="Analyze this financial document for investment insights")
+    query: str = Form(default="Analyze this financial document for investment insights"),
+    execution_mode: str = Form(default=DEFAULT_EXECUTION_MODE),
+    priority: str = Form(default=DEFAULT_PRIORITY),
+    tenant: str = Form(default=DEFAULT_TENANT),
+    document_id: str = Form(default=None)
 ):
     """
     Queue a financial document for async analysis via Redis.
     Returns a task_id immediately — use GET /result/{task_id} to poll for results.
     Supports concurrent requests without blocking.
-    """
-    file_id = str(uuid.uuid4())
-    file_path = f"data/financial_document_{file_id}.pdf"
 
-    try:
-        os.makedirs("data", exist_ok=True)
+    `priority` ("interactive" or "bulk") selects the queue; `tenant` names the
+    customer whose per-priority concurrency cap the job counts against.
+
+    `document_id` names the logical document the file is a version of (e.g. a
+    corrected Q2 update): only the sections that changed since the tenant's
+    previous version are re-analyzed.
 
-        ## Save uploaded file
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+    Identical submissions (same document bytes, normalized query, execution mode,
+    tenant, priority, document_id and model) are coalesced: a queued/running
+    duplicate returns the existing task_id, and one completed within
+    COALESCE_TTL_SECONDS returns its stored result directly.
+    """
+    file_path = None
+    execution_mode = _validate_execution_mode(execution_mode)
+    priority, tenant = _validate_scheduling(priority, tenant)
+    document_id = _validate_document_id(document_id)
 
-        ## Validate file is a PDF
-        if not file.filename.endswith(".pdf"):
-            raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    try:
+        ## Stream upload to disk — validated on the first chunk, hashed while writing
+        upload = await save_upload(file)
+        file_path = upload.path
 
         ## Validate query
         if not query or query.strip() == "":
             query = "Analyze this financial document for investment insights"
 
+        query = query.strip()
+
+        ## Coalesce with an identical job that is queued, running or recently completed
+        task_id = str(uuid.uuid4())
+        dedupe_key = coalesce_key(upload.sha256, query, execution_mode, tenant, priority, document_id)
+        existing_id = _claim_job(dedupe_key, task_id)
+        set_attributes({"job.task_id": existing_id or task_id, "job.coalesced": bool(existing_id),
+                        "job.priority": priority, "job.tenant": tenant})
+
+        if existing_id:
+            _remove_file(file_path)
+            existing = AsyncResult(existing_id)
+            if existing.state == "SUCCESS":
+                return JSONResponse(
+                    status_code=200,
+                    content={
+                        "status": "completed",
+                        "task_id": existing_id,
+                        "coalesced": True,
+                        "message": "Identical document and query were analyzed recently — returning stored result.",
+                        "result": result_store.load(existing.result)
+                    }
+                )
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "status": "queued",
+                    "task_id": existing_id,
+                    "coalesced": True,
+                    "message": "Identical document and query are already being analyzed. Poll /result/{task_id} for results.",
+                    "poll_url": f"/result/{existing_id}",
+                    "file_queued": file.filename
+                }
+            )
+
         ## Push task to Redis queue — returns immediately
-        task = analyze_document_task.delay(query.strip(), file_path)
+        try:
+            task = analyze_document_task.apply_async(
+                args=[query, file_path, upload.sha256, execution_mode],
+                kwargs={"tenant": tenant, "priority": priority, "document_id": document_id},
+                task_id=task_id, queue=PRIORITY_QUEUES[priority]
+            )
+        except Exception:
+            job_coalescer.release(dedupe_key, task_id)
+            raise
 
         return JSONResponse(
             status_code=202,  ## 202 Accepted — processing has started
             content={
                 "status": "queued",
                 "task_id": task.id,
+                "coalesced": False,
+                "priority": priority,
+                "tenant": tenant,
                 "message": "Document queued for analysis. Poll /result/{task_id} for results.",
                 "poll_url": f"/result/{task.id}",
                 "file_queued": file.filename
@@ -87,23 +277,135 @@ async def analyze_document_async(
         raise
     except Exception as e:
         ## Clean up file if queuing failed
-        if os.path.exists(file_path):
+        _remove_file(file_path)
+        raise HTTPException(status_code=500, detail=f"Error queuing document: {str(e)}")
+
+
+
+## Batch Analysis Endpoint (Queue-based)
+@app.post("/analyze/batch", summary="Queue a portfolio of documents with a shared query")
+async def analyze_batch(
+    files: List[UploadFile] = File(default=[]),
+    paths: List[str] = Form(default=[]),
+    query: str = Form(default="Analyze this financial document for investment insights"),
+    execution_mode: str = Form(default=DEFAULT_EXECUTION_MODE),
+    priority: str = Form(default=BATCH_DEFAULT_PRIORITY),
+    tenant: str = Form(default=DEFAULT_TENANT)
+):
+    """
+    Queue many documents in one request: uploaded `files` and/or `paths` of PDFs
+    already in BATCH_INPUT_DIR (never copied or deleted). Batches default to the
+    "bulk" priority, so they never hold back interactive requests.
+
+    Documents with identical bytes inside the batch share one task, documents
+    already queued or recently analyzed with the same query reuse that task,
+    and the rest are enqueued together as one Celery chord whose callback
+    stores the combined result. Poll GET /batch/{batch_id} for progress and
+    GET /batch/{batch_id}/result for the combined result.
+    """
+    execution_mode = _validate_execution_mode(execution_mode)
+    priority, tenant = _validate_scheduling(priority, tenant)
+    query = (query or "").strip() or "Analyze this financial document for investment insights"
+    paths = [path for path in paths if path and path.strip()]
+    if not files and not paths:
+        raise HTTPException(status_code=400, detail="Provide at least one file or server-side path")
+    if len(files) + len(paths) > BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"A batch accepts at most {BATCH_MAX_DOCUMENTS} documents")
+
+    batch_id = str(uuid.uuid4())
+    saved = []      ## (display name, SavedUpload, keep_file)
+    claims = []     ## (dedupe key, task id) claimed for tasks this batch enqueues
+    try:
+        ## Ingest everything first: uploads are streamed to disk and hashed, server files only hashed
+        for file in files:
+            saved.append((file.filename, await save_upload(file), False))
+        for path in paths:
+            saved.append((path, await open_server_file(path.strip()), True))
+
+        documents, by_hash, queued = [], {}, []
+        for index, (name, upload, keep_file) in enumerate(saved):
+            entry = {"index": index, "filename": name, "file_hash": upload.sha256,
+                     "duplicate_of": None, "coalesced": False}
+            original = by_hash.get(upload.sha256)
+            if original is not None:
+                ## Same bytes earlier in this batch — share its task
+                entry.update(task_id=original["task_id"], duplicate_of=original["index"],
+                             coalesced=original["coalesced"])
+            else:
+                task_id = str(uuid.uuid4())
+                dedupe_key = coalesce_key(upload.sha256, query, execution_mode, tenant, priority)
+                existing_id = _claim_job(dedupe_key, task_id)
+                if existing_id:
+                    entry.update(task_id=existing_id, coalesced=True)
+                else:
+                    claims.append((dedupe_key, task_id))
+                    entry["task_id"] = task_id
+                    queued.append(analyze_document_task.s(
+                        query, upload.path, upload.sha256, execution_mode, keep_file,
+                        tenant=tenant, priority=priority
+                    ).set(task_id=task_id, queue=PRIORITY_QUEUES[priority]))
+                by_hash[upload.sha256] = entry
+            if (original is not None or entry["coalesced"]) and not keep_file:
+                _remove_file(upload.path)
+            documents.append(entry)
+
+        ## The manifest must exist before the chord callback can possibly run
+        batch_store.save(batch_id, {
+            "batch_id": batch_id,
+            "query": query,
+            "execution_mode": execution_mode,
+            "priority": priority,
+            "tenant": tenant,
+            "created_at": time.time(),
+            "documents": documents,
+            "queued_task_ids": [signature.options["task_id"] for signature in queued],
+        })
+        if queued:
+            ## One chord for the whole batch: the header runs on all workers, the callback combines
+            chord(queued)(summarize_batch_task.s(batch_id))
+
+    except Exception as e:
+        for dedupe_key, task_id in claims:
             try:
-                os.remove(file_path)
-            except:
+                job_coalescer.release(dedupe_key, task_id)
+            except Exception:
                 pass
-        raise HTTPException(status_code=500, detail=f"Error queuing document: {str(e)}")
+        for _, upload, keep_file in saved:
+            if not keep_file:
+                _remove_file(upload.path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Error queuing batch: {str(e)}")
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "status": "queued",
+            "batch_id": batch_id,
+            "total_documents": len(documents),
+            "unique_documents": len(by_hash),
+            "queued_tasks": len(queued),
+            "documents": documents,
+            "poll_url": f"/batch/{batch_id}",
+            "result_url": f"/batch/{batch_id}/result"
+        }
+    )
 
 
 
 ##  Task Result
 @app.get("/result/{task_id}", summary="Get analysis result by task ID")
-async def get_result(task_id: str):
+async def get_result(task_id: str, fields: str = None, section: str = None):
     """
     Poll for the result of a queued analysis task.
+
+    A completed result is streamed from compact storage. `fields` limits it
+    to some of its keys (e.g. `fields=analysis,token_usage`); `section`
+    returns one section of the analysis instead (e.g. `section=risk`).
     
     Returns task status:
     - PENDING   → task is waiting in queue
+    - RETRY     → task was deferred because its tenant is at its concurrency cap
     - STARTED   → task has been picked up by a worker
     - PROGRESS  → task is actively running (includes progress %)
     - SUCCESS   → task completed — result is included
@@ -120,6 +422,13 @@ async def get_result(task_id: str):
                 "message": "Task is waiting in queue"
             }
 
+        elif state == "RETRY":
+            return {
+                "task_id": task_id,
+                "status": "pending",
+                "message": "Task is waiting in queue for a free slot for its tenant"
+            }
+
         elif state == "STARTED":
             return {
                 "task_id": task_id,
@@ -138,11 +447,18 @@ async def get_result(task_id: str):
 
         elif state == "SUCCESS":
             result = task_result.result
-            return {
-                "task_id": task_id,
-                "status": "completed",
-                "result": result
-            }
+            if is_stored(result) and not (fields or section):
+                try:
+                    stream = result_store.open_payload(result)
+                except ResultExpired as e:
+                    return JSONResponse(status_code=410, content={"task_id": task_id, "status": "expired", "error": str(e)})
+                ## The stored JSON is decompressed into the response chunk by chunk, never parsed
+                head = json.dumps({"task_id": task_id, "status": "completed"})[:-1] + ', "result": '
+                return StreamingResponse(_stream_result(head, stream), media_type="application/json")
+            result = result_store.load(result)
+            if isinstance(result, dict) and result.get("status") == "expired":
+                return JSONResponse(status_code=410, content={"task_id": task_id, **result})
+            return _select_result(task_id, result, fields, section)
 
         elif state == "FAILURE":
             return JSONResponse(
@@ -166,32 +482,187 @@ async def get_result(task_id: str):
 
 
 
+## Stored Result Document
+@app.get("/result/{task_id}/raw", summary="Stored result document, compressed or by byte range")
+async def get_result_raw(task_id: str, request: Request):
+    """
+    The stored result JSON of a completed task, streamed. A client that
+    accepts the stored codec (`Accept-Encoding: zstd` or `gzip`) receives the
+    stored bytes as they are; `Range: bytes=start-end` selects part of the
+    uncompressed document (206 Partial Content).
+    """
+    task_result = AsyncResult(task_id)
+    value = task_result.result if task_result.state == "SUCCESS" else None
+    if not is_stored(value):
+        raise HTTPException(status_code=404, detail="No stored result for this task; see /result/{task_id}")
+    reference = value["stored_result"]
+    byte_range = request.headers.get("range")
+    accepted = {token.split(";")[0].strip().lower() for token in request.headers.get("accept-encoding", "").split(",")
+                if "q=0" not in token.replace(" ", "").split(";")[1:]}
+
+    try:
+        if byte_range is None and reference["codec"] in accepted:
+            return StreamingResponse(
+                iter_stream(result_store.open_payload(value, decompress=False)),
+                media_type="application/json",
+                headers={"Content-Encoding": reference["codec"], "Content-Length": str(reference["stored_bytes"]),
+                         "Vary": "Accept-Encoding"}
+            )
+        span = parse_byte_range(byte_range, reference["bytes"]) if byte_range else None
+        stream = result_store.open_payload(value)
+    except ResultExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{reference['bytes']}"})
+
+    if span is None:
+        return StreamingResponse(iter_stream(stream), media_type="application/json",
+                                 headers={"Content-Length": str(reference["bytes"]), "Accept-Ranges": "bytes"})
+    start, end = span
+    return StreamingResponse(
+        iter_range(stream, start, end),
+        status_code=206,
+        media_type="application/json",
+        headers={"Content-Range": f"bytes {start}-{end}/{reference['bytes']}",
+                 "Content-Length": str(end - start + 1), "Accept-Ranges": "bytes"}
+    )
+
+
+
+## Streaming Task Events (Server-Sent Events)
+@app.get("/events/{task_id}", summary="Stream task state changes (SSE)")
+async def stream_task_events(task_id: str):
+    """
+    Push alternative to polling /result/{task_id}: sends the current state,
+    then every STARTED/PROGRESS event (including each finished stage's
+    `stage` and `output`) and finally SUCCESS with the result's summary and
+    `result_url`, or FAILURE with the error.
+    Events arrive through the API process's single Redis subscription.
+    """
+    async def event_stream():
+        async for event in task_event_hub.events(task_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['state'].lower()}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+
+## Streaming Task Events (WebSocket)
+@app.websocket("/ws/result/{task_id}")
+async def websocket_task_events(websocket: WebSocket, task_id: str):
+    """Same events as /events/{task_id} as JSON messages; the server closes the socket after the final one"""
+    await websocket.accept()
+    try:
+        async for event in task_event_hub.events(task_id):
+            if event is None:
+                await websocket.send_json({"task_id": task_id, "state": "HEARTBEAT"})
+            else:
+                await websocket.send_text(json.dumps(event, default=str))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+
+## Streaming Hub Stats
+@app.get("/events/hub/stats", summary="Task event fan-out counters for this API process")
+async def task_events_stats():
+    """Connected clients, watched tasks and event counters of this process's Redis subscription"""
+    return task_event_hub.stats()
+
+
+
+## Batch Progress
+@app.get("/batch/{batch_id}", summary="Aggregate progress of a batch")
+async def get_batch(batch_id: str):
+    """Per-document status and overall progress of a batch submitted to /analyze/batch"""
+    manifest = batch_store.get(batch_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Batch not found or expired")
+    try:
+        return await run_in_threadpool(batch_progress, manifest)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching batch progress: {str(e)}")
+
+
+
+## Batch Result
+@app.get("/batch/{batch_id}/result", summary="Combined result of a batch")
+async def get_batch_result(batch_id: str):
+    """
+    Combined per-document analyses of a batch. Returns 200 with the stored
+    result once every document has finished, otherwise 202 with the results
+    available so far.
+    """
+    combined = batch_store.get_result(batch_id)
+    if combined is None or not combined["complete"]:
+        manifest = batch_store.get(batch_id)
+        if manifest is None:
+            raise HTTPException(status_code=404, detail="Batch not found or expired")
+        try:
+            combined = await run_in_threadpool(combine_results, manifest)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error combining batch results: {str(e)}")
+    return JSONResponse(status_code=200 if combined["complete"] else 202, content=combined)
+
+
+
 ## Queue Status Endpoint
 @app.get("/queue/status", summary="Check Redis queue status")
 async def queue_status():
-    """Check how many tasks are active, pending, and completed in the queue"""
-    try:
-        from celery_worker import celery_app
-        inspect = celery_app.control.inspect()
+    """
+    Queue snapshot refreshed in the background every QUEUE_METRICS_INTERVAL_SECONDS:
+    active/reserved tasks per worker, broker backlog per queue, queue-wait and
+    runtime percentiles and throughput. Served from memory, never blocking on workers.
+    """
+    snapshot = queue_metrics_collector.current()
+    if snapshot.get("status") == "redis_unavailable":
+        snapshot["message"] = "Make sure Redis is running: docker run -d -p 6379:6379 redis:alpine"
+    return snapshot
 
-        active = inspect.active() or {}
-        reserved = inspect.reserved() or {}
 
-        active_count = sum(len(tasks) for tasks in active.values())
-        pending_count = sum(len(tasks) for tasks in reserved.values())
 
-        return {
-            "status": "redis_connected",
-            "active_tasks": active_count,
-            "queued_tasks": pending_count,
-            "workers": list(active.keys())
-        }
+## Prometheus Metrics
+@app.get("/metrics", summary="Queue metrics in Prometheus text format", response_class=PlainTextResponse)
+async def metrics():
+    """Scrape target exposing the cached queue snapshot"""
+    return PlainTextResponse(queue_metrics_collector.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+
+## Parsed-Document Cache Stats
+@app.get("/cache/stats", summary="Parsed-document cache counters for this API process")
+async def cache_stats():
+    """Hit/miss/eviction counters of the parsed-document cache (sync path)"""
+    return document_cache.stats()
+
+
+
+## Stage Cache Invalidation
+@app.delete("/cache/stages/{file_hash}", summary="Drop cached crew stage outputs for a document")
+async def invalidate_stage_cache(file_hash: str):
+    """Force every crew stage to re-run for this document (SHA-256 of the PDF bytes)"""
+    try:
+        from stage_cache import stage_cache
+        removed = stage_cache.invalidate_document(file_hash)
+        return {"file_hash": file_hash, "removed": removed}
     except Exception as e:
-        return {
-            "status": "redis_unavailable",
-            "error": str(e),
-            "message": "Make sure Redis is running: docker run -d -p 6379:6379 redis:alpine"
-        }
+        raise HTTPException(status_code=500, detail=f"Error invalidating stage cache: {str(e)}")
+
+
+
+## Sync Executor Stats
+@app.get("/analyze/capacity", summary="Load of the synchronous analysis pool")
+async def analyze_capacity():
+    """Running/waiting jobs and rejection/timeout counters of the sync executor"""
+    return sync_executor.stats()
 
 
 
@@ -199,44 +670,55 @@ async def queue_status():
 @app.post("/analyze", summary="Analyze document synchronously (blocking)")
 async def analyze_document(
     file: UploadFile = File(...),
-    query: str = Form(default="Analyze this financial document for investment insights")
+    query: str = Form(default="Analyze this financial document for investment insights"),
+    execution_mode: str = Form(default=DEFAULT_EXECUTION_MODE),
+    document_id: str = Form(default=None)
 ):
     """
     Synchronous analysis — waits for full result before returning.
+    The crew runs in a bounded worker pool, never on the event loop; when the
+    pool is saturated the request is rejected with 503 + Retry-After.
     Use /analyze/async for concurrent or long-running requests.
     """
-    file_id = str(uuid.uuid4())
-    file_path = f"data/financial_document_{file_id}.pdf"
+    file_path = None
+    execution_mode = _validate_execution_mode(execution_mode)
+    document_id = _validate_document_id(document_id)
 
     try:
-        os.makedirs("data", exist_ok=True)
+        ## Admission control happens before the upload is read
+        async with sync_executor.admit():
+            upload = await save_upload(file)
+            file_path = upload.path
 
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            if not query or query.strip() == "":
+                query = "Analyze this financial document for investment insights"
 
-        if not file.filename.endswith(".pdf"):
-            raise HTTPException(status_code=400, detail="Only PDF files are supported")
-
-        if not query or query.strip() == "":
-            query = "Analyze this financial document for investment insights"
-
-        response = run_crew(query=query.strip(), file_path=file_path)
+            result = await sync_executor.run(run_crew, query.strip(), file_path, upload.sha256, execution_mode,
+                                             inject_context(), document_id)
 
         return {
             "status": "success",
             "query": query,
-            "analysis": str(response),
+            **result,
             "file_processed": file.filename
         }
 
     except HTTPException:
         raise
+    except ExecutorSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"{str(e)}. Retry later or use /analyze/async.",
+            headers={"Retry-After": str(SYNC_RETRY_AFTER_SECONDS)}
+        )
+    except JobTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing financial document: {str(e)}")
 
     finally:
-        if os.path.exists(file_path):
+        if file_path and os.path.exists(file_path):
+            document_cache.forget_file(file_path)
             try:
                 os.remove(file_path)
             except:
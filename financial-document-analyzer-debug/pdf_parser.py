@@ -0,0 +1,132 @@
+## Page-parallel PDF text extraction on a per-process worker pool
+import os
+import math
+import mmap
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+load_dotenv()
+
+from pypdf import PdfReader
+
+from text_normalizer import normalize_text
+
+## Parser processes per API/Celery worker process (1 = parse in-process).
+## Each Celery worker process owns its own pool, so the total is concurrency x this value.
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+## Documents with fewer pages are parsed in-process; pool round-trips would cost more than they save
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "24"))
+## Ranges per pool process, so a few slow (image- or table-heavy) pages do not idle the others
+_RANGES_PER_WORKER = 4
+
+
+@contextmanager
+def _open_reader(path: str):
+    """
+    A reader over a read-only memory map of `path`, released with its parsed
+    pages on exit. Opening by path would copy the whole file into the heap;
+    the map is paged in by the OS on demand.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        reader = PdfReader(mapped)
+        try:
+            yield reader
+        finally:
+            ## Drop the reader's views into the mapping before it is closed (also on early stop)
+            del reader
+
+
+def _page_text(page) -> str:
+    return normalize_text(page.extract_text(extraction_mode="plain").strip(), dehyphenate=False)
+
+
+def parse_page_range(path: str, start: int, stop: int) -> list:
+    """
+    Extract and normalize pages [start, stop) the way PyPDFLoader extracts them
+    (plain mode, stripped). Whitespace and blank lines are collapsed here, in
+    the worker, so only compact text crosses the process boundary; header and
+    footer stripping needs every page and happens in the parent.
+    """
+    with _open_reader(path) as reader:
+        return [_page_text(reader.pages[number]) for number in range(start, stop)]
+
+
+def iter_pages(path: str):
+    """
+    Lazily extract and normalize one page at a time from a memory-mapped PDF.
+    The OS pages the file in on demand, so no copy of the file is held in the
+    heap and only the current page's text is alive at any time.
+    """
+    with _open_reader(path) as reader:
+        for number in range(len(reader.pages)):
+            yield _page_text(reader.pages[number])
+
+
+def page_count(path: str) -> int:
+    with _open_reader(path) as reader:
+        return len(reader.pages)
+
+
+def page_ranges(total: int, workers: int) -> list:
+    """Split [0, total) into contiguous ranges, a few per worker"""
+    size = max(1, math.ceil(total / (workers * _RANGES_PER_WORKER)))
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+class ParallelPdfParser:
+    """
+    Parses large PDFs by fanning contiguous page ranges out to a process pool
+    and reassembling the pages in order. The pool uses the spawn start method
+    (safe next to threads) and is created on first use, then kept for the life
+    of the process.
+    """
+
+    def __init__(self, workers: int = PDF_PARSE_WORKERS, min_pages: int = PDF_PARALLEL_MIN_PAGES):
+        self.workers = max(1, workers)
+        self.min_pages = min_pages
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def _discard_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def parse(self, path: str) -> list:
+        """Return the normalized text of every page of `path`, in page order"""
+        total = page_count(path)
+        if self.workers == 1 or total < self.min_pages:
+            return parse_page_range(path, 0, total)
+
+        ranges = page_ranges(total, self.workers)
+        try:
+            futures = [self.pool.submit(parse_page_range, path, start, stop) for start, stop in ranges]
+            pages = []
+            for future in futures:
+                pages.extend(future.result())
+            return pages
+        except (BrokenProcessPool, AssertionError, OSError):
+            ## A parser process died, or this process may not start children
+            ## (e.g. a daemonic pool worker): drop the pool and parse in-process
+            self._discard_pool()
+            return parse_page_range(path, 0, total)
+
+    def shutdown(self):
+        self._discard_pool()
+
+
+## Process-wide parser used by the document tools
+pdf_parser = ParallelPdfParser()
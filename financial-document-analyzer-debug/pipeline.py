@@ -0,0 +1,355 @@
+## Crew pipeline shared by the synchronous endpoint and the Celery worker
+import os
+import hashlib
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+from crewai import Crew, Process
+from crewai.tasks.task_output import TaskOutput
+from crewai.types.usage_metrics import UsageMetrics
+
+from agents import llm, financial_analyst, verifier, investment_advisor, risk_assessor
+from task import verification, analyze_financial_document, investment_analysis, risk_assessment
+from stage_cache import stage_cache, task_fingerprint
+from tools import load_document_pages, load_document_index
+from chunked_analysis import map_reduce_analysis, estimate_tokens, MAP_FINGERPRINT
+from document_versions import document_versions, document_sections, diff_versions, section_texts
+from incremental_analysis import (update_stage_output, describe_changes, INCREMENTAL_MAX_CHANGED_RATIO,
+                                  INCREMENTAL_MAX_CHAINED_UPDATES)
+from scheduling import DEFAULT_TENANT
+from crew_pool import CrewPool
+from rate_limiter import llm_rate_limiter
+from tracing import start_span, set_attributes, in_current_context
+from execution_modes import EXECUTION_MODES, DEFAULT_EXECUTION_MODE
+
+MODEL = os.getenv("MODEL", "gpt-4o-mini")
+
+## Documents estimated above this many tokens switch to "chunked" automatically (0 disables)
+CHUNKED_AUTO_THRESHOLD_TOKENS = int(os.getenv("CHUNKED_AUTO_THRESHOLD_TOKENS", "100000"))
+## Token budget reserved for a crew run; agents read through search tools, so it barely
+## depends on document size (chunked runs are budgeted from the document itself)
+CREW_JOB_TOKENS_ESTIMATE = int(os.getenv("CREW_JOB_TOKENS_ESTIMATE", "40000"))
+
+AGENTS = [verifier, financial_analyst, investment_advisor, risk_assessor]
+STAGES = {
+    "verification": verification,
+    "analyze_financial_document": analyze_financial_document,
+    "investment_analysis": investment_analysis,
+    "risk_assessment": risk_assessment,
+}
+
+## Stages whose output depends only on the document, not on the wording of the query,
+## so a new query against an already-analyzed document reuses them. Their prompts (and
+## their agents') must therefore never contain {query}
+DOCUMENT_ONLY_STAGES = {"verification", "analyze_financial_document"}
+
+## Fingerprints are taken from the module-level templates, which are never kicked off
+## themselves (every run works on a copy), so they always reflect task.py / agents.py
+STAGE_FINGERPRINTS = {name: task_fingerprint(task) for name, task in STAGES.items()}
+
+
+def _template_crew() -> Crew:
+    return Crew(agents=AGENTS, tasks=list(STAGES.values()), process=Process.sequential)
+
+
+## Process-wide pool of ready crew clones (warmed by the Celery worker at process start)
+crew_pool = CrewPool(_template_crew)
+
+
+def _dependencies(task, ordered_tasks: list) -> list:
+    """Tasks whose output `task` consumes; no explicit context means every earlier task (sequential semantics)"""
+    if isinstance(task.context, list):
+        return task.context
+    position = next(index for index, candidate in enumerate(ordered_tasks) if candidate is task)
+    return ordered_tasks[:position]
+
+
+def execution_waves(tasks: list) -> list:
+    """
+    Group tasks into waves derived from their `context` dependencies: every
+    task in a wave only depends on tasks from earlier waves (or on tasks
+    outside `tasks`, i.e. already cached). An agent appears at most once per
+    wave so it never works on two tasks at once.
+    """
+    pending = list(tasks)
+    pending_ids = {id(task) for task in tasks}
+    done = set()
+    waves = []
+    while pending:
+        wave, wave_agents = [], set()
+        for task in pending:
+            blocked = any(id(dep) in pending_ids and id(dep) not in done for dep in _dependencies(task, tasks))
+            if not blocked and id(task.agent) not in wave_agents:
+                wave.append(task)
+                wave_agents.add(id(task.agent))
+        if not wave:
+            raise ValueError("Task context dependencies contain a cycle")
+        waves.append(wave)
+        done.update(id(task) for task in wave)
+        pending = [task for task in pending if id(task) not in done]
+    return waves
+
+
+def terminal_stages() -> list:
+    """Stages no other stage consumes; together their outputs make up the final report"""
+    ordered = list(STAGES.values())
+    consumed = {id(dep) for task in ordered for dep in _dependencies(task, ordered)}
+    return [name for name, task in STAGES.items() if id(task) not in consumed]
+
+
+def _add_usage(usage: dict, metrics: UsageMetrics):
+    if usage is None or metrics is None:
+        return
+    for field, value in metrics.model_dump().items():
+        usage[field] = usage.get(field, 0) + value
+
+
+def _kickoff(tasks: list, inputs: dict) -> UsageMetrics:
+    agents = list({id(task.agent): task.agent for task in tasks}.values())
+    crew = Crew(agents=agents, tasks=tasks, process=Process.sequential)
+    crew.kickoff(inputs)
+    return crew.usage_metrics
+
+
+def _run_parallel(tasks: list, inputs: dict, usage: dict = None):
+    """Run each wave's stages concurrently, one single-task crew per stage"""
+    for wave in execution_waves(tasks):
+        if len(wave) == 1:
+            _add_usage(usage, _kickoff(wave, inputs))
+            continue
+        with ThreadPoolExecutor(max_workers=len(wave), thread_name_prefix="crew-stage") as pool:
+            for metrics in pool.map(in_current_context(lambda task: _kickoff([task], inputs)), wave):
+                _add_usage(usage, metrics)
+
+
+def _run_chunked(query: str, pages: list, file_hash: str = None, on_stage=None, usage: dict = None,
+                 previous_hash: str = None) -> str:
+    """
+    Map-reduce analysis; map outputs are query-independent and cached per chunk.
+    With the `previous_hash` of an earlier version of the document, chunks whose
+    text did not change reuse that version's map outputs.
+    """
+    def chunk_key(document_hash, chunk):
+        ## The key keeps only a prefix of the fingerprint, so prompt and chunk text are hashed together
+        fingerprint = hashlib.sha256(f"{MAP_FINGERPRINT}:{chunk.text}".encode("utf-8")).hexdigest()
+        return stage_cache.key(document_hash, "chunk_map", fingerprint, MODEL)
+
+    def cache_get(chunk):
+        output = stage_cache.get(chunk_key(file_hash, chunk))
+        if output is None and previous_hash:
+            output = stage_cache.get(chunk_key(previous_hash, chunk))
+            if output is not None:
+                stage_cache.put(chunk_key(file_hash, chunk), output)
+        return output
+
+    cache_get = cache_get if file_hash else None
+    cache_put = (lambda chunk, output: stage_cache.put(chunk_key(file_hash, chunk), output)) if file_hash else None
+    return map_reduce_analysis(query, pages, llm, cache_get=cache_get, cache_put=cache_put,
+                               on_progress=on_stage, usage=usage)
+
+
+def _stage_key(file_hash: str, name: str, query: str, updates: int = 0) -> str:
+    """
+    Stage cache key of a stage output. Outputs that went through `updates`
+    incremental updates are kept under their own fingerprint, so an analysis
+    from scratch never reuses patched text.
+    """
+    fingerprint = STAGE_FINGERPRINTS[name]
+    if updates:
+        fingerprint = hashlib.sha256(f"{fingerprint}:updates:{updates}".encode("utf-8")).hexdigest()
+    return stage_cache.key(file_hash, name, fingerprint, MODEL, query=None if name in DOCUMENT_ONLY_STAGES else query)
+
+
+def _refresh_stages(query: str, file_hash: str, previous: dict, sections: list, usage: dict = None) -> dict:
+    """
+    Incremental re-analysis of a new version of a logical document: each stage
+    output cached for the `previous` version is updated by one LLM call that
+    only sees the changed sections, and stored as this version's updated output.
+    Returns the refreshed stage outputs by name; _run_crew reuses them and runs
+    the rest. Nothing is refreshed when too much changed, the old outputs are
+    gone, or they already went through INCREMENTAL_MAX_CHAINED_UPDATES updates.
+    """
+    diff = diff_versions(previous["sections"], sections)
+    set_attributes({"incremental.changed_ratio": round(diff.ratio, 4), "incremental.changed_regions": len(diff.regions)})
+    if diff.ratio > INCREMENTAL_MAX_CHANGED_RATIO:
+        return {}
+    ## Identical section text (e.g. only the PDF metadata changed) carries the old outputs over as they are
+    changes = describe_changes(diff, section_texts(previous["file_hash"])) if diff.regions else None
+    if diff.regions and changes is None:
+        return {}
+
+    ordered = list(STAGES.values())
+    names = {id(task): name for name, task in STAGES.items()}
+    outputs, refreshed = {}, set()
+    with start_span("incremental.refresh", {"incremental.previous_hash": previous["file_hash"]}):
+        for name, task in STAGES.items():
+            upstream = [names[id(dependency)] for dependency in _dependencies(task, ordered)]
+            if any(dependency not in outputs for dependency in upstream):
+                continue
+            outputs[name] = stage_cache.get(_stage_key(file_hash, name, query))
+            if outputs[name] is not None:
+                continue
+            ## The previous version's output with the fewest updates behind it, full runs first
+            for updates in range(INCREMENTAL_MAX_CHAINED_UPDATES):
+                previous_output = stage_cache.get(_stage_key(previous["file_hash"], name, query, updates))
+                if previous_output is not None:
+                    break
+            else:
+                del outputs[name]
+                continue
+            ## Identical text carries the output over as it is, without counting as an update
+            if changes is not None:
+                updates += 1
+                previous_output = update_stage_output(
+                    llm, task, None if name in DOCUMENT_ONLY_STAGES else query, previous_output, changes,
+                    {dependency: outputs[dependency] for dependency in upstream}, usage)
+            outputs[name] = previous_output
+            stage_cache.put(_stage_key(file_hash, name, query, updates), outputs[name])
+            refreshed.add(name)
+        set_attributes({"incremental.stages_refreshed": len(refreshed)})
+    return {name: outputs[name] for name in refreshed}
+
+
+def resolve_execution_mode(file_path: str, execution_mode: str = DEFAULT_EXECUTION_MODE):
+    """
+    Returns (mode, pages). Documents too large for the crew's context are moved
+    to "chunked"; the parsed pages are returned so they are not loaded twice.
+    """
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode '{execution_mode}', expected one of {EXECUTION_MODES}")
+    if execution_mode != "chunked" and not CHUNKED_AUTO_THRESHOLD_TOKENS:
+        return execution_mode, None
+    pages = load_document_pages(file_path)
+    if execution_mode != "chunked" and sum(estimate_tokens(page) for page in pages) > CHUNKED_AUTO_THRESHOLD_TOKENS:
+        execution_mode = "chunked"
+    return execution_mode, pages
+
+
+def estimate_job_tokens(execution_mode: str, pages: list = None) -> int:
+    """Tokens a run is expected to use, reserved from the cluster-wide budget before it starts"""
+    if execution_mode == "chunked" and pages:
+        ## Every page goes through one map call; map outputs and the reduce add about a third
+        return int(sum(estimate_tokens(page) for page in pages) * 4 / 3)
+    return CREW_JOB_TOKENS_ESTIMATE
+
+
+def run_pipeline(query: str, file_path: str, file_hash: str = None, on_stage=None,
+                 execution_mode: str = DEFAULT_EXECUTION_MODE, usage: dict = None, pages: list = None,
+                 document_id: str = None, tenant: str = DEFAULT_TENANT) -> str:
+    """
+    Run verification → analysis → investment → risk for one document and
+    return the final report.
+
+    With a `file_hash`, stage outputs are cached: a stage is reused when its
+    cached output exists and every stage in its `context` was reused too, so
+    only the stages that depend on the query (or on a changed prompt) run.
+
+    `execution_mode` selects sequential or DAG-parallel execution of the
+    remaining stages, or a chunked map-reduce (also chosen automatically for
+    documents above CHUNKED_AUTO_THRESHOLD_TOKENS). `on_stage(stage_name,
+    output, cached)` is called as each stage finishes, and LLM token usage is
+    accumulated into `usage` if given. Callers that already ran
+    resolve_execution_mode() pass its `pages` along.
+
+    The run first waits until its estimated tokens fit in the model's job
+    budget, so no more jobs start than the quota can serve.
+
+    `document_id` names the logical document this file is a version of (per
+    `tenant`). When the previous version was analyzed, only the sections that
+    changed are re-analyzed: its stage outputs are updated incrementally, and
+    in chunked mode unchanged chunks reuse its map outputs.
+    """
+    if pages is None:
+        execution_mode, pages = resolve_execution_mode(file_path, execution_mode)
+    sections, previous = None, None
+    if document_id and file_hash:
+        sections = document_sections(pages if pages is not None else load_document_pages(file_path))
+        previous = document_versions.latest(tenant, document_id)
+        if previous and previous["file_hash"] == file_hash:
+            previous = None
+    job_tokens = estimate_job_tokens(execution_mode, pages)
+    with start_span("pipeline.run", {"job.execution_mode": execution_mode, "llm.job_tokens_estimate": job_tokens,
+                                     "document.id": document_id or ""}), \
+            llm_rate_limiter.job(MODEL, job_tokens):
+        if execution_mode == "chunked":
+            report = _run_chunked(query, pages, file_hash, on_stage, usage,
+                                  previous_hash=previous["file_hash"] if previous else None)
+        else:
+            refreshed = _refresh_stages(query, file_hash, previous, sections, usage) if previous else {}
+            ## Build (or load) the retrieval index once up front so agents' searches are lookups
+            ## (skipped when every stage was refreshed and no agent will search)
+            if len(refreshed) < len(STAGES):
+                load_document_index(file_path)
+
+            ## Each run gets its own clone so concurrent or successive runs never share task state
+            with crew_pool.checkout() as crew:
+                report = _run_crew(crew, query, file_path, file_hash, on_stage, execution_mode, usage, refreshed)
+    if sections is not None:
+        document_versions.record(tenant, document_id, file_hash, sections)
+    return report
+
+
+def _run_crew(crew: Crew, query: str, file_path: str, file_hash: str = None, on_stage=None,
+              execution_mode: str = DEFAULT_EXECUTION_MODE, usage: dict = None, refreshed: dict = None) -> str:
+    """
+    Run the crew's stages, reusing cached stage outputs (see run_pipeline);
+    `refreshed` holds the outputs just updated from a previous version. Stages
+    that run on top of refreshed outputs are not cached as full-run outputs.
+    """
+    refreshed = refreshed or {}
+    inputs = {"query": query, "file_path": file_path}
+    tasks = dict(zip(STAGES, crew.tasks))
+    task_names = {id(task): name for name, task in tasks.items()}
+    ordered = list(tasks.values())
+
+    cache_keys = {}
+    reused = set()
+    derived = set()     ## refreshed stages and the stages run on top of them
+    to_run = []
+    for name, task in tasks.items():
+        cached = None
+        upstream = [task_names[id(dependency)] for dependency in _dependencies(task, ordered)]
+        if name in refreshed:
+            cached = refreshed[name]
+            derived.add(name)
+        elif file_hash:
+            cache_keys[name] = _stage_key(file_hash, name, query)
+            if all(dependency in reused for dependency in upstream):
+                cached = stage_cache.get(cache_keys[name])
+
+        if cached is None and any(dependency in derived for dependency in upstream):
+            derived.add(name)
+        if cached is not None:
+            task.output = TaskOutput(description=task.description, raw=cached, agent=task.agent.role)
+            reused.add(name)
+            if on_stage:
+                on_stage(name, cached, name not in refreshed)
+        else:
+            to_run.append(task)
+
+    if to_run:
+        def finished(name, output):
+            if name in cache_keys and name not in derived:
+                stage_cache.put(cache_keys[name], output.raw)
+            if on_stage:
+                on_stage(name, output.raw, False)
+
+        for task in to_run:
+            task.callback = partial(finished, task_names[id(task)])
+            ## Names the stage in its trace span (the clone is discarded after the run)
+            task.name = task_names[id(task)]
+
+        if execution_mode == "parallel":
+            _run_parallel(to_run, inputs, usage)
+        else:
+            _add_usage(usage, _kickoff(to_run, inputs))
+
+    set_attributes({"crew.stages_cached": len(reused)})
+    terminal = terminal_stages()
+    if len(terminal) == 1:
+        return tasks[terminal[0]].output.raw
+    return "\n\n".join(
+        f"## {name.replace('_', ' ').title()}\n\n{tasks[name].output.raw}" for name in terminal
+    )
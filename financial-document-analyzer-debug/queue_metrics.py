@@ -0,0 +1,221 @@
+## Background queue metrics: task timing samples from workers, cached snapshots for the API
+import os
+import json
+import time
+import asyncio
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+## How often the API process refreshes the cached snapshot
+QUEUE_METRICS_INTERVAL_SECONDS = float(os.getenv("QUEUE_METRICS_INTERVAL_SECONDS", "10"))
+## Upper bound on how long one collection waits for worker replies
+QUEUE_METRICS_INSPECT_TIMEOUT = float(os.getenv("QUEUE_METRICS_INSPECT_TIMEOUT", "1.0"))
+## Recent timing samples kept in Redis per series
+QUEUE_METRICS_SAMPLES = int(os.getenv("QUEUE_METRICS_SAMPLES", "1000"))
+## Window for throughput (completed tasks per minute)
+QUEUE_METRICS_THROUGHPUT_WINDOW_SECONDS = int(os.getenv("QUEUE_METRICS_THROUGHPUT_WINDOW_SECONDS", "300"))
+
+WAIT_SAMPLES_KEY = "metrics:queue_wait"
+RUNTIME_SAMPLES_KEY = "metrics:task_runtime"
+
+PERCENTILES = (50, 90, 99)
+
+_recorder = None
+
+
+def record_sample(key: str, sample: dict, max_samples: int = QUEUE_METRICS_SAMPLES):
+    """Append a timing sample to a capped Redis list; best-effort, never fails the caller"""
+    global _recorder
+    try:
+        if _recorder is None:
+            _recorder = redis.Redis.from_url(REDIS_URL)
+        pipe = _recorder.pipeline(transaction=False)
+        pipe.lpush(key, json.dumps(sample))
+        pipe.ltrim(key, 0, max_samples - 1)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def percentiles(values: list, points=PERCENTILES) -> dict:
+    """Nearest-rank percentiles, e.g. {"p50": ..., "p90": ..., "p99": ...}"""
+    if not values:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(values)
+    return {
+        f"p{point}": round(ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))], 3)
+        for point in points
+    }
+
+
+class QueueMetricsCollector:
+    """
+    Refreshes a queue snapshot in the background so /queue/status and /metrics
+    never wait on workers:
+
+    - worker RPCs (active, reserved, stats) with a short reply timeout;
+    - broker backlog as the Redis list length of each Celery queue;
+    - queue-wait (overall and per priority class) and runtime percentiles plus
+      throughput from the samples workers record once a task has run.
+
+    The blocking collection runs in a thread; the API only reads `snapshot`.
+    """
+
+    def __init__(self, celery_app=None, interval: float = QUEUE_METRICS_INTERVAL_SECONDS,
+                 inspect_timeout: float = QUEUE_METRICS_INSPECT_TIMEOUT, redis_url: str = REDIS_URL):
+        self._celery_app = celery_app
+        self.interval = interval
+        self.inspect_timeout = inspect_timeout
+        self._redis_url = redis_url
+        self._client = None
+        self._task = None
+        self.snapshot = {"status": "collecting", "collected_at": None}
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    @property
+    def celery_app(self):
+        if self._celery_app is None:
+            from celery_worker import celery_app
+            self._celery_app = celery_app
+        return self._celery_app
+
+    def queue_names(self) -> list:
+        names = [self.celery_app.conf.task_default_queue]
+        names += [queue.name for queue in (self.celery_app.conf.task_queues or ()) if queue.name not in names]
+        return names
+
+    def _samples(self, key: str) -> list:
+        return [json.loads(raw) for raw in self.client.lrange(key, 0, -1)]
+
+    def collect(self) -> dict:
+        started = time.perf_counter()
+        now = time.time()
+        inspect = self.celery_app.control.inspect(timeout=self.inspect_timeout)
+        active = inspect.active() or {}
+        reserved = inspect.reserved() or {}
+        stats = inspect.stats() or {}
+
+        broker = {name: self.client.llen(name) for name in self.queue_names()}
+        active_ages = [now - task["time_start"] for tasks in active.values() for task in tasks if task.get("time_start")]
+        waits = self._samples(WAIT_SAMPLES_KEY)
+        runtimes = self._samples(RUNTIME_SAMPLES_KEY)
+        window = [sample for sample in runtimes if now - sample["t"] <= QUEUE_METRICS_THROUGHPUT_WINDOW_SECONDS]
+        waits_by_priority = {}
+        for sample in waits:
+            if sample.get("priority"):
+                waits_by_priority.setdefault(sample["priority"], []).append(sample["v"])
+
+        workers = {
+            name: {
+                "active": len(active.get(name, [])),
+                "reserved": len(reserved.get(name, [])),
+                "concurrency": (stats.get(name, {}).get("pool") or {}).get("max-concurrency"),
+                "processed": sum((stats.get(name, {}).get("total") or {}).values()),
+            }
+            for name in sorted(set(active) | set(reserved) | set(stats))
+        }
+        active_count = sum(worker["active"] for worker in workers.values())
+        reserved_count = sum(worker["reserved"] for worker in workers.values())
+        return {
+            "status": "redis_connected",
+            "active_tasks": active_count,
+            "reserved_tasks": reserved_count,
+            "broker_queue_length": broker,
+            "queued_tasks": reserved_count + sum(broker.values()),
+            "workers": list(workers),
+            "worker_details": workers,
+            "active_task_age_seconds": percentiles(active_ages),
+            "queue_wait_seconds": percentiles([sample["v"] for sample in waits]),
+            "queue_wait_seconds_by_priority": {
+                priority: percentiles(values) for priority, values in sorted(waits_by_priority.items())
+            },
+            "runtime_seconds": percentiles([sample["v"] for sample in runtimes]),
+            "throughput_per_minute": round(len(window) * 60 / QUEUE_METRICS_THROUGHPUT_WINDOW_SECONDS, 2),
+            "failures_in_window": sum(1 for sample in window if sample.get("state") != "SUCCESS"),
+            "collected_at": now,
+            "collection_seconds": round(time.perf_counter() - started, 3),
+        }
+
+    async def run(self):
+        from starlette.concurrency import run_in_threadpool
+
+        while True:
+            try:
+                self.snapshot = await run_in_threadpool(self.collect)
+            except Exception as e:
+                ## Keep serving the last good numbers, flagged with the error
+                self.snapshot = {**self.snapshot, "status": "redis_unavailable", "error": str(e)}
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def current(self) -> dict:
+        collected_at = self.snapshot.get("collected_at")
+        age = round(time.time() - collected_at, 1) if collected_at else None
+        return {**self.snapshot, "snapshot_age_seconds": age}
+
+    def prometheus(self) -> str:
+        """The snapshot in Prometheus text exposition format"""
+        snapshot = self.snapshot
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        metric("fda_up", "gauge", "1 if the last queue collection succeeded",
+               [({}, 1 if snapshot.get("status") == "redis_connected" else 0)])
+        if snapshot.get("collected_at") is None:
+            return "\n".join(lines) + "\n"
+        metric("fda_broker_queue_length", "gauge", "Messages waiting in the broker per queue",
+               [({"queue": name}, length) for name, length in snapshot.get("broker_queue_length", {}).items()])
+        metric("fda_worker_active_tasks", "gauge", "Tasks executing per worker",
+               [({"worker": name}, worker["active"]) for name, worker in snapshot.get("worker_details", {}).items()])
+        metric("fda_worker_reserved_tasks", "gauge", "Tasks prefetched but not started per worker",
+               [({"worker": name}, worker["reserved"]) for name, worker in snapshot.get("worker_details", {}).items()])
+        metric("fda_worker_processed_tasks_total", "counter", "Tasks processed per worker since it started",
+               [({"worker": name}, worker["processed"]) for name, worker in snapshot.get("worker_details", {}).items()])
+        for name, key, help_text in (
+            ("fda_queue_wait_seconds", "queue_wait_seconds", "Time from publish to task start over recent tasks"),
+            ("fda_task_runtime_seconds", "runtime_seconds", "Task execution time over recent tasks"),
+            ("fda_active_task_age_seconds", "active_task_age_seconds", "Age of currently executing tasks"),
+        ):
+            metric(name, "gauge", help_text,
+                   [({"quantile": str(int(point[1:]) / 100)}, value) for point, value in snapshot.get(key, {}).items()])
+        metric("fda_priority_queue_wait_seconds", "gauge", "Time from publish to task start per priority class",
+               [({"priority": priority, "quantile": str(int(point[1:]) / 100)}, value)
+                for priority, points in snapshot.get("queue_wait_seconds_by_priority", {}).items()
+                for point, value in points.items()])
+        metric("fda_throughput_per_minute", "gauge", "Completed tasks per minute over the throughput window",
+               [({}, snapshot.get("throughput_per_minute"))])
+        metric("fda_snapshot_timestamp_seconds", "gauge", "When the snapshot was collected",
+               [({}, snapshot.get("collected_at"))])
+        return "\n".join(lines) + "\n"
+
+
+## Process-wide collector started by the API
+queue_metrics_collector = QueueMetricsCollector()
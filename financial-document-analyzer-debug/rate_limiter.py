@@ -0,0 +1,245 @@
+## Cluster-wide LLM rate limiting: requests/tokens per minute per model, plus per-job token budgets
+import os
+import json
+import time
+import uuid
+import random
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+from tracing import set_attributes
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+## "redis" shares the limits across every process; "local" limits this process only (tests, dev)
+LLM_RATE_LIMIT_BACKEND = os.getenv("LLM_RATE_LIMIT_BACKEND", "redis")
+## Account quota per model (0 = unlimited); per-model overrides as JSON,
+## e.g. {"gpt-4o": {"rpm": 500, "tpm": 30000}}
+LLM_RPM = int(os.getenv("LLM_RPM", "500"))
+LLM_TPM = int(os.getenv("LLM_TPM", "200000"))
+LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+## Completion tokens reserved per call until the actual size is known
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "1000"))
+## Running jobs may together hold this many minutes of the token quota; later jobs wait to start
+LLM_JOB_BUDGET_MINUTES = float(os.getenv("LLM_JOB_BUDGET_MINUTES", "2"))
+## Budget of a job whose process died is reclaimed after this long
+LLM_JOB_BUDGET_LEASE_SECONDS = int(os.getenv("LLM_JOB_BUDGET_LEASE_SECONDS", "3600"))
+LLM_JOB_BUDGET_POLL_SECONDS = float(os.getenv("LLM_JOB_BUDGET_POLL_SECONDS", "1"))
+
+KEY_PREFIX = "llm-limit:"
+
+## Refill both buckets for the time elapsed (Redis clock, shared by all workers), then take
+## one request and `tokens` tokens, or return how long to wait until both would be available
+_TAKE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts')
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local req = math.min(rpm, (tonumber(state[1]) or rpm) + elapsed * rpm / 60)
+local tok = math.min(tpm, (tonumber(state[2]) or tpm) + elapsed * tpm / 60)
+local wait = 0
+if rpm > 0 and req < 1 then wait = (1 - req) * 60 / rpm end
+if tpm > 0 and tok < cost then wait = math.max(wait, (cost - tok) * 60 / tpm) end
+if wait == 0 then
+    req = req - 1
+    tok = tok - cost
+end
+redis.call('HSET', KEYS[1], 'req', req, 'tok', tok, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+## Admit a job if the budgets held by other live jobs leave room for it (a job alone is always
+## admitted, however large). Entries are "tokens expiry" per job id.
+_RESERVE_JOB = """
+local now = tonumber(redis.call('TIME')[1])
+local used = 0
+local entries = redis.call('HGETALL', KEYS[1])
+for i = 1, #entries, 2 do
+    local tokens, expiry = string.match(entries[i + 1], '(%S+) (%S+)')
+    if tonumber(expiry) < now then
+        redis.call('HDEL', KEYS[1], entries[i])
+    elseif entries[i] ~= ARGV[1] then
+        used = used + tonumber(tokens)
+    end
+end
+if used > 0 and used + tonumber(ARGV[2]) > tonumber(ARGV[3]) then return 0 end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ' ' .. (now + tonumber(ARGV[4])))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+def model_limits(model: str) -> tuple:
+    """(requests per minute, tokens per minute) for `model`"""
+    limits = LLM_RATE_LIMITS.get(model, {})
+    return int(limits.get("rpm", LLM_RPM)), int(limits.get("tpm", LLM_TPM))
+
+
+class Reservation:
+    """Tokens taken for one call; `settle` corrects the bucket once the real size is known"""
+
+    def __init__(self, limiter, model: str, tokens: int):
+        self._limiter = limiter
+        self.model = model
+        self.tokens = tokens
+
+    def settle(self, actual_tokens: int):
+        if actual_tokens != self.tokens:
+            self._limiter.adjust(self.model, actual_tokens - self.tokens)
+            self.tokens = actual_tokens
+
+
+class LocalRateLimiter:
+    """
+    In-process token buckets and job budgets with the same behaviour as the
+    Redis limiter. Limits apply to this process only, so it serves tests and
+    single-process setups, and is the Redis limiter's fallback when Redis is
+    unreachable. `clock` and `sleep` can be replaced to test without waiting.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets = {}      ## model -> [requests, tokens, last refill]
+        self._jobs = {}         ## model -> {job id: tokens}
+
+    def _take(self, model: str, tokens: int) -> float:
+        rpm, tpm = model_limits(model)
+        with self._lock:
+            now = self.clock()
+            req, tok, last = self._buckets.get(model, (rpm, tpm, now))
+            elapsed = max(0.0, now - last)
+            req = min(rpm, req + elapsed * rpm / 60)
+            tok = min(tpm, tok + elapsed * tpm / 60)
+            wait = 0.0
+            if rpm > 0 and req < 1:
+                wait = (1 - req) * 60 / rpm
+            if tpm > 0 and tok < tokens:
+                wait = max(wait, (tokens - tok) * 60 / tpm)
+            if wait == 0:
+                req, tok = req - 1, tok - tokens
+            self._buckets[model] = [req, tok, now]
+            return wait
+
+    def adjust(self, model: str, tokens: int):
+        """Charge (or refund, if negative) tokens to the model's bucket"""
+        rpm, tpm = model_limits(model)
+        with self._lock:
+            req, tok, last = self._buckets.get(model, (rpm, tpm, self.clock()))
+            self._buckets[model] = [req, tok - tokens, last]
+
+    def _reserve_job(self, model: str, job_id: str, tokens: int, capacity: int) -> bool:
+        with self._lock:
+            jobs = self._jobs.setdefault(model, {})
+            used = sum(held for other, held in jobs.items() if other != job_id)
+            if used and used + tokens > capacity:
+                return False
+            jobs[job_id] = tokens
+            return True
+
+    def _release_job(self, model: str, job_id: str):
+        with self._lock:
+            self._jobs.get(model, {}).pop(job_id, None)
+
+    def acquire(self, model: str, tokens: int) -> Reservation:
+        """Block until one request and `tokens` tokens are available for `model`"""
+        rpm, tpm = model_limits(model)
+        ## A call larger than the whole bucket could never fit; let it through on a full bucket
+        tokens = min(tokens, tpm) if tpm else tokens
+        waited = 0.0
+        if rpm or tpm:
+            while True:
+                wait = self._take(model, tokens)
+                if not wait:
+                    break
+                ## Jitter keeps waiting workers from retrying in lockstep
+                wait *= random.uniform(1.0, 1.2)
+                self.sleep(wait)
+                waited += wait
+        set_attributes({"llm.rate_limit_wait_seconds": round(waited, 3)})
+        return Reservation(self, model, tokens)
+
+    @contextmanager
+    def call(self, model: str, prompt_tokens: int, completion_tokens: int = LLM_COMPLETION_TOKENS_ESTIMATE):
+        """Wrap one LLM call; settle the yielded reservation with the call's real token count"""
+        yield self.acquire(model, prompt_tokens + completion_tokens)
+
+    @contextmanager
+    def job(self, model: str, tokens: int):
+        """
+        Hold `tokens` of the model's job budget (LLM_JOB_BUDGET_MINUTES of its
+        token quota) for the duration of a job, waiting until it fits.
+        """
+        _, tpm = model_limits(model)
+        capacity = int(tpm * LLM_JOB_BUDGET_MINUTES)
+        if not capacity:
+            yield
+            return
+        job_id = uuid.uuid4().hex
+        started = self.clock()
+        while not self._reserve_job(model, job_id, tokens, capacity):
+            self.sleep(LLM_JOB_BUDGET_POLL_SECONDS * random.uniform(1.0, 1.5))
+        set_attributes({"llm.job_budget_wait_seconds": round(self.clock() - started, 3)})
+        try:
+            yield
+        finally:
+            self._release_job(model, job_id)
+
+
+class RedisRateLimiter(LocalRateLimiter):
+    """
+    Token buckets and job budgets kept in Redis, so the limits hold for the
+    whole cluster rather than per worker process. Buckets refill continuously
+    on the Redis clock. If Redis cannot be reached, the process falls back to
+    its local buckets rather than failing the job.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, lease: int = LLM_JOB_BUDGET_LEASE_SECONDS):
+        super().__init__()
+        self.lease = lease
+        self._redis_url = redis_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def _take(self, model: str, tokens: int) -> float:
+        rpm, tpm = model_limits(model)
+        try:
+            return float(self.client.eval(_TAKE, 1, f"{KEY_PREFIX}{model}", rpm, tpm, tokens))
+        except redis.RedisError:
+            return super()._take(model, tokens)
+
+    def adjust(self, model: str, tokens: int):
+        try:
+            self.client.hincrbyfloat(f"{KEY_PREFIX}{model}", "tok", -tokens)
+        except redis.RedisError:
+            super().adjust(model, tokens)
+
+    def _reserve_job(self, model: str, job_id: str, tokens: int, capacity: int) -> bool:
+        try:
+            return bool(self.client.eval(_RESERVE_JOB, 1, f"{KEY_PREFIX}{model}:jobs",
+                                         job_id, tokens, capacity, self.lease))
+        except redis.RedisError:
+            return super()._reserve_job(model, job_id, tokens, capacity)
+
+    def _release_job(self, model: str, job_id: str):
+        try:
+            self.client.hdel(f"{KEY_PREFIX}{model}:jobs", job_id)
+        except redis.RedisError:
+            pass
+        super()._release_job(model, job_id)
+
+
+## Process-wide limiter used by every LLM call
+llm_rate_limiter = RedisRateLimiter() if LLM_RATE_LIMIT_BACKEND == "redis" else LocalRateLimiter()
@@ -0,0 +1,326 @@
+## Compact storage of finished analysis results: compressed, small ones in Redis, large ones as blobs
+import os
+import io
+import gzip
+import json
+import time
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+try:
+    import zstandard
+except ImportError:  ## optional: results fall back to gzip
+    zstandard = None
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+## "zstd" (default when the zstandard package is installed), "gzip" or "none"
+RESULT_CODECS = ("zstd", "gzip", "none")
+RESULT_CODEC = os.getenv("RESULT_CODEC", "zstd" if zstandard is not None else "gzip")
+## zstd accepts 1-22, gzip 1-9; 6 is a good ratio at a few ms per result for both
+RESULT_COMPRESSION_LEVEL = int(os.getenv("RESULT_COMPRESSION_LEVEL", "6"))
+## Compressed results up to this size are kept in Redis; larger ones are written to RESULT_BLOB_DIR
+RESULT_INLINE_MAX_BYTES = int(os.getenv("RESULT_INLINE_MAX_BYTES", str(32 * 1024)))
+## A local directory shared by workers and API, or an fsspec URL such as s3://bucket/results
+## (needs fsspec and the backend's package, e.g. s3fs)
+RESULT_BLOB_DIR = os.getenv("RESULT_BLOB_DIR", "data/.results")
+## How long results are kept; also the expiry of the Celery result that points at them
+RESULT_TTL_SECONDS = int(os.getenv("RESULT_TTL_SECONDS", "3600"))
+## Expired local blobs are swept by one worker per interval (object stores use lifecycle rules)
+RESULT_PURGE_INTERVAL_SECONDS = int(os.getenv("RESULT_PURGE_INTERVAL_SECONDS", "600"))
+
+KEY_PREFIX = "result:"
+STREAM_CHUNK_BYTES = 64 * 1024
+## Result fields kept next to the pointer in the Celery backend: enough for status checks
+## (coalescing, batch progress) without fetching the payload
+SUMMARY_FIELDS = ("status", "query", "file_processed", "execution_mode", "elapsed_seconds")
+_EXTENSIONS = {"zstd": ".json.zst", "gzip": ".json.gz", "none": ".json"}
+
+
+class ResultExpired(LookupError):
+    """The stored payload of a result is past its retention or was removed"""
+
+
+def is_stored(value) -> bool:
+    """True for the pointer a task returns instead of its full result"""
+    return isinstance(value, dict) and isinstance(value.get("stored_result"), dict)
+
+
+def _compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=level)
+    return data
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    """GzipFile that also closes the stream it reads from"""
+
+    def close(self):
+        source = self.fileobj
+        super().close()
+        if source is not None:
+            source.close()
+
+
+def _decompressing_reader(stream, codec: str):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Result was stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(stream, closefd=True)
+    if codec == "gzip":
+        return _ClosingGzipFile(fileobj=stream, mode="rb")
+    return stream
+
+
+def iter_stream(stream, chunk_size: int = STREAM_CHUNK_BYTES):
+    """Read an opened payload in chunks and close it"""
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            yield chunk
+    finally:
+        stream.close()
+
+
+def iter_range(stream, start: int, end: int, chunk_size: int = STREAM_CHUNK_BYTES):
+    """Bytes `start`..`end` (inclusive) of an opened payload; the skipped prefix is read, not kept"""
+    try:
+        position = 0
+        while position < start:
+            skipped = stream.read(min(chunk_size, start - position))
+            if not skipped:
+                return
+            position += len(skipped)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = stream.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        stream.close()
+
+
+def parse_byte_range(header: str, size: int):
+    """
+    (start, end) of a single `Range: bytes=...` header, None when it is not
+    one the server can apply (the full document is sent), and ValueError
+    when the range lies outside the document.
+    """
+    unit, _, spec = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} is outside the {size}-byte result")
+    return start, end
+
+
+class ResultStore:
+    """
+    Storage of finished task results outside the Celery result backend.
+
+    A result is serialized to JSON and compressed once. Payloads up to
+    `inline_max_bytes` are kept under `result:<task_id>` in Redis; larger ones
+    are written to `blob_dir`. Either way the Celery backend only holds a
+    pointer (`stored_result`) plus a few summary fields, all expiring after `ttl`.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, blob_dir: str = RESULT_BLOB_DIR, codec: str = RESULT_CODEC,
+                 level: int = RESULT_COMPRESSION_LEVEL, inline_max_bytes: int = RESULT_INLINE_MAX_BYTES,
+                 ttl: int = RESULT_TTL_SECONDS, purge_interval: int = RESULT_PURGE_INTERVAL_SECONDS):
+        if codec not in RESULT_CODECS:
+            raise ValueError(f"Unknown result codec '{codec}', expected one of {RESULT_CODECS}")
+        if codec == "zstd" and zstandard is None:
+            codec = "gzip"
+        self.blob_dir = blob_dir
+        self.codec = codec
+        self.level = level
+        self.inline_max_bytes = inline_max_bytes
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._redis_url = redis_url
+        self._client = None
+        self._fs = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        ## Payloads are binary, unlike the JSON values of the other stores
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url)
+        return self._client
+
+    @property
+    def remote(self) -> bool:
+        return "://" in self.blob_dir
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            import fsspec
+            self._fs = fsspec.url_to_fs(self.blob_dir)[0]
+        return self._fs
+
+    def _blob_path(self, task_id: str, codec: str) -> str:
+        return f"{self.blob_dir.rstrip('/')}/{task_id[:2]}/{task_id}{_EXTENSIONS[codec]}"
+
+    def _write_blob(self, path: str, payload: bytes):
+        if self.remote:
+            self.fs.pipe_file(path, payload)
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            ## Atomic rename so the API never streams a half-written blob
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_blob(self, path: str):
+        try:
+            if self.remote:
+                self.fs.rm_file(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+
+    def save(self, task_id: str, result: dict) -> dict:
+        """Store `result` and return the pointer to keep in the Celery backend instead"""
+        data = json.dumps(result, default=str).encode("utf-8")
+        payload = _compress(data, self.codec, self.level)
+        reference = {
+            "codec": self.codec,
+            "bytes": len(data),
+            "stored_bytes": len(payload),
+            "expires_at": round(time.time() + self.ttl, 3),
+        }
+        if len(payload) <= self.inline_max_bytes:
+            reference.update(location="redis", key=f"{KEY_PREFIX}{task_id}")
+            self.client.set(reference["key"], payload, ex=self.ttl)
+        else:
+            reference.update(location="blob", path=self._blob_path(task_id, self.codec))
+            self._write_blob(reference["path"], payload)
+            self._maybe_purge()
+        return {**{name: result[name] for name in SUMMARY_FIELDS if name in result}, "stored_result": reference}
+
+    def open_payload(self, value, decompress: bool = True):
+        """
+        Binary stream of a stored result's JSON (or, with `decompress=False`, of
+        the stored bytes in the pointer's codec). Raises ResultExpired when gone.
+        """
+        reference = value["stored_result"]
+        if reference["expires_at"] < time.time():
+            if reference["location"] == "blob":
+                self._remove_blob(reference["path"])
+            raise ResultExpired("Stored result has expired")
+        try:
+            if reference["location"] == "redis":
+                payload = self.client.get(reference["key"])
+                if payload is None:
+                    raise FileNotFoundError(reference["key"])
+                stream = io.BytesIO(payload)
+            elif self.remote:
+                stream = self.fs.open(reference["path"], "rb")
+            else:
+                stream = open(reference["path"], "rb")
+        except FileNotFoundError:
+            raise ResultExpired("Stored result is no longer available")
+        return _decompressing_reader(stream, reference["codec"]) if decompress else stream
+
+    def load(self, value):
+        """
+        Full result for a pointer returned by save(); other values are returned
+        unchanged. A pointer whose payload is gone yields its summary with
+        status "expired".
+        """
+        if not is_stored(value):
+            return value
+        try:
+            with self.open_payload(value) as stream:
+                return json.loads(stream.read())
+        except ResultExpired as e:
+            summary = {name: value[name] for name in SUMMARY_FIELDS if name in value}
+            return {**summary, "status": "expired", "error": str(e)}
+
+    def _maybe_purge(self):
+        if self.remote or self.purge_interval <= 0:
+            return
+        try:
+            if not self.client.set(f"{KEY_PREFIX}purge-lock", os.getpid(), nx=True, ex=self.purge_interval):
+                return
+        except redis.RedisError:
+            return
+        threading.Thread(target=self.purge_expired, name="result-purge", daemon=True).start()
+
+    def purge_expired(self, now: float = None) -> int:
+        """Delete local blobs older than the retention; returns how many were removed"""
+        if self.remote:
+            return 0
+        cutoff = (now or time.time()) - self.ttl
+        removed = 0
+        with self._lock:
+            for directory, _, files in os.walk(self.blob_dir):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+
+def _normalize(name: str) -> str:
+    return "_".join(name.lower().replace("-", " ").replace("_", " ").split())
+
+
+def select_section(result: dict, section: str):
+    """
+    One section of an analysis, e.g. "risk" or "risk_assessment": the output
+    of the matching crew stage when the result has it, otherwise the matching
+    "## ..." section of the report. Returns (section name, text) or None.
+    """
+    wanted = _normalize(section)
+    for stage, output in (result.get("stage_outputs") or {}).items():
+        if wanted in stage:
+            return stage, output
+
+    lines = (result.get("analysis") or "").split("\n")
+    for start, line in enumerate(lines):
+        if not line.startswith("#"):
+            continue
+        level = len(line) - len(line.lstrip("#"))
+        title = _normalize(line.lstrip("#").strip(" —-:"))
+        if wanted not in title:
+            continue
+        end = next((index for index in range(start + 1, len(lines))
+                    if lines[index].startswith("#") and len(lines[index]) - len(lines[index].lstrip("#")) <= level),
+                   len(lines))
+        return title, "\n".join(lines[start:end]).strip()
+    return None
+
+
+def select_fields(result: dict, fields: list) -> dict:
+    return {name: result[name] for name in fields if name in result}
+
+
+## Process-wide store used by the worker (writes) and the API (reads)
+result_store = ResultStore()
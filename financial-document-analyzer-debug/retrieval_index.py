@@ -0,0 +1,283 @@
+## Per-document retrieval index persisted next to the parsed-text cache
+import os
+import re
+import gzip
+import json
+import math
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import NamedTuple
+from dotenv import load_dotenv
+load_dotenv()
+
+from doc_cache import document_cache, DOC_CACHE_DIR, PARSER_VERSION
+from text_normalizer import find_headings
+
+## Bump whenever passage splitting or scoring changes so stale indexes are rebuilt
+INDEX_VERSION = "bm25-1"
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+## Passage size in words; long sections are split into overlapping windows
+RETRIEVAL_PASSAGE_WORDS = int(os.getenv("RETRIEVAL_PASSAGE_WORDS", "220"))
+RETRIEVAL_PASSAGE_OVERLAP = int(os.getenv("RETRIEVAL_PASSAGE_OVERLAP", "40"))
+## Indexes kept in memory per process
+RETRIEVAL_INDEX_MEMORY_ENTRIES = int(os.getenv("RETRIEVAL_INDEX_MEMORY_ENTRIES", "16"))
+## Optional directory with an ONNX sentence-embedding model (model.onnx + tokenizer.json);
+## when unset, retrieval is BM25 only
+RETRIEVAL_EMBEDDING_MODEL = os.getenv("RETRIEVAL_EMBEDDING_MODEL", "")
+
+## Numbers keep their separators so "1,234.5" and "2025" stay searchable as one token
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what which with"
+    .split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class Passage(NamedTuple):
+    page: int
+    section: str
+    text: str
+
+
+class SearchHit(NamedTuple):
+    page: int
+    section: str
+    text: str
+    score: float
+
+
+def split_passages(pages: list, max_words: int = RETRIEVAL_PASSAGE_WORDS,
+                   overlap: int = RETRIEVAL_PASSAGE_OVERLAP) -> list:
+    """Split normalized pages into section-aligned passages of at most `max_words` words"""
+    passages = []
+    section = ""
+    step = max(1, max_words - overlap)
+    for page_number, page_text in enumerate(pages, start=1):
+        starts, titles = find_headings(page_text)
+        bounds = [0] + starts + [len(page_text)]
+        ## Text before the first heading continues the previous page's section
+        labels = [section] + titles
+        for start, end, label in zip(bounds, bounds[1:], labels):
+            section = label
+            words = page_text[start:end].split()
+            for offset in range(0, len(words), step):
+                passages.append(Passage(page_number, section, " ".join(words[offset:offset + max_words])))
+                if offset + max_words >= len(words):
+                    break
+    return passages
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index of passage term frequencies"""
+
+    def __init__(self, postings: dict, doc_lengths: list, k1: float = 1.5, b: float = 0.75):
+        self.postings = postings        ## term -> [[passage id, term frequency], ...]
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        count = len(doc_lengths)
+        self.avg_length = (sum(doc_lengths) / count) if count else 0.0
+        self.idf = {
+            term: math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in postings.items()
+        }
+
+    @classmethod
+    def build(cls, texts: list) -> "BM25Index":
+        postings = {}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append([doc_id, frequency])
+        return cls(postings, doc_lengths)
+
+    def scores(self, query: str) -> dict:
+        """passage id -> BM25 score, for passages sharing at least one query term"""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def to_dict(self) -> dict:
+        return {"postings": self.postings, "doc_lengths": self.doc_lengths, "k1": self.k1, "b": self.b}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        return cls(data["postings"], data["doc_lengths"], data["k1"], data["b"])
+
+
+class OnnxEmbedder:
+    """Mean-pooled, L2-normalized sentence embeddings from a local ONNX model"""
+
+    def __init__(self, model_dir: str, max_length: int = 256, batch_size: int = 32):
+        import numpy as np
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self._np = np
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def encode(self, texts: list):
+        np = self._np
+        vectors = []
+        for offset in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[offset:offset + self.batch_size])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            feeds = {name: value for name, value in feeds.items() if name in self._input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = feeds["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            vectors.append(pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-9, None))
+        return np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+class DocumentIndex:
+    """Passages of one document with a BM25 index and, optionally, passage embeddings"""
+
+    def __init__(self, passages: list, bm25: BM25Index, embeddings=None, embedder: OnnxEmbedder = None):
+        self.passages = passages
+        self.bm25 = bm25
+        self.embeddings = embeddings
+        self.embedder = embedder
+
+    @classmethod
+    def build(cls, pages: list, embedder: OnnxEmbedder = None) -> "DocumentIndex":
+        passages = split_passages(pages)
+        texts = [passage.text for passage in passages]
+        embeddings = embedder.encode(texts) if embedder is not None and texts else None
+        return cls(passages, BM25Index.build(texts), embeddings, embedder)
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> list:
+        """
+        Top-k passages for the query. With embeddings, BM25 and cosine rankings
+        are merged by reciprocal rank fusion so exact figures and paraphrases
+        both surface.
+        """
+        lexical = self.bm25.scores(query)
+        if self.embeddings is None or self.embedder is None or not len(self.embeddings):
+            ranked = sorted(lexical.items(), key=lambda item: -item[1])
+        else:
+            semantic = self.embeddings @ self.embedder.encode([query])[0]
+            fused = {}
+            for rank, (doc_id, _) in enumerate(sorted(lexical.items(), key=lambda item: -item[1])):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (60 + rank)
+            for rank, doc_id in enumerate(semantic.argsort()[::-1][:max(top_k * 10, 50)]):
+                fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1 / (60 + rank)
+            ranked = sorted(fused.items(), key=lambda item: -item[1])
+        return [SearchHit(*self.passages[doc_id], round(score, 4)) for doc_id, score in ranked[:top_k]]
+
+
+class DocumentIndexStore:
+    """
+    Builds each document's index once and persists it under the parsed-text
+    cache directory (`{key}.index.json.gz`, plus `{key}.emb.npy` when
+    embeddings are enabled), with a small per-process LRU in front.
+    """
+
+    def __init__(self, cache_dir: str = DOC_CACHE_DIR, max_entries: int = RETRIEVAL_INDEX_MEMORY_ENTRIES,
+                 embedding_model: str = RETRIEVAL_EMBEDDING_MODEL):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.embedding_model = embedding_model
+        self._model_name = os.path.basename(os.path.normpath(embedding_model)) if embedding_model else "none"
+        self._embedder = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def embedder(self):
+        if self.embedding_model and self._embedder is None:
+            self._embedder = OnnxEmbedder(self.embedding_model)
+        return self._embedder
+
+    def key(self, file_hash: str) -> str:
+        identity = f"{file_hash}:{PARSER_VERSION}:{INDEX_VERSION}:{self._model_name}"
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _disk_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}{suffix}")
+
+    def _remember(self, key: str, index: DocumentIndex):
+        with self._lock:
+            self._entries[key] = index
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key: str):
+        try:
+            with open(self._disk_path(key, ".index.json.gz"), "rb") as f:
+                data = json.loads(gzip.decompress(f.read()))
+            embeddings = None
+            if self.embedding_model:
+                import numpy as np
+                embeddings = np.load(self._disk_path(key, ".emb.npy"))
+        except Exception:
+            ## Missing, corrupt or partially written index — rebuild it
+            return None
+        passages = [Passage(*passage) for passage in data["passages"]]
+        return DocumentIndex(passages, BM25Index.from_dict(data["bm25"]), embeddings, self.embedder)
+
+    def _save(self, key: str, index: DocumentIndex):
+        index_path = self._disk_path(key, ".index.json.gz")
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        payload = gzip.compress(json.dumps({
+            "passages": [list(passage) for passage in index.passages],
+            "bm25": index.bm25.to_dict(),
+        }).encode("utf-8"), compresslevel=6)
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            if index.embeddings is not None:
+                import numpy as np
+                with open(self._disk_path(key, ".emb.npy") + suffix, "wb") as f:
+                    np.save(f, index.embeddings)
+                os.replace(self._disk_path(key, ".emb.npy") + suffix, self._disk_path(key, ".emb.npy"))
+            with open(index_path + suffix, "wb") as f:
+                f.write(payload)
+            ## The index file is written last, so its presence means the entry is complete
+            os.replace(index_path + suffix, index_path)
+        except OSError:
+            pass
+
+    def get_or_build(self, path: str, load_pages, file_hash: str = None) -> DocumentIndex:
+        """Return the index for `path`, building it from `load_pages(path)` only on a miss"""
+        key = self.key(file_hash or document_cache.file_hash(path))
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+                return index
+        index = self._load(key)
+        if index is None:
+            index = DocumentIndex.build(load_pages(path), self.embedder)
+            self._save(key, index)
+        self._remember(key, index)
+        return index
+
+
+## Process-wide index store used by the search tool
+retrieval_index_store = DocumentIndexStore()
@@ -0,0 +1,243 @@
+## Single-pass multi-pattern risk keyword scanner used by RiskTool
+import os
+import re
+import json
+import bisect
+import heapq
+import itertools
+from typing import NamedTuple
+from dotenv import load_dotenv
+load_dotenv()
+
+from text_normalizer import find_headings
+
+## Built-in taxonomy (the original RiskTool keywords, grouped by risk category).
+## Override with a JSON file of {"category": ["term", ...]} via RISK_TAXONOMY_PATH.
+DEFAULT_RISK_TAXONOMY = {
+    "market": ["competition", "decline", "demand", "volatility", "inflation"],
+    "financial": ["debt", "liability", "loss", "default", "interest rate", "liquidity", "impairment"],
+    "legal_regulatory": ["lawsuit", "litigation", "regulation", "regulatory", "investigation"],
+    "operational": ["supply chain", "disruption", "recall", "shortage"],
+    "general": ["risk", "uncertainty", "warning"],
+}
+
+RISK_TAXONOMY_PATH = os.getenv("RISK_TAXONOMY_PATH")
+## Page-streaming scans stop once every category has this many mentions and enough
+## candidate passages are collected (0 scans the whole document)
+RISK_EARLY_STOP_MENTIONS = int(os.getenv("RISK_EARLY_STOP_MENTIONS", "5"))
+
+class RiskMatch(NamedTuple):
+    category: str
+    term: str
+    start: int
+    end: int
+
+
+class RiskPassage(NamedTuple):
+    start: int
+    end: int
+    score: float
+    categories: tuple
+    terms: tuple
+    section: str
+    text: str
+    page: int = 0    ## 1-based page number when scanned page by page, else 0
+
+
+class RiskScanResult(NamedTuple):
+    category_counts: dict
+    passages: list
+    pages_scanned: int
+    stopped_early: bool
+
+
+def load_taxonomy(path: str = None) -> dict:
+    """Load a {category: [terms]} taxonomy from JSON, falling back to the built-in one"""
+    path = path or RISK_TAXONOMY_PATH
+    if not path:
+        return DEFAULT_RISK_TAXONOMY
+    with open(path, "r", encoding="utf-8") as f:
+        taxonomy = json.load(f)
+    if not isinstance(taxonomy, dict) or not all(isinstance(terms, list) for terms in taxonomy.values()):
+        raise ValueError(f"Risk taxonomy at {path} must be a JSON object of category -> list of terms")
+    return taxonomy
+
+
+def _canonical(term: str) -> str:
+    return " ".join(term.lower().split())
+
+
+def _variants(term: str):
+    """Surface forms matched for a term: plural forms keep "risks"/"liabilities" matching"""
+    yield term
+    yield term + "s"
+    yield term + "es"
+    if term.endswith("y"):
+        yield term[:-1] + "ies"
+
+
+def _trie_pattern(terms) -> str:
+    """
+    Compile terms into a prefix-trie regex (e.g. "li(?:ability|quidity)") so the
+    engine walks shared prefixes once instead of trying every term at every offset.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def emit(node) -> str:
+        terminal = "" in node
+        branches = []
+        for char in sorted(key for key in node if key):
+            piece = r"\s+" if char == " " else re.escape(char)
+            branches.append(piece + emit(node[char]))
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 and not terminal else f"(?:{'|'.join(branches)})"
+        return f"{body}?" if terminal else body
+
+    return emit(trie)
+
+
+class RiskScanner:
+    """Compiled matcher over a risk taxonomy; scans a document in one pass"""
+
+    def __init__(self, taxonomy: dict = None):
+        taxonomy = taxonomy if taxonomy is not None else load_taxonomy()
+        self.categories_by_term = {}
+        self.term_by_variant = {}
+        self.categories = frozenset(category for category, terms in taxonomy.items() if terms)
+        for category, terms in taxonomy.items():
+            for term in terms:
+                term = _canonical(term)
+                if not term:
+                    continue
+                self.categories_by_term.setdefault(term, []).append(category)
+                for variant in _variants(term):
+                    self.term_by_variant.setdefault(variant, term)
+        if not self.categories_by_term:
+            raise ValueError("Risk taxonomy contains no terms")
+        ## Longest match wins at each offset because the trie is greedy and backtracks
+        self.pattern = re.compile(rf"\b{_trie_pattern(self.term_by_variant)}\b", re.IGNORECASE)
+
+    def iter_matches(self, text: str):
+        for match in self.pattern.finditer(text):
+            term = self.term_by_variant.get(_canonical(match.group()))
+            for category in self.categories_by_term.get(term, ()):
+                yield RiskMatch(category, term, match.start(), match.end())
+
+    def scan(self, text: str = None, matches: list = None) -> dict:
+        """Return {category: [RiskMatch, ...]} with character offsets into `text`"""
+        grouped = {}
+        for match in (matches if matches is not None else self.iter_matches(text)):
+            grouped.setdefault(match.category, []).append(match)
+        return grouped
+
+    def passages(self, text: str, matches: list = None, context_chars: int = 240, max_passages: int = 12,
+                 max_chars: int = 6000, default_section: str = "", page: int = 0) -> list:
+        """
+        Ranked, deduplicated risk passages.
+
+        Each match is widened to `context_chars` on both sides (snapped to line
+        boundaries), overlapping windows are merged, and the merged passages are
+        scored by distinct terms and categories, with a boost inside risk sections.
+        Text before the first heading belongs to `default_section`.
+        """
+        matches = matches if matches is not None else list(self.iter_matches(text))
+        if not matches:
+            return []
+
+        section_starts, section_titles = find_headings(text)
+
+        windows = []
+        for match in matches:
+            start = text.rfind("\n", 0, max(0, match.start - context_chars)) + 1
+            end = text.find("\n", min(len(text), match.end + context_chars))
+            end = len(text) if end == -1 else end
+            if windows and start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], end)
+                windows[-1][2].append(match)
+            else:
+                windows.append([start, end, [match]])
+
+        ranked = []
+        for start, end, window_matches in windows:
+            terms = tuple(sorted({m.term for m in window_matches}))
+            categories = tuple(sorted({m.category for m in window_matches}))
+            index = bisect.bisect_right(section_starts, window_matches[0].start) - 1
+            section = section_titles[index] if index >= 0 else default_section
+            score = len(terms) + 0.5 * len(categories) + 0.1 * len(window_matches)
+            if "risk" in section.lower():
+                score *= 1.5
+            ranked.append(RiskPassage(start, end, round(score, 2), categories, terms, section,
+                                      text[start:end].strip(), page))
+
+        ranked.sort(key=lambda passage: passage.score, reverse=True)
+        selected, used = [], 0
+        for passage in ranked:
+            if len(selected) >= max_passages or used >= max_chars:
+                break
+            selected.append(passage)
+            used += len(passage.text)
+        ## Present the selected passages in document order
+        return sorted(selected, key=lambda passage: (passage.page, passage.start))
+
+    def scan_pages(self, pages, context_chars: int = 240, max_passages: int = 12, max_chars: int = 6000,
+                   early_stop_mentions: int = RISK_EARLY_STOP_MENTIONS) -> RiskScanResult:
+        """
+        Scan an iterable of pages (e.g. a lazy page stream) one page at a time.
+
+        Only category counts and the best candidate passages are kept, so memory
+        does not grow with the document. With `early_stop_mentions`, the stream
+        is abandoned once every category has that many mentions and
+        `max_passages` candidates are in hand.
+        """
+        counts = dict.fromkeys(self.categories, 0)
+        candidates = []     ## min-heap of (score, order, passage)
+        order = itertools.count()
+        section = ""
+        pages_scanned = 0
+        stopped_early = False
+        for page_number, page_text in enumerate(pages, start=1):
+            pages_scanned = page_number
+            matches = list(self.iter_matches(page_text))
+            for match in matches:
+                counts[match.category] = counts.get(match.category, 0) + 1
+            for passage in self.passages(page_text, matches, context_chars, max_passages, max_chars,
+                                         default_section=section, page=page_number):
+                entry = (passage.score, -next(order), passage)   ## ties keep the earlier passage
+                if len(candidates) < max_passages:
+                    heapq.heappush(candidates, entry)
+                else:
+                    heapq.heappushpop(candidates, entry)
+            titles = find_headings(page_text)[1]
+            section = titles[-1] if titles else section
+
+            if early_stop_mentions and len(candidates) >= max_passages and \
+                    all(count >= early_stop_mentions for count in counts.values()):
+                stopped_early = True
+                break
+
+        selected, used = [], 0
+        for _, _, passage in sorted(candidates, reverse=True):
+            if used >= max_chars:
+                break
+            selected.append(passage)
+            used += len(passage.text)
+        selected.sort(key=lambda passage: (passage.page, passage.start))
+        return RiskScanResult({category: count for category, count in counts.items() if count},
+                              selected, pages_scanned, stopped_early)
+
+
+_default_scanner = None
+
+
+def get_risk_scanner() -> RiskScanner:
+    """Process-wide scanner compiled once from the configured taxonomy"""
+    global _default_scanner
+    if _default_scanner is None:
+        _default_scanner = RiskScanner()
+    return _default_scanner
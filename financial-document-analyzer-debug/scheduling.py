@@ -0,0 +1,107 @@
+## Priority classes (one Celery queue each) and per-tenant concurrency caps within a class
+import os
+import re
+import json
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+## Interactive jobs are always taken before bulk ones (queues are consumed in this order)
+PRIORITY_QUEUES = {
+    "interactive": os.getenv("INTERACTIVE_QUEUE", "analysis.interactive"),
+    "bulk": os.getenv("BULK_QUEUE", "analysis.bulk"),
+}
+PRIORITIES = tuple(PRIORITY_QUEUES)
+DEFAULT_PRIORITY = "interactive"
+BATCH_DEFAULT_PRIORITY = "bulk"
+DEFAULT_TENANT = "default"
+
+## Jobs one tenant may run at once per priority class (0 = no cap)
+TENANT_CAPS = {
+    "interactive": int(os.getenv("TENANT_CAP_INTERACTIVE", "4")),
+    "bulk": int(os.getenv("TENANT_CAP_BULK", "2")),
+}
+## Per-tenant overrides, e.g. {"acme": {"bulk": 8}, "trial": {"interactive": 1, "bulk": 1}}
+TENANT_CAP_OVERRIDES = json.loads(os.getenv("TENANT_CAP_OVERRIDES", "{}"))
+## A job over its tenant's cap goes back to its queue and is retried after this delay
+TENANT_DEFER_SECONDS = float(os.getenv("TENANT_DEFER_SECONDS", "5"))
+## Slots of workers that died mid-job are reclaimed after this long
+TENANT_SLOT_LEASE_SECONDS = int(os.getenv("TENANT_SLOT_LEASE_SECONDS", str(2 * 3600)))
+
+KEY_PREFIX = "tenant-slots:"
+TENANT_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+## Take a slot unless the tenant is at its cap; a task that already holds one keeps it
+## (redelivered message). Members are task ids scored by lease expiry.
+_ACQUIRE = """
+redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[1])
+if redis.call('zscore', KEYS[1], ARGV[3]) then
+    redis.call('zadd', KEYS[1], ARGV[2], ARGV[3])
+    return 1
+end
+local cap = tonumber(ARGV[4])
+if cap > 0 and redis.call('zcard', KEYS[1]) >= cap then return 0 end
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[3])
+redis.call('expire', KEYS[1], ARGV[5])
+return 1
+"""
+
+
+def priority_for_queue(queue: str):
+    """Priority class of a queue name, or None for other queues"""
+    return next((priority for priority, name in PRIORITY_QUEUES.items() if name == queue), None)
+
+
+def tenant_cap(tenant: str, priority: str) -> int:
+    return int(TENANT_CAP_OVERRIDES.get(tenant, {}).get(priority, TENANT_CAPS.get(priority, 0)))
+
+
+class TenantSlots:
+    """
+    Counts the jobs each tenant is running per priority class, across all
+    workers, in one Redis sorted set per (class, tenant). A worker takes a
+    slot before it starts a job and gives it back when the job ends; a job
+    that finds its tenant at the cap is deferred, so the worker moves on to
+    other tenants' jobs and no tenant can fill every worker.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, lease: int = TENANT_SLOT_LEASE_SECONDS):
+        self.lease = lease
+        self._redis_url = redis_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    @staticmethod
+    def key(priority: str, tenant: str) -> str:
+        return f"{KEY_PREFIX}{priority}:{tenant}"
+
+    def acquire(self, priority: str, tenant: str, task_id: str) -> bool:
+        cap = tenant_cap(tenant, priority)
+        if cap <= 0:
+            return True
+        now = time.time()
+        try:
+            return bool(self.client.eval(_ACQUIRE, 1, self.key(priority, tenant),
+                                         now, now + self.lease, task_id, cap, self.lease))
+        except redis.RedisError:
+            ## Without Redis there is nothing to enforce the cap with; do not hold jobs back
+            return True
+
+    def release(self, priority: str, tenant: str, task_id: str):
+        try:
+            self.client.zrem(self.key(priority, tenant), task_id)
+        except redis.RedisError:
+            pass
+
+
+## Process-wide slot counter used by the worker
+tenant_slots = TenantSlots()
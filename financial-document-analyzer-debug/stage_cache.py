@@ -0,0 +1,109 @@
+## Per-stage crew output cache shared by the API and the Celery workers
+import os
+import json
+import hashlib
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STAGE_CACHE_TTL_SECONDS = int(os.getenv("STAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+## Bump to invalidate every cached stage output at once (e.g. after a tool change
+## that alters what agents see without touching any prompt)
+STAGE_CACHE_VERSION = os.getenv("STAGE_CACHE_VERSION", "1")
+
+KEY_PREFIX = "stage:"
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def _llm_model(agent) -> str:
+    llm = getattr(agent, "llm", None)
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or llm)
+
+
+def task_fingerprint(task, _seen: dict = None) -> str:
+    """
+    Hash of everything that shapes a task's output: its prompt templates, its
+    agent's configuration and model, its tool names, and — recursively — the
+    fingerprints of the tasks in its `context`. Editing a prompt in task.py or
+    an agent in agents.py therefore changes the fingerprint of that stage and of
+    every stage downstream of it, so stale outputs are never reused.
+    """
+    _seen = {} if _seen is None else _seen
+    if id(task) in _seen:
+        return _seen[id(task)]
+
+    agent = task.agent
+    context = task.context if isinstance(task.context, list) else []
+    definition = {
+        "version": STAGE_CACHE_VERSION,
+        "description": task._original_description or task.description,
+        "expected_output": task._original_expected_output or task.expected_output,
+        "tools": sorted(tool.name for tool in (task.tools or [])),
+        "agent": {
+            "role": agent._original_role or agent.role,
+            "goal": agent._original_goal or agent.goal,
+            "backstory": agent._original_backstory or agent.backstory,
+            "llm": _llm_model(agent),
+            "tools": sorted(tool.name for tool in (agent.tools or [])),
+            "max_iter": agent.max_iter,
+        } if agent is not None else None,
+        "context": [task_fingerprint(upstream, _seen) for upstream in context],
+    }
+    fingerprint = _sha256(json.dumps(definition, sort_keys=True))
+    _seen[id(task)] = fingerprint
+    return fingerprint
+
+
+class StageCache:
+    """
+    Redis-backed store of raw task outputs keyed by
+    (document hash, stage name, task fingerprint, model[, query]).
+
+    Lookups and writes never raise: when Redis is unreachable the pipeline
+    simply runs every stage.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, ttl: int = STAGE_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._redis_url = redis_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def key(self, file_hash: str, stage: str, fingerprint: str, model: str, query: str = None) -> str:
+        key = f"{KEY_PREFIX}{file_hash}:{stage}:{fingerprint[:24]}:{model}"
+        if query is not None:
+            key += f":{_sha256(' '.join(query.lower().split()))[:24]}"
+        return key
+
+    def get(self, key: str):
+        try:
+            return self.client.get(key)
+        except redis.RedisError:
+            return None
+
+    def put(self, key: str, output: str):
+        try:
+            self.client.set(key, output, ex=self.ttl)
+        except redis.RedisError:
+            pass
+
+    def invalidate_document(self, file_hash: str) -> int:
+        """Drop every cached stage output for one document; returns the number of keys removed"""
+        removed = 0
+        for key in self.client.scan_iter(match=f"{KEY_PREFIX}{file_hash}:*", count=500):
+            removed += self.client.delete(key)
+        return removed
+
+
+## Process-wide stage cache
+stage_cache = StageCache()
@@ -0,0 +1,153 @@
+## Bounded, cancellable executor for the synchronous /analyze path
+import os
+import asyncio
+import multiprocessing
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+from starlette.concurrency import run_in_threadpool
+
+SYNC_MAX_WORKERS = int(os.getenv("SYNC_MAX_WORKERS", "2"))
+SYNC_QUEUE_DEPTH = int(os.getenv("SYNC_QUEUE_DEPTH", "4"))
+SYNC_TIMEOUT_SECONDS = float(os.getenv("SYNC_TIMEOUT_SECONDS", "600"))
+## How long an admitted request may wait for a worker slot before it is turned away
+SYNC_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SYNC_QUEUE_TIMEOUT_SECONDS", "60"))
+SYNC_RETRY_AFTER_SECONDS = int(os.getenv("SYNC_RETRY_AFTER_SECONDS", "30"))
+## Job processes are forked from a server process that has already imported these modules,
+## so a job does not pay the crew stack's import time (falls back to spawn where unsupported)
+SYNC_START_METHOD = os.getenv("SYNC_START_METHOD", "forkserver")
+SYNC_PRELOAD_MODULES = [name for name in os.getenv("SYNC_PRELOAD_MODULES", "pipeline").split(",") if name]
+
+
+class ExecutorSaturated(Exception):
+    """All worker slots and queue slots are taken"""
+
+
+class JobTimeout(Exception):
+    """A job exceeded its timeout and its worker process was terminated"""
+
+
+class JobFailed(Exception):
+    """The job raised inside its worker process"""
+
+
+def _run_job(conn, fn, args):
+    """Child-process entry point: run the job and send back ("ok", result) or ("error", message)"""
+    try:
+        conn.send(("ok", fn(*args)))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _receive(conn):
+    try:
+        return conn.recv()
+    except (EOFError, OSError):
+        return ("error", "Worker process exited before returning a result")
+
+
+class BoundedCrewExecutor:
+    """
+    Runs blocking crew jobs off the event loop with admission control.
+
+    - At most `max_workers` jobs run at once, each in its own worker process so
+      a timed-out or abandoned job can be terminated cleanly (threads cannot be killed).
+    - At most `queue_depth` more requests may wait for a slot; anything beyond
+      that is rejected immediately with ExecutorSaturated, and so is a waiting
+      request that gets no slot within `queue_timeout`. The job timeout only
+      starts once the job has a slot.
+    """
+
+    def __init__(self, max_workers: int = SYNC_MAX_WORKERS, queue_depth: int = SYNC_QUEUE_DEPTH,
+                 timeout: float = SYNC_TIMEOUT_SECONDS, queue_timeout: float = SYNC_QUEUE_TIMEOUT_SECONDS,
+                 start_method: str = SYNC_START_METHOD,
+                 preload: list = SYNC_PRELOAD_MODULES):
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            self._context.set_forkserver_preload(preload)
+        self._workers = asyncio.Semaphore(max_workers)
+        self._admitted = 0
+        self._running = 0
+        self._counters = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0}
+
+    def warm(self):
+        """Start the fork server now, so it imports the preloaded modules before the first job"""
+        if self._context.get_start_method() == "forkserver":
+            from multiprocessing import forkserver
+            forkserver.ensure_running()
+
+    @asynccontextmanager
+    async def admit(self):
+        """Reserve a place in the executor, or fail fast when it is saturated"""
+        if self._admitted >= self.max_workers + self.queue_depth:
+            self._counters["rejected"] += 1
+            raise ExecutorSaturated(
+                f"Synchronous analysis is at capacity ({self.max_workers} running, {self.queue_depth} queued)"
+            )
+        self._admitted += 1
+        try:
+            yield
+        finally:
+            self._admitted -= 1
+
+    async def run(self, fn, *args, timeout: float = None):
+        """Run `fn(*args)` in a worker process; `fn`, its args and its result must be picklable"""
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._workers.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._counters["rejected"] += 1
+            raise ExecutorSaturated(
+                f"No synchronous analysis slot became free within {self.queue_timeout:.0f}s"
+            )
+        try:
+            parent_conn, child_conn = self._context.Pipe(duplex=False)
+            process = self._context.Process(target=_run_job, args=(child_conn, fn, args), daemon=True)
+            self._running += 1
+            try:
+                ## Inside the try: a failed start (fork/spawn error, unpicklable job) must not leak the slot
+                process.start()
+                child_conn.close()
+                status, payload = await asyncio.wait_for(run_in_threadpool(_receive, parent_conn), timeout)
+            except asyncio.TimeoutError:
+                self._counters["timed_out"] += 1
+                raise JobTimeout(f"Analysis exceeded the {timeout:.0f}s timeout and was cancelled")
+            finally:
+                ## Also reached when the client disconnects and the request is cancelled
+                self._running -= 1
+                if process.pid is not None:
+                    if process.is_alive():
+                        process.terminate()
+                    await run_in_threadpool(process.join, 5)
+                child_conn.close()
+                parent_conn.close()
+        finally:
+            self._workers.release()
+
+        if status != "ok":
+            self._counters["failed"] += 1
+            raise JobFailed(payload)
+        self._counters["completed"] += 1
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "queue_depth": self.queue_depth,
+            "running": self._running,
+            "waiting": max(0, self._admitted - self._running),
+            **self._counters,
+        }
+
+
+## Process-wide executor used by the /analyze endpoint
+sync_executor = BoundedCrewExecutor()
@@ -2,7 +2,7 @@
 from crewai import Task
 
 from agents import financial_analyst, verifier, investment_advisor, risk_assessor 
-from tools import  FinancialDocumentTool
+from tools import  FinancialDocumentTool, DocumentSearchTool, FinancialMetricsTool
 
 ## verify the document is a valid financial document
 
@@ -19,9 +19,7 @@ verification = Task(
        SEC filing, prospectus, etc.)
     3. Extract the company name, reporting period, and document date
     4. Flag any missing sections or anomalies that could affect analysis quality
-    5. Confirm the document is readable and not corrupted
-    
-    User query for context: {query}""",
+    5. Confirm the document is readable and not corrupted""",
     
     expected_output="""A structured verification report containing:
     - Document type and classification
@@ -32,20 +30,22 @@ verification = Task(
     - Clear confirmation: VERIFIED or NOT VERIFIED with reasoning""",
     
     agent=verifier,
-    tools=[FinancialDocumentTool.read_data_tool],
+    tools=[DocumentSearchTool.search_document_tool, FinancialDocumentTool.read_data_tool],
     async_execution=False
 )
 
 ## financial analysis
 analyze_financial_document = Task(
     description="""Perform a comprehensive financial analysis of the document 
-    at {file_path} to address the user's query: {query}
+    at {file_path}. The user's question is answered by the investment and risk 
+    stages, so cover the whole document rather than one topic.
     
     Your analysis must:
     1. Extract all key financial metrics (revenue, net income, EPS, margins, 
        cash flow, debt levels)
-    2. Calculate year-over-year and quarter-over-quarter growth rates where 
-       data is available
+    2. Report year-over-year and quarter-over-quarter growth rates where 
+       data is available, taking metrics, margins and growth rates from the 
+       Financial Metrics Extractor rather than calculating them yourself
     3. Identify significant trends, patterns, or anomalies in the financials
     4. Summarize management commentary and forward guidance
     5. Compare performance against industry benchmarks where possible
@@ -62,7 +62,8 @@ analyze_financial_document = Task(
     All figures must be cited with their source location in the document.""",
     
     agent=financial_analyst,
-    tools=[FinancialDocumentTool.read_data_tool],
+    tools=[FinancialMetricsTool.extract_metrics_tool, DocumentSearchTool.search_document_tool,
+           FinancialDocumentTool.read_data_tool],
     async_execution=False,
     context=[verification]
 )
@@ -114,7 +115,8 @@ investment_analysis = Task(
     All recommendations must reference specific data points from the document.""",
     
     agent=investment_advisor,
-    tools=[FinancialDocumentTool.read_data_tool],
+    ## Downstream stages get the analysis as context and only need targeted lookups
+    tools=[FinancialMetricsTool.extract_metrics_tool, DocumentSearchTool.search_document_tool],
     async_execution=False,
     context=[analyze_financial_document]
 )
@@ -147,7 +149,8 @@ risk_assessment = Task(
     All risk ratings must cite specific figures or disclosures from the document.""",
     
     agent=risk_assessor,
-    tools=[FinancialDocumentTool.read_data_tool],
+    tools=[DocumentSearchTool.search_document_tool],
     async_execution=False,
-    context=[analyze_financial_document, investment_analysis]
+    ## Risk only needs the financial analysis, so it can run alongside investment_analysis
+    context=[analyze_financial_document]
 )
\ No newline at end of file
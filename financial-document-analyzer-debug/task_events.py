@@ -0,0 +1,179 @@
+## Push delivery of task state changes: workers publish to Redis, each API process fans out
+import os
+import json
+import asyncio
+from dotenv import load_dotenv
+load_dotenv()
+
+import redis
+import redis.asyncio as aioredis
+
+from result_store import SUMMARY_FIELDS
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+TASK_EVENTS_CHANNEL = os.getenv("TASK_EVENTS_CHANNEL", "task-events")
+## Idle streams get a keep-alive at this interval so proxies do not close them
+TASK_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("TASK_EVENTS_HEARTBEAT_SECONDS", "15"))
+## Events buffered per connected client; a client that falls further behind loses the oldest
+TASK_EVENTS_CLIENT_BUFFER = int(os.getenv("TASK_EVENTS_CLIENT_BUFFER", "100"))
+## How long a new client waits for the hub's subscription to be confirmed before taking its
+## snapshot anyway (Redis unreachable: events resume on reconnect)
+TASK_EVENTS_SUBSCRIBE_TIMEOUT_SECONDS = float(os.getenv("TASK_EVENTS_SUBSCRIBE_TIMEOUT_SECONDS", "5"))
+
+TERMINAL_STATES = ("SUCCESS", "FAILURE")
+
+_publisher = None
+
+
+def publish_task_event(task_id: str, state: str, **fields):
+    """Publish one state change from a worker; delivery is best-effort and never fails the task"""
+    global _publisher
+    try:
+        if _publisher is None:
+            _publisher = redis.Redis.from_url(REDIS_URL)
+        _publisher.publish(TASK_EVENTS_CHANNEL, json.dumps({"task_id": task_id, "state": state, **fields}, default=str))
+    except redis.RedisError:
+        pass
+
+
+def result_reference(task_id: str, value) -> dict:
+    """
+    Fields of a SUCCESS event: the result's summary and where to fetch it.
+    The payload itself is never broadcast; clients read it from /result/{task_id}.
+    """
+    summary = {name: value[name] for name in SUMMARY_FIELDS if name in value} if isinstance(value, dict) else {}
+    return {"result": summary, "result_url": f"/result/{task_id}"}
+
+
+def snapshot_event(task_id: str) -> dict:
+    """Current state from the result backend, sent once when a client connects (covers missed events)"""
+    from celery.result import AsyncResult
+    from celery_worker import celery_app
+
+    result = AsyncResult(task_id, app=celery_app)
+    state, info = result.state, result.info
+    event = {"task_id": task_id, "state": state}
+    if state == "SUCCESS":
+        event.update(result_reference(task_id, info))
+    elif state == "FAILURE":
+        event["error"] = str(info)
+    elif isinstance(info, dict):
+        event.update({key: info[key] for key in ("status", "progress", "stages") if key in info})
+    return event
+
+
+class TaskEventHub:
+    """
+    One Redis pub/sub subscription per API process, shared by every SSE and
+    WebSocket client of that process. A background listener decodes each
+    event once and hands it to the in-memory queues of the clients watching
+    that task, so Redis load does not grow with the number of clients.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, channel: str = TASK_EVENTS_CHANNEL,
+                 client_buffer: int = TASK_EVENTS_CLIENT_BUFFER):
+        self.redis_url = redis_url
+        self.channel = channel
+        self.client_buffer = client_buffer
+        self._subscribers = {}      ## task id -> set of asyncio.Queue
+        self._listener = None
+        self._subscribed = asyncio.Event()  ## set while the listener's SUBSCRIBE is confirmed
+        self._counters = {"events_received": 0, "events_delivered": 0, "events_dropped": 0, "reconnects": 0}
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        queue = asyncio.Queue(maxsize=self.client_buffer)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(task_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[task_id]
+
+    def _dispatch(self, event: dict):
+        for queue in self._subscribers.get(event.get("task_id"), ()):
+            if queue.full():
+                queue.get_nowait()
+                self._counters["events_dropped"] += 1
+            queue.put_nowait(event)
+            self._counters["events_delivered"] += 1
+
+    async def _listen(self):
+        backoff = 0.5
+        while True:
+            client = aioredis.Redis.from_url(self.redis_url)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    backoff = 0.5
+                    async for message in pubsub.listen():
+                        if message.get("type") == "subscribe":
+                            self._subscribed.set()
+                        if message.get("type") != "message":
+                            continue
+                        self._counters["events_received"] += 1
+                        try:
+                            self._dispatch(json.loads(message["data"]))
+                        except (ValueError, TypeError):
+                            continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                ## Redis restarted or unreachable: clients keep their streams, events resume on reconnect
+                self._counters["reconnects"] += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+            finally:
+                self._subscribed.clear()
+                await client.aclose()
+
+    async def _wait_subscribed(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def events(self, task_id: str, heartbeat: float = TASK_EVENTS_HEARTBEAT_SECONDS,
+                     subscribe_timeout: float = TASK_EVENTS_SUBSCRIBE_TIMEOUT_SECONDS):
+        """
+        Yield the task's current state, then each pushed event until a terminal
+        one; yields None every `heartbeat` seconds without events.
+        """
+        from starlette.concurrency import run_in_threadpool
+
+        ## Take the snapshot only once Redis has confirmed the subscription, so no event falls
+        ## between the two (a freshly started listener has merely sent its SUBSCRIBE)
+        queue = self.subscribe(task_id)
+        try:
+            await self._wait_subscribed(subscribe_timeout)
+            snapshot = await run_in_threadpool(snapshot_event, task_id)
+            yield snapshot
+            if snapshot["state"] in TERMINAL_STATES:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event["state"] in TERMINAL_STATES:
+                    return
+        finally:
+            self.unsubscribe(task_id, queue)
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "watched_tasks": len(self._subscribers),
+            "clients": sum(len(queues) for queues in self._subscribers.values()),
+            "listening": self._listener is not None and not self._listener.done(),
+        }
+
+
+## Process-wide hub used by the streaming endpoints
+task_event_hub = TaskEventHub()
@@ -0,0 +1,43 @@
+## Shared test setup: offline LLM, temp storage and one in-process Redis for every client the app creates
+import os
+import sys
+import tempfile
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+## Module-level settings are read at import, so the environment is fixed before any app module loads
+_WORKDIR = tempfile.mkdtemp(prefix="fda-tests-")
+os.environ.update({
+    "LLM_CACHE_MODE": "fake",
+    "LLM_RATE_LIMIT_BACKEND": "local",
+    "DOC_CACHE_DIR": os.path.join(_WORKDIR, "cache"),
+    "UPLOAD_DIR": os.path.join(_WORKDIR, "uploads"),
+    "RESULT_BLOB_DIR": os.path.join(_WORKDIR, "results"),
+    "CREWAI_DISABLE_TELEMETRY": "true",
+})
+
+
+@pytest.fixture(scope="session")
+def fake_redis():
+    """Point every redis client the app creates at one in-process fakeredis server"""
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+
+    server = fakeredis.FakeServer()
+    original = redis.Redis.from_url
+    redis.Redis.from_url = staticmethod(lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    yield server
+    redis.Redis.from_url = original
+
+
+@pytest.fixture(scope="session")
+def celery_eager(fake_redis):
+    """The Celery app with in-memory broker and result backend, for running tasks with .apply()"""
+    from celery_worker import celery_app
+
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://")
+    celery_app.set_default()
+    return celery_app
@@ -0,0 +1,61 @@
+## Batches: task states read in one round trip, and the combined result only frozen once complete
+import uuid
+
+import pytest
+
+
+def _manifest(batch_id: str, queued_id: str, coalesced_id: str) -> dict:
+    return {
+        "batch_id": batch_id,
+        "query": "Summarize the filing",
+        "documents": [
+            {"index": 0, "filename": "a.pdf", "file_hash": "a", "task_id": queued_id,
+             "duplicate_of": None, "coalesced": False},
+            {"index": 1, "filename": "b.pdf", "file_hash": "b", "task_id": coalesced_id,
+             "duplicate_of": None, "coalesced": True},
+        ],
+        "queued_task_ids": [queued_id],
+    }
+
+
+def test_batch_result_is_stored_only_when_complete(celery_eager):
+    from batches import batch_store
+    from celery_worker import summarize_batch_task
+
+    batch_id, queued_id, coalesced_id = (str(uuid.uuid4()) for _ in range(3))
+    batch_store.save(batch_id, _manifest(batch_id, queued_id, coalesced_id))
+    finished = {"status": "success", "analysis": "Report", "token_usage": {"total_tokens": 10}}
+
+    ## The coalesced document's task (outside the chord) has not finished yet
+    outcome = summarize_batch_task([finished], batch_id)
+    assert outcome["status"] == "pending"
+    assert outcome["summary"]["completed"] == 1
+    assert batch_store.get_result(batch_id) is None
+
+    celery_eager.backend.store_result(coalesced_id, finished, "SUCCESS")
+    outcome = summarize_batch_task([finished], batch_id)
+    assert outcome["status"] == "completed"
+    stored = batch_store.get_result(batch_id)
+    assert stored["complete"] and stored["summary"]["completed"] == 2
+
+
+def test_task_states_are_read_in_one_backend_round_trip(celery_eager, monkeypatch):
+    from batches import _task_states
+
+    backend = celery_eager.backend
+    pending, running, done, failed = (str(uuid.uuid4()) for _ in range(4))
+    backend.store_result(running, {"progress": "40%"}, "PROGRESS")
+    backend.store_result(done, {"status": "success"}, "SUCCESS")
+    backend.store_result(failed, ValueError("broken filing"), "FAILURE")
+
+    calls = []
+    mget = backend.mget
+    monkeypatch.setattr(backend, "mget", lambda keys: calls.append(keys) or mget(keys))
+    monkeypatch.setattr(backend, "get_task_meta", lambda task_id: pytest.fail("per-task lookup"))
+
+    states = _task_states([pending, running, done, failed, done])
+    assert len(calls) == 1 and len(calls[0]) == 4
+    assert states[pending] == ("PENDING", None)
+    assert states[running] == ("PROGRESS", {"progress": "40%"})
+    assert states[done] == ("SUCCESS", {"status": "success"})
+    assert states[failed][0] == "FAILURE" and isinstance(states[failed][1], ValueError)
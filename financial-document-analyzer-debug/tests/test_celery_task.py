@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("crewai")
+
+
+@pytest.fixture
+def filing(tmp_path):
+    from benchmarks.synthetic_pdf import write_synthetic_pdf
+    from doc_cache import file_sha256
+
+    path = write_synthetic_pdf(str(tmp_path / "filing.pdf"), pages=4, seed=11)
+    return path, file_sha256(path)
+
+
+def test_parallel_mode_runs_through_the_celery_task(celery_eager, filing):
+    ## Stage callbacks run on pool threads, where the task's thread-local request has no id
+    from celery_worker import analyze_document_task
+    from result_store import result_store
+    from pipeline import STAGES
+
+    path, file_hash = filing
+    outcome = analyze_document_task.apply(
+        args=["Summarize the quarter", path, file_hash, "parallel"],
+        kwargs={"keep_file": True, "tenant": "tests"},
+        task_id="parallel-job",
+    ).get()
+
+    assert outcome["status"] == "success", outcome.get("error")
+    result = result_store.load(outcome)
+    assert result["execution_mode"] == "parallel"
+    assert sorted(stage["stage"] for stage in result["stages"]) == sorted(STAGES)
+    assert result["analysis"]
+    assert "stage_outputs" not in result
+
+
+def test_versioned_results_keep_only_intermediate_stage_outputs(celery_eager, filing):
+    from celery_worker import analyze_document_task
+    from result_store import result_store, select_section
+    from pipeline import STAGES, terminal_stages
+
+    path, file_hash = filing
+    outcome = analyze_document_task.apply(
+        args=["Assess the risks", path, file_hash, "sequential"],
+        kwargs={"keep_file": True, "tenant": "tests", "document_id": "acme-10q"},
+        task_id="versioned-job",
+    ).get()
+
+    assert outcome["status"] == "success", outcome.get("error")
+    result = result_store.load(outcome)
+    assert sorted(result["stage_outputs"]) == sorted(set(STAGES) - set(terminal_stages()))
+    ## Terminal stages are still selectable, from their heading in the analysis
+    assert select_section(result, "risk")[0] == "risk_assessment"
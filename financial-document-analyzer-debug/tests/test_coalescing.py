@@ -0,0 +1,30 @@
+## Coalescing identity: which submissions count as the same job
+import pytest
+
+from coalescing import coalesce_key
+
+BASE = dict(file_hash="ab" * 32, query="What drove revenue?", execution_mode="sequential",
+            tenant="acme", priority="interactive", document_id=None)
+
+
+def test_queries_differing_only_in_case_and_spacing_are_the_same_job():
+    assert coalesce_key(**BASE) == coalesce_key(**{**BASE, "query": "  what DROVE   revenue? "})
+
+
+@pytest.mark.parametrize("field, value", [
+    ("file_hash", "cd" * 32),
+    ("query", "What drove margins?"),
+    ("execution_mode", "chunked"),
+    ("tenant", "globex"),
+    ("priority", "bulk"),
+    ("document_id", "ACME-10Q-2025Q2"),
+    ("model", "gpt-4o"),
+])
+def test_every_part_of_the_identity_separates_jobs(field, value):
+    assert coalesce_key(**BASE) != coalesce_key(**{**BASE, field: value})
+
+
+def test_fields_cannot_run_into_each_other():
+    ## Moving text across a field boundary must not produce the same identity
+    assert (coalesce_key(**{**BASE, "tenant": "acme", "priority": "interactive"})
+            != coalesce_key(**{**BASE, "tenant": "acmeinter", "priority": "active"}))
@@ -0,0 +1,34 @@
+## Crew pool: checkouts hand out ready clones and the refill runs off the caller's thread
+import threading
+
+
+class Template:
+    def __init__(self, copied: threading.Event, release: threading.Event):
+        self.copied, self.release = copied, release
+
+    def copy(self):
+        self.copied.set()
+        assert self.release.wait(5)
+        return object()
+
+
+def test_checkout_returns_before_the_pool_is_refilled():
+    from crew_pool import CrewPool
+
+    copied, release = threading.Event(), threading.Event()
+    pool = CrewPool(lambda: Template(copied, release), size=1)
+    ready = object()
+    pool._ready.append(ready)
+    pool.template
+
+    ## The refill blocks in copy() until released; the job finishes meanwhile
+    with pool.checkout() as crew:
+        assert crew is ready
+    assert copied.wait(5)
+    assert len(pool._ready) == 0
+
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == "crew-pool-refill":
+            thread.join(5)
+    assert len(pool._ready) == 1
@@ -0,0 +1,61 @@
+## Incremental re-analysis: patched stage outputs stay apart from full runs and chain a bounded number of times
+import random
+
+import pytest
+
+pytest.importorskip("crewai")
+
+QUERY = "Summarize the quarter"
+## Distinct wording per amendment, inserted mid-page: repeated lines and page edges are
+## normalized as headers and footers
+AMENDMENTS = [
+    "Segment revenue was reclassified between automotive and energy storage.",
+    "A lease obligation was corrected upward after the landlord's audit.",
+    "Deferred tax assets were remeasured under the new statutory rate.",
+    "Warranty reserves for prior quarters were restated.",
+]
+
+
+@pytest.fixture
+def versions(tmp_path):
+    """Five versions of an 8-page filing, each amending one more page than the one before"""
+    from benchmarks.synthetic_pdf import build_pdf, page_lines
+    from doc_cache import file_sha256
+
+    rng = random.Random(5)
+    pages = [page_lines(number, rng) for number in range(1, 9)]
+    paths = []
+    for version in range(5):
+        if version:
+            pages[version] = [*pages[version][:5], AMENDMENTS[version - 1], *pages[version][5:]]
+        path = tmp_path / f"filing-v{version}.pdf"
+        path.write_bytes(build_pdf(pages))
+        paths.append(str(path))
+    return [(path, file_sha256(path)) for path in paths]
+
+
+def test_refreshed_outputs_are_kept_apart_and_chain_a_bounded_number_of_times(fake_redis, versions, monkeypatch):
+    import pipeline
+    from pipeline import STAGES, run_pipeline, _stage_key
+    from stage_cache import stage_cache
+
+    monkeypatch.setattr(pipeline, "INCREMENTAL_MAX_CHAINED_UPDATES", 2)
+
+    def analyze(version):
+        path, file_hash = versions[version]
+        run_pipeline(QUERY, path, file_hash, document_id="acme-10q", tenant="incremental-tests")
+        return file_hash
+
+    def stored_updates(file_hash):
+        ## Updates behind each stage's cached output (None when it is not cached)
+        return {name: next((updates for updates in range(4)
+                            if stage_cache.get(_stage_key(file_hash, name, QUERY, updates)) is not None), None)
+                for name in STAGES}
+
+    assert set(stored_updates(analyze(0)).values()) == {0}
+    ## Updated outputs never become the version's full-run entries
+    assert set(stored_updates(analyze(1)).values()) == {1}
+    assert set(stored_updates(analyze(2)).values()) == {2}
+    ## The limit is reached: the next version is analyzed in full again
+    assert set(stored_updates(analyze(3)).values()) == {0}
+    assert set(stored_updates(analyze(4)).values()) == {1}
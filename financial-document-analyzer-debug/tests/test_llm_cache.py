@@ -0,0 +1,76 @@
+## LLM response cache: replay never reaches the network, and the SQLite store evicts least recently used
+import types
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMResponseCache, ReplayMiss, SqliteResponseStore
+
+MODEL = "test-model"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteResponseStore(path=str(tmp_path / "responses.sqlite"))
+
+
+class TickingClock:
+    """Advances one second per reading, so every write and read has its own use time"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = TickingClock()
+    monkeypatch.setattr(llm_cache, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def live_call():
+    raise AssertionError("replay mode must not call the API")
+
+
+def test_replay_miss_raises_without_calling_the_api(store):
+    cache = LLMResponseCache(store=store, mode="replay")
+
+    with pytest.raises(ReplayMiss):
+        cache.complete(MODEL, "What was revenue?", {}, live_call)
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["live_calls"] == 0
+
+
+def test_replay_answers_recorded_calls(store):
+    LLMResponseCache(store=store, mode="record").complete(MODEL, "What was revenue?", {}, lambda: "25 billion")
+    cache = LLMResponseCache(store=store, mode="replay")
+
+    assert cache.complete(MODEL, "What was revenue?", {}, live_call) == "25 billion"
+    ## Parameters are part of the recorded call
+    with pytest.raises(ReplayMiss):
+        cache.complete(MODEL, "What was revenue?", {"temperature": 0.5}, live_call)
+
+
+def test_sqlite_store_evicts_least_recently_used(store, clock):
+    store.max_bytes = 250
+    store.put("a", "x" * 100, ttl=3600)
+    store.put("b", "y" * 100, ttl=3600)
+    ## Reading "a" makes "b" the least recently used entry
+    assert store.get("a") == "x" * 100
+
+    assert store.put("c", "z" * 100, ttl=3600) == 1
+    assert store.get("b") is None
+    assert store.get("a") == "x" * 100
+    assert store.get("c") == "z" * 100
+
+
+def test_sqlite_store_drops_expired_entries(store, clock):
+    store.put("a", "x" * 10, ttl=60)
+    assert store.get("a") == "x" * 10
+
+    clock.now += 60
+    assert store.get("a") is None
@@ -0,0 +1,46 @@
+## PDF parser: page ranges, page order across the parser pool, and no reader kept after parsing
+import gc
+
+import pytest
+
+from pdf_parser import ParallelPdfParser, page_count, page_ranges, parse_page_range
+
+
+@pytest.fixture
+def filing(tmp_path):
+    from benchmarks.synthetic_pdf import write_synthetic_pdf
+    return write_synthetic_pdf(str(tmp_path / "filing.pdf"), pages=30, seed=3)
+
+
+@pytest.mark.parametrize("total, workers", [(1, 4), (7, 2), (30, 4), (100, 3), (16, 4)])
+def test_page_ranges_cover_every_page_once_in_order(total, workers):
+    ranges = page_ranges(total, workers)
+
+    assert [page for start, stop in ranges for page in range(start, stop)] == list(range(total))
+    assert all(stop > start for start, stop in ranges)
+    assert len(ranges) <= workers * 4
+
+
+def test_pool_returns_pages_in_document_order(filing):
+    expected = parse_page_range(filing, 0, page_count(filing))
+    parser = ParallelPdfParser(workers=2, min_pages=1)
+    try:
+        pages = parser.parse(filing)
+    finally:
+        parser.shutdown()
+
+    assert len(pages) == 30
+    assert pages == expected
+    ## Every synthetic page ends with its own number
+    assert [page.rsplit("Page ", 1)[-1] for page in pages] == [str(number) for number in range(1, 31)]
+
+
+def test_no_reader_outlives_a_parse(filing):
+    from pypdf import PdfReader
+
+    ParallelPdfParser(workers=1).parse(filing)
+    page_count(filing)
+    gc.collect()
+
+    ## type(), not isinstance(): lazy import proxies elsewhere in the heap resolve on __class__
+    assert not [obj for obj in gc.get_objects() if type(obj) is PdfReader]
@@ -0,0 +1,119 @@
+## LLM rate limiter: token-bucket refill and waits on a fake clock, and job-budget admission
+import contextlib
+
+import pytest
+
+import rate_limiter
+from rate_limiter import LocalRateLimiter, RedisRateLimiter
+
+MODEL = "test-model"
+
+
+class FakeClock:
+    """Clock whose sleep() only advances time, recording each wait"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Set the test model's (rpm, tpm)"""
+    def set_limits(rpm: int, tpm: int):
+        monkeypatch.setitem(rate_limiter.LLM_RATE_LIMITS, MODEL, {"rpm": rpm, "tpm": tpm})
+    return set_limits
+
+
+def test_requests_wait_for_the_bucket_to_refill(clock, limits):
+    limits(rpm=2, tpm=0)
+    limiter = LocalRateLimiter(clock=clock, sleep=clock.sleep)
+
+    limiter.acquire(MODEL, 100)
+    limiter.acquire(MODEL, 100)
+    assert clock.sleeps == []
+
+    ## Empty bucket: one request refills after 60 / rpm seconds (plus up to 20% jitter)
+    limiter.acquire(MODEL, 100)
+    assert len(clock.sleeps) == 1
+    assert 30 <= clock.sleeps[0] <= 36
+
+
+def test_tokens_wait_only_for_the_missing_share(clock, limits):
+    limits(rpm=0, tpm=600)
+    limiter = LocalRateLimiter(clock=clock, sleep=clock.sleep)
+
+    limiter.acquire(MODEL, 500)
+    ## 100 tokens left; 200 more refill in 200 * 60 / 600 = 20 seconds
+    limiter.acquire(MODEL, 300)
+    assert len(clock.sleeps) == 1
+    assert 20 <= clock.sleeps[0] <= 24
+
+    ## Idle time refills the bucket, never beyond its size
+    clock.now += 3600
+    limiter.acquire(MODEL, 600)
+    assert len(clock.sleeps) == 1
+
+
+def test_settled_reservations_refund_unused_tokens(clock, limits):
+    limits(rpm=0, tpm=600)
+    limiter = LocalRateLimiter(clock=clock, sleep=clock.sleep)
+
+    limiter.acquire(MODEL, 500).settle(100)
+    limiter.acquire(MODEL, 500)
+    assert clock.sleeps == []
+
+
+def test_calls_larger_than_the_bucket_pass_on_a_full_bucket(clock, limits):
+    limits(rpm=0, tpm=600)
+    limiter = LocalRateLimiter(clock=clock, sleep=clock.sleep)
+
+    assert limiter.acquire(MODEL, 5000).tokens == 600
+    assert clock.sleeps == []
+
+
+@pytest.fixture(params=["local", "redis"])
+def job_limiter(request, clock):
+    if request.param == "local":
+        return LocalRateLimiter(clock=clock, sleep=clock.sleep)
+    request.getfixturevalue("fake_redis")
+    pytest.importorskip("lupa")
+    limiter = RedisRateLimiter()
+    limiter.clock, limiter.sleep = clock, clock.sleep
+    return limiter
+
+
+def test_jobs_wait_until_the_budget_has_room(job_limiter, clock, limits, monkeypatch):
+    limits(rpm=0, tpm=600)
+    monkeypatch.setattr(rate_limiter, "LLM_JOB_BUDGET_MINUTES", 2)    ## 1200 tokens of running jobs
+    running = contextlib.ExitStack()
+    running.enter_context(job_limiter.job(MODEL, 800))
+
+    with job_limiter.job(MODEL, 400):
+        ## Fits next to the first job
+        assert clock.sleeps == []
+
+    ## Would exceed the budget: admitted once the first job finishes (here, while it waits)
+    job_limiter.sleep = lambda seconds: (clock.sleep(seconds), running.close())
+    with job_limiter.job(MODEL, 500):
+        assert len(clock.sleeps) == 1
+
+
+def test_a_job_alone_is_admitted_whatever_its_size(job_limiter, clock, limits, monkeypatch):
+    limits(rpm=0, tpm=600)
+    monkeypatch.setattr(rate_limiter, "LLM_JOB_BUDGET_MINUTES", 2)
+
+    with job_limiter.job(MODEL, 10_000):
+        assert clock.sleeps == []
@@ -0,0 +1,56 @@
+## Result store: byte ranges of stored results and sections of an analysis
+import pytest
+
+from result_store import parse_byte_range, select_section
+
+REPORT = """# Analysis of the quarter
+
+## Investment Analysis
+Revenue grew 8%.
+
+### Valuation
+Shares trade at 30x earnings.
+
+## Risk Assessment — Summary
+Leverage is rising.
+"""
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("Bytes = 10-19", (10, 19)),
+])
+def test_single_ranges_are_clamped_to_the_result(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-9", "bytes=0-9,20-29", "bytes=a-b"])
+def test_ranges_the_server_cannot_apply_send_the_whole_result(header):
+    assert parse_byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=50-10"])
+def test_ranges_outside_the_result_are_rejected(header):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, 1000)
+
+
+def test_stage_outputs_answer_before_the_report():
+    result = {"analysis": REPORT, "stage_outputs": {"risk_assessment": "Stage output"}}
+
+    assert select_section(result, "Risk") == ("risk_assessment", "Stage output")
+    assert select_section(result, "risk-assessment") == ("risk_assessment", "Stage output")
+
+
+def test_report_sections_run_until_the_next_heading_of_their_level():
+    result = {"analysis": REPORT}
+
+    name, text = select_section(result, "investment")
+    assert name == "investment_analysis"
+    assert text == "## Investment Analysis\nRevenue grew 8%.\n\n### Valuation\nShares trade at 30x earnings."
+    assert select_section(result, "risk_assessment")[1] == "## Risk Assessment — Summary\nLeverage is rising."
+    assert select_section(result, "liquidity") is None
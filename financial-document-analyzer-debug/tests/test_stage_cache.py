@@ -0,0 +1,103 @@
+## Stage cache: keys and fingerprints, and only stages whose prompts ignore the query are shared between queries
+import pytest
+
+pytest.importorskip("crewai")
+
+
+def _prompt_texts(task) -> list:
+    agent = task.agent
+    return [task._original_description or task.description,
+            task._original_expected_output or task.expected_output,
+            agent._original_role or agent.role, agent._original_goal or agent.goal,
+            agent._original_backstory or agent.backstory]
+
+
+def test_document_only_stages_never_see_the_query():
+    from pipeline import STAGES, DOCUMENT_ONLY_STAGES
+
+    for name, task in STAGES.items():
+        uses_query = any("{query}" in text for text in _prompt_texts(task))
+        assert uses_query == (name not in DOCUMENT_ONLY_STAGES), name
+
+
+def test_a_new_query_reuses_only_query_independent_stages(fake_redis, tmp_path):
+    from benchmarks.synthetic_pdf import write_synthetic_pdf
+    from doc_cache import file_sha256
+    from pipeline import STAGES, DOCUMENT_ONLY_STAGES, run_pipeline
+
+    path = write_synthetic_pdf(str(tmp_path / "filing.pdf"), pages=3, seed=23)
+    file_hash = file_sha256(path)
+
+    def analyze(query):
+        stages = {}
+        run_pipeline(query, path, file_hash,
+                     on_stage=lambda name, output, cached: stages.__setitem__(name, (output, cached)))
+        return stages
+
+    first = analyze("What drove revenue growth?")
+    second = analyze("How leveraged is the balance sheet?")
+
+    assert {name for name, (_, cached) in second.items() if cached} == DOCUMENT_ONLY_STAGES
+    for name in DOCUMENT_ONLY_STAGES:
+        assert second[name][0] == first[name][0]
+    assert set(second) == set(STAGES)
+    ## The same query again reuses everything
+    assert all(cached for _, cached in analyze("how leveraged is the  balance sheet?").values())
+
+
+def test_a_stage_without_explicit_context_depends_on_every_earlier_stage(fake_redis, tmp_path):
+    from crewai.utilities.constants import NOT_SPECIFIED
+    from benchmarks.synthetic_pdf import write_synthetic_pdf
+    from doc_cache import file_sha256
+    from pipeline import STAGES, crew_pool, run_pipeline, _run_crew, _stage_key
+    from stage_cache import stage_cache
+
+    query = "Summarize the quarter"
+    path = write_synthetic_pdf(str(tmp_path / "filing.pdf"), pages=3, seed=29)
+    file_hash = file_sha256(path)
+    run_pipeline(query, path, file_hash)
+    stage_cache.client.delete(_stage_key(file_hash, "verification", query))
+
+    stages = {}
+    with crew_pool.checkout() as crew:
+        ## Sequential semantics: the last stage now consumes everything before it
+        crew.tasks[-1].context = NOT_SPECIFIED
+        _run_crew(crew, query, path, file_hash,
+                  on_stage=lambda name, output, cached: stages.__setitem__(name, cached))
+
+    assert stages == {name: False for name in STAGES}
+
+
+def test_the_key_carries_the_query_only_when_given_and_normalized():
+    from stage_cache import StageCache
+
+    cache = StageCache()
+    fingerprint = "f" * 64
+    shared = cache.key("doc", "verification", fingerprint, "model")
+    asked = cache.key("doc", "investment_analysis", fingerprint, "model", "What drove  Revenue?")
+
+    assert shared == f"stage:doc:verification:{'f' * 24}:model"
+    assert asked == cache.key("doc", "investment_analysis", fingerprint, "model", "what drove revenue?")
+    assert asked != cache.key("doc", "investment_analysis", fingerprint, "model", "What drove margins?")
+    assert asked != cache.key("doc", "investment_analysis", fingerprint, "other-model", "What drove revenue?")
+
+
+def test_editing_a_prompt_changes_its_fingerprint_and_every_downstream_one():
+    from pipeline import STAGES, STAGE_FINGERPRINTS, crew_pool
+    from stage_cache import task_fingerprint
+
+    def fingerprints_after(stage, **prompt):
+        ## Edit a copy: the module-level templates back STAGE_FINGERPRINTS
+        crew = crew_pool.template.copy()
+        tasks = dict(zip(STAGES, crew.tasks))
+        for field, text in prompt.items():
+            setattr(tasks[stage], field, text)
+        return {name: task_fingerprint(task) for name, task in tasks.items()}
+
+    assert fingerprints_after("verification") == STAGE_FINGERPRINTS
+    ## analyze_financial_document feeds both the investment and the risk stage
+    edited = fingerprints_after("analyze_financial_document", _original_description="Reworded")
+    changed = {name for name in STAGES if edited[name] != STAGE_FINGERPRINTS[name]}
+    assert changed == {"analyze_financial_document", "investment_analysis", "risk_assessment"}
+    edited = fingerprints_after("risk_assessment", _original_expected_output="Reworded")
+    assert {name for name in STAGES if edited[name] != STAGE_FINGERPRINTS[name]} == {"risk_assessment"}
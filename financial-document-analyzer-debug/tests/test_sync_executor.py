@@ -0,0 +1,24 @@
+## Sync executor: a request waiting for a worker slot is turned away once its queue wait runs out
+import asyncio
+
+import pytest
+
+
+def test_waiting_for_a_slot_is_bounded():
+    from sync_executor import BoundedCrewExecutor, ExecutorSaturated
+
+    executor = BoundedCrewExecutor(max_workers=1, queue_timeout=0.1, start_method="spawn")
+
+    async def wait_behind_a_running_job():
+        ## Stand-in for a job that holds the only slot for longer than the queue wait
+        await executor._workers.acquire()
+        try:
+            async with executor.admit():
+                await executor.run(print, "never started")
+        finally:
+            executor._workers.release()
+
+    with pytest.raises(ExecutorSaturated):
+        asyncio.run(wait_behind_a_running_job())
+    assert executor.stats()["rejected"] == 1
+    assert executor.stats()["running"] == 0
@@ -0,0 +1,48 @@
+## Task event hub: no event lost between the snapshot and the subscription, results sent as a pointer
+import asyncio
+import uuid
+
+
+def test_final_event_right_after_connect_carries_only_the_pointer(celery_eager, fake_redis, monkeypatch):
+    import fakeredis
+    import redis.asyncio as aioredis
+    import task_events
+    from celery_worker import _publish_final_state
+    from result_store import result_store
+    from task_events import TaskEventHub
+
+    monkeypatch.setattr(aioredis.Redis, "from_url",
+                        staticmethod(lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=fake_redis, **kwargs)))
+    subscribe = aioredis.client.PubSub.subscribe
+
+    async def slow_subscribe(pubsub, *args, **kwargs):
+        ## A network round-trip to a real Redis, during which the listener is not yet subscribed
+        await asyncio.sleep(0.2)
+        return await subscribe(pubsub, *args, **kwargs)
+
+    monkeypatch.setattr(aioredis.client.PubSub, "subscribe", slow_subscribe)
+    task_id = str(uuid.uuid4())
+    pointer = result_store.save(task_id, {"status": "success", "query": "q", "analysis": "x" * 1000})
+
+    def snapshot_then_finish(task_id):
+        ## The task finishes while the client is reading its snapshot: the event must still arrive
+        snapshot = {"task_id": task_id, "state": "PENDING"}
+        _publish_final_state(task_id=task_id, state="SUCCESS", retval=pointer)
+        return snapshot
+
+    monkeypatch.setattr(task_events, "snapshot_event", snapshot_then_finish)
+
+    async def watch():
+        hub = TaskEventHub()
+        stream = hub.events(task_id, heartbeat=2, subscribe_timeout=2)
+        try:
+            return await stream.__anext__(), await stream.__anext__()
+        finally:
+            await stream.aclose()
+            hub._listener.cancel()
+
+    snapshot, final = asyncio.run(watch())
+    assert snapshot["state"] == "PENDING"
+    assert final is not None and final["state"] == "SUCCESS"
+    assert final["result"] == {"status": "success", "query": "q"}
+    assert final["result_url"] == f"/result/{task_id}"
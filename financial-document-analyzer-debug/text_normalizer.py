@@ -0,0 +1,135 @@
+## Linear-time text normalization shared by all document tools
+import re
+from collections import Counter
+from itertools import chain, islice
+
+## Lines that only carry a page number: "12", "- 12 -", "Page 12", "Page 12 of 40", "12/40"
+_PAGE_NUMBER_LINE = re.compile(r"^(?:page\s+)?[-–—\s]*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?[-–—\s]*$", re.IGNORECASE)
+_DIGITS = re.compile(r"\d+")
+
+## Headings that open a section, e.g. "Item 1A. Risk Factors" or an all-caps "LIQUIDITY"
+_HEADING = re.compile(r"^[ \t]*((?:(?:ITEM|Item)\s+\d+[A-Za-z]?\.?\s+)?[A-Z][A-Za-z0-9&,'()\- ]{2,80}?)[ \t]*$",
+                      re.MULTILINE)
+
+## How many leading/trailing lines of a page are considered header/footer candidates
+_EDGE_LINES = 2
+
+
+def _normalized_lines(text: str) -> list:
+    """
+    Split text into lines with every whitespace run collapsed to one space and
+    blank lines dropped. `str.split()` does the per-line work in C, so the
+    whole pass is linear in the input size.
+    """
+    return [line for line in (" ".join(raw.split()) for raw in text.split("\n")) if line]
+
+
+def _join_hyphenated(text: str) -> str:
+    """Join words broken across a line end: "fin-\\nancial" -> "financial" """
+    parts = text.split("-\n")
+    if len(parts) == 1:
+        return text
+    out = [parts[0]]
+    for part in parts[1:]:
+        previous = out[-1]
+        if previous and previous[-1].isalnum() and part[:1].islower():
+            out.append(part)
+        else:
+            out.append("-\n")
+            out.append(part)
+    return "".join(out)
+
+
+def normalize_text(text: str, dehyphenate: bool = True) -> str:
+    """
+    Normalize a single chunk of text in linear time: collapse whitespace runs,
+    collapse blank lines and join hyphenated line breaks.
+    """
+    if not text:
+        return ""
+    text = "\n".join(_normalized_lines(text))
+    return _join_hyphenated(text) if dehyphenate else text
+
+
+def _edge_signature(line: str) -> str:
+    """Page numbers differ from page to page, so compare edge lines with digits masked"""
+    return _DIGITS.sub("#", line.lower())
+
+
+def _edge_lines(lines: list):
+    """Header/footer candidates of a page, tagged by position; short pages have none"""
+    if len(lines) <= 2 * _EDGE_LINES:
+        return set()
+    top = {("top", _edge_signature(line)) for line in lines[:_EDGE_LINES]}
+    bottom = {("bottom", _edge_signature(line)) for line in lines[-_EDGE_LINES:]}
+    return top | bottom
+
+
+def detect_boilerplate(pages, min_pages: int = 3, min_ratio: float = 0.5) -> frozenset:
+    """
+    Learn running headers/footers from a sample of pages (each a list of
+    normalized lines): an edge line that repeats on most pages is boilerplate.
+    """
+    pages = [lines for lines in pages if lines]
+    if len(pages) < min_pages:
+        return frozenset()
+    counts = Counter(chain.from_iterable(_edge_lines(lines) for lines in pages))
+    threshold = max(min_pages, int(len(pages) * min_ratio))
+    return frozenset(signature for signature, count in counts.items() if count >= threshold)
+
+
+def strip_boilerplate(lines: list, boilerplate: frozenset = frozenset()) -> list:
+    """Remove header/footer and page-number lines from the top and bottom of a page"""
+    start, end = 0, len(lines)
+
+    def is_boilerplate(line: str, position: str) -> bool:
+        return bool(_PAGE_NUMBER_LINE.match(line)) or (position, _edge_signature(line)) in boilerplate
+
+    while start < end and start < _EDGE_LINES and is_boilerplate(lines[start], "top"):
+        start += 1
+    while end > start and len(lines) - end < _EDGE_LINES and is_boilerplate(lines[end - 1], "bottom"):
+        end -= 1
+    return lines[start:end]
+
+
+def _finish_page(lines: list, dehyphenate: bool) -> str:
+    text = "\n".join(lines)
+    return _join_hyphenated(text) if dehyphenate else text
+
+
+def iter_normalized_pages(pages, strip_headers: bool = True, dehyphenate: bool = True, sample_pages: int = 8):
+    """
+    Stream normalized pages one at a time.
+
+    Header/footer detection only needs a small look-ahead window: the first
+    `sample_pages` pages are buffered to learn the running boilerplate and
+    every page after that is normalized and yielded immediately.
+    """
+    pages = iter(pages)
+    if not strip_headers:
+        for page in pages:
+            yield normalize_text(page, dehyphenate=dehyphenate)
+        return
+
+    window = [_normalized_lines(page) for page in islice(pages, sample_pages)]
+    boilerplate = detect_boilerplate(window)
+    for lines in window:
+        yield _finish_page(strip_boilerplate(lines, boilerplate), dehyphenate)
+    for page in pages:
+        yield _finish_page(strip_boilerplate(_normalized_lines(page), boilerplate), dehyphenate)
+
+
+def normalize_pages(pages, strip_headers: bool = True) -> str:
+    """Normalize every page and join the document once"""
+    return "".join(f"{page}\n" for page in iter_normalized_pages(pages, strip_headers=strip_headers))
+
+
+def find_headings(text: str):
+    """Offsets and titles of heading-like lines, used to label and split text by section"""
+    starts, titles = [], []
+    for match in _HEADING.finditer(text):
+        title = match.group(1)
+        if len(title.split()) <= 8 and not title.endswith("."):
+            starts.append(match.start(1))
+            titles.append(title)
+    return starts, titles
@@ -5,15 +5,59 @@ load_dotenv()
 
 from crewai_tools import SerperDevTool
 from crewai.tools import tool
-from langchain_community.document_loaders import PyPDFLoader
+
+from doc_cache import document_cache
+from pdf_parser import pdf_parser, iter_pages as iter_pdf_pages
+from text_normalizer import iter_normalized_pages, normalize_text
+from risk_scanner import get_risk_scanner
+from retrieval_index import retrieval_index_store, RETRIEVAL_TOP_K
+from financial_tables import metrics_report
+from tracing import traced, start_span, set_attributes
 
 ## Creating search tool
 search_tool = SerperDevTool()
 
+## Character budget of document text InvestmentTool hands to the agent when reading from a file
+INVESTMENT_TOOL_MAX_CHARS = int(os.getenv("INVESTMENT_TOOL_MAX_CHARS", "24000"))
+
+@traced("pdf.parse")
+def _load_pdf_pages(path: str) -> list:
+    """Parse a PDF into a list of page texts; large documents are split across parser processes"""
+    pages = pdf_parser.parse(path)
+    set_attributes({"document.pages": len(pages)})
+    return pages
+
+
+def load_document_pages(path: str) -> list:
+    """Normalized page texts of a PDF, parsed through the shared document cache"""
+    ## A "pdf.parse" child span means the document cache missed
+    with start_span("document.load", {"document.path": os.path.basename(path)}) as span:
+        pages = list(iter_normalized_pages(document_cache.get_or_parse(path, _load_pdf_pages)))
+        set_attributes({"document.pages": len(pages), "document.chars": sum(len(page) for page in pages)}, span)
+        return pages
+
+
+def iter_document_pages(path: str):
+    """
+    Lazily yield normalized pages. Cached documents stream from the parsed-text
+    cache; otherwise pages are extracted one at a time from the memory-mapped
+    PDF, so consumers that stop early never parse the rest of the file.
+    """
+    cached = document_cache.get(document_cache.file_hash(path))
+    yield from iter_normalized_pages(cached if cached is not None else iter_pdf_pages(path))
+
+
+@traced("retrieval.index")
+def load_document_index(path: str):
+    """Retrieval index of a PDF, built once per document and persisted next to the parsed-text cache"""
+    return retrieval_index_store.get_or_build(path, load_document_pages)
+
+
 ## Creating custom pdf reader tool
 class FinancialDocumentTool():
     @staticmethod
     @tool("Finalcial Document Reader")
+    @traced("tool.read_document")
     def read_data_tool(path : str ='data/TSLA-Q2-2025-Update.pdf') -> str:
         """Tool to read data from a pdf file from a path
 
@@ -24,50 +68,100 @@ class FinancialDocumentTool():
             str: Full Financial Document file
         """
         try:
-            loader = PyPDFLoader(file_path=path)
-            docs = loader.load()
-            full_report = ""
-        
-            for data in docs:
-              # Clean and format the financial document data
-              content = data.page_content
-            
-              # Remove extra whitespaces and format properly
-              while "\n\n" in content:
-                 content = content.replace("\n\n", "\n")
-                
-              full_report += content + "\n"
-            
+            ## Parsed pages are cached by file hash, so repeat reads skip PDF parsing.
+            # Clean and format the financial document data in one linear pass per page,
+            # then join the report once
+            full_report = "".join(f"{page}\n" for page in load_document_pages(path))
             return full_report
         except Exception as e:
             return f"Error reading PDF: {str(e)}"
-        
+
+
+## Creating document search tool
+class DocumentSearchTool():
+    @staticmethod
+    @tool("Financial Document Search")
+    @traced("tool.search_document")
+    def search_document_tool(query: str, path: str = 'data/TSLA-Q2-2025-Update.pdf', top_k: int = RETRIEVAL_TOP_K) -> str:
+        """Search a financial pdf for the passages most relevant to a question, e.g.
+        "total revenue Q2 2025" or "liquidity and debt covenants". Much cheaper than
+        reading the full document; run several focused searches instead of one broad one.
+
+        Args:
+            query (str): What to look for (metrics, periods, topics).
+            path (str, optional): Path of the pdf file. Defaults to 'data/TSLA-Q2-2025-Update.pdf'.
+            top_k (int, optional): Number of passages to return.
+
+        Returns:
+            str: Top passages, each labeled with its page number and section
+        """
+        try:
+            hits = load_document_index(path).search(query, top_k=max(1, min(int(top_k), 20)))
+        except Exception as e:
+            return f"Error searching PDF: {str(e)}"
+        if not hits:
+            return f"No passages found for '{query}'"
+        return "\n\n".join(
+            f"[page {hit.page} | section: {hit.section or 'n/a'}]\n{hit.text}" for hit in hits
+        )
+
+## Creating financial metrics tool
+class FinancialMetricsTool():
+    @staticmethod
+    @tool("Financial Metrics Extractor")
+    @traced("tool.extract_metrics")
+    def extract_metrics_tool(path: str = 'data/TSLA-Q2-2025-Update.pdf') -> str:
+        """Extract the financial tables of a pdf and return its key metrics (revenue,
+        profit, EPS, cash flow), margins and YoY/QoQ growth rates, computed
+        deterministically from the reported figures. Use these numbers instead of
+        recalculating them.
+
+        Args:
+            path (str, optional): Path of the pdf file. Defaults to 'data/TSLA-Q2-2025-Update.pdf'.
+
+        Returns:
+            str: Compact metrics, margin and growth tables with source pages
+        """
+        try:
+            return metrics_report(load_document_pages(path))
+        except Exception as e:
+            return f"Error extracting metrics: {str(e)}"
+
 ## Creating Investment Analysis Tool
 class InvestmentTool:
     @staticmethod
     @tool("Investment Analyzer")
-    def analyze_investment_tool(financial_document_data: str) -> str:
+    @traced("tool.investment_analyzer")
+    def analyze_investment_tool(financial_document_data: str = "", path: str = "") -> str:
         """Analyzes financial document data and structures it for investment analysis.
         Args:
-            financial_document_data (str): Raw financial document text content.
+            financial_document_data (str, optional): Raw financial document text content.
+            path (str, optional): Path of a pdf file to read instead; pages are streamed and
+                reading stops once enough figure-bearing text is collected.
         Returns:
             str: Structured investment analysis prompt with key financial metrics.
         """
 
-        if not financial_document_data:
+        if path:
+            # Stream pages and keep those carrying figures until the budget is used up
+            selected, used = [], 0
+            try:
+                for page in iter_document_pages(path):
+                    if not any(char.isdigit() for char in page):
+                        continue
+                    selected.append(page[:INVESTMENT_TOOL_MAX_CHARS - used])
+                    used += len(selected[-1])
+                    if used >= INVESTMENT_TOOL_MAX_CHARS:
+                        break
+            except Exception as e:
+                return f"Error reading PDF: {str(e)}"
+            processed_data = "\n".join(selected)
+        elif financial_document_data:
+            # Clean up the data format (whitespace runs, blank lines, hyphenation)
+            processed_data = normalize_text(financial_document_data)
+        else:
             return "No financial data provided"
-        # Process and analyze the financial document data
-        processed_data = financial_document_data
-        
-        # Clean up the data format
-        i = 0
-        while i < len(processed_data):
-            if processed_data[i:i+2] == "  ":  # Remove double spaces
-                processed_data = processed_data[:i] + processed_data[i+1:]
-            else:
-                i += 1
-                
-    
+
         # structure the output for the agent
         analysis_prompt = f"""
             From the following financial document data, extract:
@@ -87,36 +181,46 @@ class RiskTool:
 
     @staticmethod
     @tool("Risk Assessor")
-    def create_risk_assessment_tool(financial_document_data: str) -> str: 
+    @traced("tool.risk_assessor")
+    def create_risk_assessment_tool(financial_document_data: str = "", path: str = "") -> str: 
         """Extracts risk-related sections from financial document data for risk assessment.
         Args:
-            financial_document_data (str): Raw financial document text content.
+            financial_document_data (str, optional): Raw financial document text content.
+            path (str, optional): Path of a pdf file to scan instead; pages are streamed and
+                the scan stops once every risk category has enough evidence.
         Returns:
             str: Structured risk assessment prompt with identified risk factors.
         """ 
 
-        if not financial_document_data:
+        scanner = get_risk_scanner()
+        if path:
+            # Scan page by page; only counts and the best passages are kept in memory
+            try:
+                result = scanner.scan_pages(iter_document_pages(path))
+            except Exception as e:
+                return f"Error reading PDF: {str(e)}"
+        elif financial_document_data:
+            # Scan the document once with the compiled risk taxonomy
+            result = scanner.scan_pages([financial_document_data], early_stop_mentions=0)
+        else:
             return "No financial data provided for risk assessment"
 
-        #Extract risk-related keywords and sections
-        risk_keywords = [
-            "risk", "uncertainty", "decline", "loss", "debt",
-            "liability", "lawsuit", "competition", "regulation",
-            "inflation", "interest rate", "default", "warning"
-        ]    
-
-        lines = financial_document_data.split("\n")
-        risk_relevant_lines = []
-
-        for line in lines:
-            line_lower = line.lower()  
-            if any(keyword in line_lower for keyword in risk_keywords):
-                risk_relevant_lines.append(line.strip())
-
-        if not risk_relevant_lines:
+        if not result.passages:
+            category_summary = "None"
             risk_section = "No explicit risk factors found in document"
         else:
-            risk_section = "\n".join(risk_relevant_lines)            
+            category_summary = ", ".join(
+                f"{category} ({count} mentions)"
+                for category, count in sorted(result.category_counts.items(), key=lambda item: -item[1])
+            )
+            if result.stopped_early:
+                category_summary += f" — scan stopped after page {result.pages_scanned} with sufficient evidence"
+            risk_section = "\n\n".join(
+                f"[{' / '.join(p.categories)} | section: {p.section or 'n/a'} | "
+                + (f"page {p.page}]" if path else f"chars {p.start}-{p.end}]")
+                + f"\n{p.text}"
+                for p in result.passages
+            )
 
         # Structure output for the risk assessor agent
         risk_prompt = f"""
@@ -127,10 +231,10 @@ class RiskTool:
         4. Regulatory and legal risks
         5. Overall risk rating: Low / Medium / High
 
-            Risk-relevant sections found:
-            {risk_section}
+            Risk categories detected:
+            {category_summary}
 
-            Full document context:
-            {financial_document_data[:2000]}
+            Ranked risk passages (with surrounding context):
+            {risk_section}
         """
-        return risk_prompt
\ No newline at end of file
+        return risk_prompt
@@ -0,0 +1,201 @@
+## OpenTelemetry tracing: one trace per job, from the HTTP request across Celery into crew stages, tools and LLM calls
+import os
+import inspect
+import functools
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+from opentelemetry import trace, propagate, context as otel_context
+from opentelemetry.trace import Status, StatusCode
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+## "none" (default) records nothing and costs next to nothing; "otlp" ships spans to
+## OTEL_EXPORTER_OTLP_ENDPOINT; "file" appends one JSON span per line for offline analysis;
+## "console" prints them
+TRACING_EXPORTERS = ("none", "otlp", "file", "console")
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+## "http/protobuf" survives the prefork pool; gRPC channels must not cross a fork
+TRACING_OTLP_PROTOCOL = os.getenv("TRACING_OTLP_PROTOCOL", "http/protobuf")
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "data/traces.jsonl")
+## Fraction of new traces kept; jobs follow the decision of the request that queued them
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "financial-document-analyzer")
+
+## Replaced by the provider's tracer in setup_tracing(); until then every span is a no-op
+_tracer = trace.NoOpTracer()
+_provider = None
+_setup_lock = threading.Lock()
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends finished spans to a JSON-lines file, one span per line"""
+
+    def __init__(self, path: str = TRACING_FILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+        except OSError:
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+
+def _exporter(exporter: str):
+    if exporter == "otlp":
+        if TRACING_OTLP_PROTOCOL == "grpc":
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        else:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if exporter == "file":
+        return FileSpanExporter()
+    if exporter == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter()
+    raise ValueError(f"Unknown tracing exporter '{exporter}', expected one of {TRACING_EXPORTERS}")
+
+
+def setup_tracing(component: str, exporter: str = TRACING_EXPORTER):
+    """
+    Install the tracer provider for this process (`component` is "api" or
+    "worker" and ends up in the service name). Safe to call more than once;
+    with TRACING_EXPORTER=none nothing is installed and every span is a no-op.
+    """
+    global _provider, _tracer
+    with _setup_lock:
+        if exporter == "none" or _provider is not None:
+            return _provider
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": f"{SERVICE_NAME}-{component}"}),
+            sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)),
+        )
+        provider.add_span_processor(BatchSpanProcessor(_exporter(exporter)))
+        ## Not installed as the global provider: crewai claims that one for its own telemetry
+        ## when it is imported, and this app's spans must not end up in it
+        _tracer = provider.get_tracer("financial-document-analyzer")
+        _instrument_crew_tasks()
+        _provider = provider
+        return provider
+
+
+def flush_tracing(timeout_millis: int = 5000):
+    """Export buffered spans now; for processes that exit without running atexit hooks"""
+    if _provider is not None:
+        _provider.force_flush(timeout_millis)
+
+
+def start_span(name: str, attributes: dict = None, context=None, kind=trace.SpanKind.INTERNAL):
+    """Context manager: a span that is current until the block ends (children nest under it)"""
+    return _tracer.start_as_current_span(name, context=context, kind=kind, attributes=attributes)
+
+
+def open_span(name: str, attributes: dict = None, context=None, kind=trace.SpanKind.INTERNAL) -> tuple:
+    """
+    Start a span and make it current on this thread until close_span(); for
+    spans that begin and end in separate callbacks (Celery signals, crew events)
+    """
+    span = _tracer.start_span(name, context=context, kind=kind, attributes=attributes)
+    return span, otel_context.attach(trace.set_span_in_context(span))
+
+
+def close_span(opened: tuple, error: str = None):
+    span, token = opened
+    if error is not None:
+        span.set_status(Status(StatusCode.ERROR, error))
+    otel_context.detach(token)
+    span.end()
+
+
+def inject_context(carrier: dict = None) -> dict:
+    """Current trace context as W3C headers (`traceparent`, `tracestate`)"""
+    carrier = {} if carrier is None else carrier
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract_context(carrier: dict):
+    return propagate.extract(carrier or {})
+
+
+def in_current_context(fn):
+    """Wrap `fn` to run in the caller's trace context; thread pools do not carry it over"""
+    captured = otel_context.get_current()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = otel_context.attach(captured)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            otel_context.detach(token)
+    return run
+
+
+def set_attributes(attributes: dict, span=None):
+    """Set attributes on `span` (default: the current span), skipping None values"""
+    span = span or trace.get_current_span()
+    if span.is_recording():
+        span.set_attributes({name: value for name, value in attributes.items() if value is not None})
+
+
+def traced(name: str):
+    """Run the decorated function (or coroutine) in a span; string results record their length"""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                with start_span(name):
+                    return await fn(*args, **kwargs)
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with start_span(name) as span:
+                result = fn(*args, **kwargs)
+                if isinstance(result, str):
+                    set_attributes({"output.chars": len(result)}, span)
+                return result
+        return run
+    return decorate
+
+
+## Crew tasks: crewai emits started/completed events on the thread that runs the task, so a
+## span opened on "started" is the parent of the agent's LLM and tool calls until "completed"
+_task_spans = {}
+
+
+def _task_started(source, event):
+    task = event.task
+    _task_spans[id(task)] = open_span("crew.task", {
+        "crew.stage": task.name or "",
+        "crew.agent": getattr(task.agent, "role", "") or "",
+    })
+
+
+def _task_finished(source, event):
+    opened = _task_spans.pop(id(event.task), None)
+    if opened is None:
+        return
+    output = getattr(event, "output", None)
+    if output is not None:
+        set_attributes({"output.chars": len(output.raw or "")}, opened[0])
+    close_span(opened, getattr(event, "error", None))
+
+
+def _instrument_crew_tasks():
+    from crewai.utilities.events import crewai_event_bus, TaskStartedEvent, TaskCompletedEvent, TaskFailedEvent
+    crewai_event_bus.register_handler(TaskStartedEvent, _task_started)
+    crewai_event_bus.register_handler(TaskCompletedEvent, _task_finished)
+    crewai_event_bus.register_handler(TaskFailedEvent, _task_finished)
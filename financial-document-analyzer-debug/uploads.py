@@ -0,0 +1,124 @@
+## Streaming upload-to-disk helpers for the API
+import os
+import uuid
+import hashlib
+from typing import NamedTuple
+from dotenv import load_dotenv
+load_dotenv()
+
+from fastapi import UploadFile, HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from tracing import traced, set_attributes
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+## Directory batch requests may reference server-side files from (relative paths resolve inside it)
+BATCH_INPUT_DIR = os.getenv("BATCH_INPUT_DIR", "data/batch_inputs")
+
+PDF_MAGIC = b"%PDF-"
+
+
+class SavedUpload(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+
+
+def _validate_first_chunk(filename: str, chunk: bytes):
+    """Reject non-PDF uploads before any byte is written to disk"""
+    if not filename or not filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    if not chunk:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    ## PDF spec allows up to 1024 bytes of junk before the header
+    if PDF_MAGIC not in chunk[:1024]:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a valid PDF (missing %PDF- header)")
+
+
+def _too_large():
+    return HTTPException(
+        status_code=413,
+        detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+    )
+
+
+@traced("upload.save")
+async def save_upload(file: UploadFile, upload_dir: str = UPLOAD_DIR,
+                      max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = UPLOAD_CHUNK_BYTES) -> SavedUpload:
+    """
+    Stream an upload to disk in fixed-size chunks.
+
+    - Extension, PDF magic bytes and the size limit are checked on the first
+      chunk, before the destination file is created.
+    - Blocking file writes run in the threadpool so the event loop stays free.
+    - The SHA-256 is computed incrementally while writing, so later stages
+      (document cache, job coalescing) never re-read the file to hash it.
+    - Data goes to a `.part` file that is renamed only once the upload is complete.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large()
+
+    first_chunk = await file.read(chunk_size)
+    _validate_first_chunk(file.filename, first_chunk)
+
+    os.makedirs(upload_dir, exist_ok=True)
+    file_path = os.path.join(upload_dir, f"financial_document_{uuid.uuid4()}.pdf")
+    part_path = f"{file_path}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    out = await run_in_threadpool(open, part_path, "wb")
+    try:
+        chunk = first_chunk
+        while chunk:
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large()
+            digest.update(chunk)
+            await run_in_threadpool(out.write, chunk)
+            chunk = await file.read(chunk_size)
+        await run_in_threadpool(out.close)
+        os.replace(part_path, file_path)
+    except BaseException:
+        out.close()
+        if os.path.exists(part_path):
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+        raise
+
+    set_attributes({"document.bytes": size, "document.sha256": digest.hexdigest()})
+    return SavedUpload(path=file_path, sha256=digest.hexdigest(), size=size)
+
+
+def _hash_server_file(path: str, max_bytes: int, chunk_size: int) -> SavedUpload:
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        raise _too_large()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        first_chunk = f.read(chunk_size)
+        _validate_first_chunk(path, first_chunk)
+        digest.update(first_chunk)
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return SavedUpload(path=path, sha256=digest.hexdigest(), size=size)
+
+
+async def open_server_file(path: str, input_dir: str = BATCH_INPUT_DIR,
+                           max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = UPLOAD_CHUNK_BYTES) -> SavedUpload:
+    """
+    Validate and hash a PDF already on the server, without copying it.
+    Only files inside `input_dir` are accepted, so a request cannot read
+    arbitrary paths; the file is never deleted by the worker.
+    """
+    root = os.path.realpath(input_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise HTTPException(status_code=400, detail=f"Path '{path}' is outside the batch input directory")
+    if not os.path.isfile(resolved):
+        raise HTTPException(status_code=404, detail=f"File '{path}' not found in the batch input directory")
+    return await run_in_threadpool(_hash_server_file, resolved, max_bytes, chunk_size)